@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class CompanyConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'company'
+
+    def ready(self):
+        from core.versioning import register_versioned_models
+        from .models import CompanyInfo
+
+        register_versioned_models('company', CompanyInfo)
@@ -3,7 +3,11 @@ from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from .models import CompanyInfo
 from .serializers import CompanyInfoSerializer
+from django.utils.decorators import method_decorator
+from core.caching import cache_response
+from core.conditional import condition_on_version
 
+@method_decorator(condition_on_version('company'), name='dispatch')
 class CompanyInfoView(generics.RetrieveAPIView):
     """
     Get company information. Since there should only be one company info record,
@@ -14,6 +18,8 @@ class CompanyInfoView(generics.RetrieveAPIView):
     def get_object(self):
         return CompanyInfo.objects.first()
 
+@condition_on_version('company')
+@cache_response('company')
 @api_view(['GET'])
 def company_info(request):
     """
@@ -1,3 +1,31 @@
-from django.test import TestCase
+from django.core import mail
+from django.test import TestCase, override_settings
 
-# Create your tests here.
+from core.models import OutboxMessage
+from core.outbox import deliver_due
+from .models import ContactSubmission
+
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    OWNER_EMAIL='owner@example.com',
+)
+class ContactFormTestCase(TestCase):
+    def test_submission_queues_emails(self):
+        response = self.client.post('/api/contact/submit/', {
+            'name': 'Test User',
+            'email': 'customer@example.com',
+            'subject': 'quote',
+            'message': 'Please quote a pump.',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(ContactSubmission.objects.count(), 1)
+        # Nothing is sent while the request is handled
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(
+            sorted(address for to in OutboxMessage.objects.values_list('to', flat=True) for address in to),
+            ['customer@example.com', 'owner@example.com']
+        )
+
+        self.assertEqual(deliver_due(), (2, 0))
+        self.assertEqual(len(mail.outbox), 2)
@@ -1,31 +1,35 @@
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from django.core.mail import send_mail
 from django.conf import settings
+from django.db import transaction
 from django.template.loader import render_to_string
 from django.views.decorators.csrf import csrf_exempt
 from .models import ContactSubmission
 from .serializers import ContactSubmissionSerializer
 from company.models import CompanyInfo
+from core.outbox import queue_mail
 
 @api_view(['POST'])
 def submit_contact_form(request):
     """
-    Submit a contact form and send email notification
+    Submit a contact form and queue the email notifications
     """
     serializer = ContactSubmissionSerializer(data=request.data)
     
     if serializer.is_valid():
-        # Save the submission to database
-        submission = serializer.save()
-        
-        # Prepare email content
-        subject_dict = dict(ContactSubmission.SUBJECT_CHOICES)
-        email_subject = f"New Contact Form Submission - {subject_dict.get(submission.subject, 'General Inquiry')}"
-        
-        # Email content
-        email_body = f"""
+        # The submission and its emails are committed together; the
+        # deliver_outbox worker sends the emails
+        with transaction.atomic():
+            # Save the submission to database
+            submission = serializer.save()
+            
+            # Prepare email content
+            subject_dict = dict(ContactSubmission.SUBJECT_CHOICES)
+            email_subject = f"New Contact Form Submission - {subject_dict.get(submission.subject, 'General Inquiry')}"
+            
+            # Email content
+            email_body = f"""
 New contact form submission received:
 
 Name: {submission.name}
@@ -38,16 +42,14 @@ Message:
 {submission.message}
 
 Submitted on: {submission.created_at.strftime('%B %d, %Y at %I:%M %p')}
-        """
-        
-        try:
-            # Send email notification to owner
-            send_mail(
+            """
+            
+            # Email notification to owner
+            queue_mail(
                 subject=email_subject,
                 message=email_body,
-                from_email=settings.DEFAULT_FROM_EMAIL,
                 recipient_list=[settings.OWNER_EMAIL],
-                fail_silently=False,
+                from_email=settings.DEFAULT_FROM_EMAIL,
             )
             
             # Get company info for email
@@ -57,7 +59,7 @@ Submitted on: {submission.created_at.strftime('%B %d, %Y at %I:%M %p')}
             except CompanyInfo.DoesNotExist:
                 company_name = "Rotational Equipment Services"
             
-            # Send confirmation email to customer
+            # Confirmation email to customer
             confirmation_subject = f"Thank you for contacting {company_name}"
             confirmation_body = f"""
 Dear {submission.name},
@@ -71,25 +73,16 @@ Best regards,
 {company_name} Team
             """
             
-            send_mail(
+            queue_mail(
                 subject=confirmation_subject,
                 message=confirmation_body,
-                from_email=settings.DEFAULT_FROM_EMAIL,
                 recipient_list=[submission.email],
-                fail_silently=True,  # Don't fail if customer email fails
+                from_email=settings.DEFAULT_FROM_EMAIL,
             )
-            
-            return Response({
-                'message': 'Contact form submitted successfully. We will get back to you soon!',
-                'submission_id': submission.id
-            }, status=status.HTTP_201_CREATED)
-            
-        except Exception as e:
-            # Email failed but form was saved
-            return Response({
-                'message': 'Contact form submitted successfully, but there was an issue sending the email notification.',
-                'submission_id': submission.id,
-                'error': str(e)
-            }, status=status.HTTP_201_CREATED)
+        
+        return Response({
+            'message': 'Contact form submitted successfully. We will get back to you soon!',
+            'submission_id': submission.id
+        }, status=status.HTTP_201_CREATED)
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
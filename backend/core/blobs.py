@@ -0,0 +1,354 @@
+"""
+Serving of blobs over HTTP, with Range support.
+
+Files in the blob store (core.storage) are sent with ``FileResponse``,
+which the WSGI server turns into sendfile(2) through ``wsgi.file_wrapper``;
+byte ranges are sliced from an mmap of the file. Rows not yet moved to the
+store are read from their BLOB column: on SQLite with incremental blob I/O
+(``sqlite3.Connection.blobopen``), so a response never holds more than one
+chunk of a file in memory, elsewhere in one go.
+
+Image models also answer ``?size=`` with a resized derivative in the best
+format the client accepts (see core.images).
+
+URLs built with ``core.storage.versioned_url`` carry a fingerprint of the
+bytes in ``?v=``. While it matches the stored blob, public responses are
+cached for a year as immutable; a replaced file gets a new fingerprint and
+so a new URL. Requests without it, or with a stale one, get the current
+bytes under the server's revalidating policy.
+"""
+import hashlib
+import io
+import logging
+import mmap
+import os
+import sqlite3
+
+from django.conf import settings
+from django.db import connection
+from django.db import models
+from django.db.models.functions import Coalesce, Length
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+from rest_framework.negotiation import BaseContentNegotiation
+
+from .images import FORMATS, SIZE_PARAM, SIZES, DerivativeError, get_derivative, negotiate_format
+from .models import StoredBlobModel
+from .storage import VERSION_PARAM, BlobNotFound, fingerprint, get_blob_store
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# For public responses to URLs whose fingerprint matches the blob
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_byte_range(header, size):
+    """
+    Parse a ``Range`` header against a resource of ``size`` bytes.
+
+    Returns an inclusive ``(start, end)`` tuple, or None when the header
+    should be ignored (absent, malformed, other units or several ranges,
+    which are answered with the full body). Raises RangeNotSatisfiable
+    when the range lies outside the resource.
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    spec = header[len('bytes='):].strip()
+    if ',' in spec or '-' not in spec:
+        return None
+    first, last = (part.strip() for part in spec.split('-', 1))
+    try:
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def open_blob(model, field_name, pk):
+    """
+    Open the BLOB stored in ``field_name`` of the ``model`` row ``pk`` for
+    reading. Returns a file-like object with ``seek``/``read``/``close``,
+    or None when the row or value does not exist.
+    """
+    column = model._meta.get_field(field_name).column
+    if connection.vendor == 'sqlite':
+        connection.ensure_connection()
+        try:
+            return connection.connection.blobopen(
+                model._meta.db_table, column, pk, readonly=True
+            )
+        except sqlite3.OperationalError:
+            # Missing row or NULL value; let the fallback decide which
+            pass
+    data = model.objects.filter(pk=pk).values_list(field_name, flat=True).first()
+    if data is None:
+        return None
+    return io.BytesIO(bytes(data))
+
+
+def iter_blob(blob, start, end, chunk_size=CHUNK_SIZE):
+    """Yield bytes ``start``..``end`` (inclusive) of an open blob, then close it"""
+    try:
+        blob.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = blob.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    except sqlite3.OperationalError:
+        # The row was rewritten while streaming; the client will see a
+        # short body and can retry with If-Range
+        logger.warning("Blob changed while streaming, response truncated")
+    finally:
+        blob.close()
+
+
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    """
+    For views that return files: ``Accept`` selects an image format, not a
+    DRF renderer, so it must not turn into 406 Not Acceptable. Errors are
+    rendered with the first renderer (JSON).
+    """
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+def iter_file(file, start, end, chunk_size=CHUNK_SIZE):
+    """Yield bytes ``start``..``end`` (inclusive) of an open file through an mmap, then close it"""
+    with file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for offset in range(start, end + 1, chunk_size):
+            yield mapped[offset:min(offset + chunk_size, end + 1)]
+
+
+class BlobServer:
+    """
+    Serve a model's BLOB column over HTTP, metadata first.
+
+    ``get_metadata`` loads only the small columns plus the BLOB length;
+    ``respond`` answers conditional requests (304/412) from that metadata
+    and only then reads the bytes: from the blob store for models based on
+    StoredBlobModel, otherwise (and for rows not migrated yet) with a second
+    narrow query or, with ``stream=True``, chunk by chunk through
+    ``open_blob``. Range and If-Range are honoured in every mode.
+
+    When ``settings.BLOB_ACCEL_REDIRECT_PREFIX`` is set, bodies of stored
+    blobs are handed off to nginx with ``X-Accel-Redirect`` instead.
+    """
+
+    def __init__(self, model, blob_field, *, version_field='updated_at',
+                 content_type_field='content_type', filename_field='filename',
+                 default_content_type='application/octet-stream',
+                 extra_fields=(), cache_control='public, no-cache',
+                 as_attachment=False, stream=False):
+        self.model = model
+        self.blob_field = blob_field
+        self.version_field = version_field
+        self.content_type_field = content_type_field
+        self.filename_field = filename_field
+        self.extra_fields = tuple(extra_fields)
+        self.default_content_type = default_content_type
+        self.cache_control = cache_control
+        self.as_attachment = as_attachment
+        self.stream = stream
+        self.stored = issubclass(model, StoredBlobModel)
+        self.derivatives = self.stored and model.image_derivatives
+
+    def metadata_fields(self):
+        fields = ['pk', self.version_field, self.content_type_field, self.filename_field, *self.extra_fields]
+        if self.stored:
+            fields += ['blob_sha256', 'blob_size']
+        return fields
+
+    def get_metadata(self, queryset, **lookup):
+        """
+        Return the matching row with only metadata loaded and
+        ``blob_length`` annotated, or None if there is no row or no data
+        """
+        length = Length(self.blob_field)
+        if self.stored:
+            length = Coalesce('blob_size', length, output_field=models.BigIntegerField())
+        obj = queryset.only(*self.metadata_fields()).annotate(blob_length=length).filter(**lookup).first()
+        if obj is None or not obj.blob_length:
+            return None
+        return obj
+
+    def get_etag(self, obj):
+        if self.stored and obj.blob_sha256:
+            # Changes with the bytes, however the row was updated
+            return f'"{obj.blob_sha256[:32]}"'
+        version = getattr(obj, self.version_field)
+        digest = hashlib.sha256(f'{obj.pk}-{version.isoformat()}-{obj.blob_length}'.encode()).hexdigest()
+        return f'"{digest[:32]}"'
+
+    def is_versioned(self, request, obj):
+        """Whether the request's ``?v=`` fingerprint matches the stored blob"""
+        return bool(
+            self.stored and obj.blob_sha256
+            and request.GET.get(VERSION_PARAM) == fingerprint(obj.blob_sha256)
+        )
+
+    def get_cache_control(self, obj, versioned=False):
+        # A callable gets the metadata row, e.g. to keep private files private
+        cache_control = self.cache_control(obj) if callable(self.cache_control) else self.cache_control
+        if versioned and cache_control.startswith('public'):
+            return IMMUTABLE_CACHE_CONTROL
+        return cache_control
+
+    def get_file_path(self, obj):
+        """Path of the blob on disk relative to the accel-redirect location, if any"""
+        if self.stored and obj.blob_sha256:
+            return get_blob_store().relative_path(obj.blob_sha256)
+        return None
+
+    def respond(self, request, obj):
+        """
+        Response for the blob's metadata row ``obj``, or None when the
+        bytes turn out to be missing. Image models answer ``?size=`` with
+        a derivative (see core.images) and everything else with the
+        original file.
+        """
+        size_name = request.GET.get(SIZE_PARAM) if self.derivatives else None
+        if size_name is not None:
+            if size_name not in SIZES:
+                return JsonResponse({'error': f'Unknown image size {size_name!r}'}, status=400)
+            # Rows still in the database have no digest to key derivatives on
+            if obj.blob_sha256:
+                response = self.respond_derivative(request, obj, size_name)
+                if response is not None:
+                    return response
+        return self.respond_original(request, obj)
+
+    def respond_derivative(self, request, obj, size_name):
+        """The ``size_name`` derivative in the best format the client accepts"""
+        fmt = negotiate_format(request.META.get('HTTP_ACCEPT'))
+        etag = f'"{obj.blob_sha256[:32]}-{size_name}-{fmt}"'
+        last_modified = int(getattr(obj, self.version_field).timestamp())
+        cache_control = self.get_cache_control(obj, self.is_versioned(request, obj))
+
+        def with_headers(response):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            response['Cache-Control'] = cache_control
+            patch_vary_headers(response, ['Accept'])
+            return response
+
+        conditional = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if conditional is not None:
+            return with_headers(conditional)
+
+        try:
+            path = get_derivative(obj.blob_sha256, size_name, fmt)
+        except (BlobNotFound, DerivativeError) as error:
+            # Not decodable (e.g. SVG); the original is better than nothing
+            logger.warning(f"No {size_name} derivative for {self.model.__name__} {obj.pk}: {error}")
+            return None
+
+        if request.method == 'HEAD':
+            response = HttpResponse()
+            response['Content-Length'] = str(os.path.getsize(path))
+        else:
+            response = FileResponse(open(path, 'rb'))
+            del response['Content-Disposition']
+        response['Content-Type'] = FORMATS[fmt]
+        return with_headers(response)
+
+    def respond_original(self, request, obj):
+        size = obj.blob_length
+        etag = self.get_etag(obj)
+        last_modified = int(getattr(obj, self.version_field).timestamp())
+        cache_control = self.get_cache_control(obj, self.is_versioned(request, obj))
+
+        def with_headers(response):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            response['Cache-Control'] = cache_control
+            response['Accept-Ranges'] = 'bytes'
+            return response
+
+        # 304/412 are decided before the blob is touched
+        conditional = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if conditional is not None:
+            return with_headers(conditional)
+
+        content_type = getattr(obj, self.content_type_field) or self.default_content_type
+        filename = getattr(obj, self.filename_field, None)
+
+        accel_prefix = getattr(settings, 'BLOB_ACCEL_REDIRECT_PREFIX', None)
+        file_path = self.get_file_path(obj) if accel_prefix else None
+        if file_path:
+            # nginx serves the file (and any Range) from an internal location
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{file_path.lstrip('/')}"
+            if self.as_attachment and filename:
+                response['Content-Disposition'] = content_disposition_header(True, filename)
+            return with_headers(response)
+
+        # If-Range: only honour Range when the client's copy is current
+        byte_range = None
+        if_range = request.META.get('HTTP_IF_RANGE', '').strip()
+        if not if_range or if_range == etag or parse_http_date_safe(if_range) == last_modified:
+            try:
+                byte_range = parse_byte_range(request.META.get('HTTP_RANGE'), size)
+            except RangeNotSatisfiable:
+                response = with_headers(HttpResponse(status=416))
+                response['Content-Range'] = f'bytes */{size}'
+                return response
+
+        start, end = byte_range or (0, size - 1)
+        status = 206 if byte_range else 200
+        if request.method == 'HEAD':
+            response = HttpResponse(status=status)
+        elif self.stored and obj.blob_sha256:
+            try:
+                file = get_blob_store().open(obj.blob_sha256)
+            except BlobNotFound:
+                logger.error(f"Blob {obj.blob_sha256} of {self.model.__name__} {obj.pk} is missing")
+                return None
+            if byte_range:
+                response = StreamingHttpResponse(iter_file(file, start, end), status=status)
+            else:
+                response = FileResponse(file, status=status)
+                # FileResponse names the file after the digest otherwise
+                del response['Content-Disposition']
+        elif self.stream:
+            blob = open_blob(self.model, self.blob_field, obj.pk)
+            if blob is None:
+                return None
+            response = StreamingHttpResponse(iter_blob(blob, start, end), status=status)
+        else:
+            data = self.model.objects.filter(pk=obj.pk).values_list(self.blob_field, flat=True).first()
+            if not data:
+                return None
+            response = HttpResponse(bytes(data)[start:end + 1], status=status)
+
+        response['Content-Type'] = content_type
+        response['Content-Length'] = str(end - start + 1)
+        if self.as_attachment and filename:
+            response['Content-Disposition'] = content_disposition_header(True, filename)
+        if byte_range:
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        return with_headers(response)
@@ -0,0 +1,153 @@
+"""
+Versioned response cache for public, read-mostly API endpoints.
+
+Rendered responses are stored per host, path, query string and Accept header,
+together with the content version of the domains they were built from
+(see core.versioning). A cached copy is served while its version is
+current; once the version moves on, the first request rebuilds it while
+concurrent requests keep getting the previous copy (stale-while-revalidate).
+
+Usage::
+
+    @cache_response('products')
+    @api_view(['GET'])
+    def featured_products(request): ...
+
+    @method_decorator(cache_response('products'), name='dispatch')
+    class CategoryListView(APIView): ...
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+from .versioning import get_request_versions
+
+# How long a request may hold the rebuild lock before another one takes over
+REBUILD_LOCK_TIMEOUT = 30
+
+# Response headers that must never be replayed to another client
+UNCACHEABLE_HEADERS = {'set-cookie', 'x-cache'}
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _record(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def get_cache_stats():
+    """Hit/miss counters for this worker process"""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = sum(stats.get(outcome, 0) for outcome in ('hit', 'stale', 'miss'))
+    served_from_cache = stats.get('hit', 0) + stats.get('stale', 0)
+    return {
+        'pid': os.getpid(),
+        'hits': stats.get('hit', 0),
+        'stale_hits': stats.get('stale', 0),
+        'misses': stats.get('miss', 0),
+        'bypassed': stats.get('bypass', 0),
+        'hit_ratio': round(served_from_cache / lookups, 4) if lookups else 0.0,
+    }
+
+
+def reset_cache_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def _cache_key(request):
+    query = urlencode(sorted(
+        (key, value) for key, values in request.GET.lists() for value in values
+    ))
+    # Serializers build absolute media URLs, so the host is part of the key
+    host = request.META.get('HTTP_HOST', '')
+    accept = request.META.get('HTTP_ACCEPT', '')
+    digest = hashlib.sha1(f'{host}{request.path}?{query}|{accept}'.encode()).hexdigest()
+    return f'response:{digest}'
+
+
+def _is_authenticated(request):
+    user = getattr(request, 'user', None)
+    return bool(user and user.is_authenticated)
+
+
+def _replay(entry, outcome):
+    response = HttpResponse(entry['content'], status=entry['status'])
+    for header, value in entry['headers']:
+        response[header] = value
+    response['X-Cache'] = outcome
+    return response
+
+
+def cache_response(*domains, timeout=None, stale_timeout=None):
+    """
+    Cache successful GET responses of a view until the content version of
+    ``domains`` changes or ``timeout`` seconds pass.
+
+    Authenticated requests bypass the cache so staff always see live data.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or _is_authenticated(request):
+                _record('bypass')
+                return view_func(request, *args, **kwargs)
+
+            cache = caches[settings.RESPONSE_CACHE_ALIAS]
+            fresh_for = settings.RESPONSE_CACHE_TIMEOUT if timeout is None else timeout
+            stale_for = settings.RESPONSE_CACHE_STALE_TIMEOUT if stale_timeout is None else stale_timeout
+
+            versions = get_request_versions(request, *domains)
+            version = '.'.join(versions[domain][0] for domain in domains)
+            key = _cache_key(request)
+            lock_key = f'{key}:rebuild'
+            entry = cache.get(key)
+
+            if entry is not None:
+                age = time.time() - entry['created']
+                if entry['version'] == version and age < fresh_for:
+                    _record('hit')
+                    return _replay(entry, 'HIT')
+                # Out of date: let one request rebuild while the others keep
+                # receiving the previous copy
+                if not cache.add(lock_key, True, REBUILD_LOCK_TIMEOUT):
+                    _record('stale')
+                    return _replay(entry, 'STALE')
+
+            _record('miss')
+            try:
+                response = view_func(request, *args, **kwargs)
+                if hasattr(response, 'render') and not response.is_rendered:
+                    response.render()
+
+                if response.status_code == 200 and not response.streaming:
+                    cache.set(key, {
+                        'version': version,
+                        'created': time.time(),
+                        'status': response.status_code,
+                        'content': response.content,
+                        'headers': [
+                            (header, value) for header, value in response.items()
+                            if header.lower() not in UNCACHEABLE_HEADERS
+                        ],
+                    }, fresh_for + stale_for)
+            finally:
+                if entry is not None:
+                    cache.delete(lock_key)
+
+            response['X-Cache'] = 'MISS'
+            return response
+
+        return wrapper
+    return decorator
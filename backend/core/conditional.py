@@ -0,0 +1,87 @@
+"""
+Conditional GET for catalog JSON endpoints.
+
+The validator is the content version of the domains a view reads (see
+core.versioning): the ETag is derived from the version tokens and
+Last-Modified is the time of the latest bump. Both are known before the
+view runs, so a matching If-None-Match / If-Modified-Since is answered
+with 304 without touching the catalog tables or the serializer.
+
+Usage::
+
+    @condition_on_version('products')
+    @api_view(['GET'])
+    def featured_products(request): ...
+
+    @method_decorator(condition_on_version('products'), name='dispatch')
+    class CategoryListView(APIView): ...
+
+Stack it outside ``cache_response`` so revalidations skip the cache too.
+
+Authenticated requests get no validators: staff responses can include
+data anonymous ones leave out (private attachments, for one), and the
+version tokens are the same for both. They are marked private instead,
+the same way ``cache_response`` lets them bypass the cache.
+"""
+import hashlib
+from functools import wraps
+
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from .versioning import get_request_versions
+
+
+def version_etag(versions, request):
+    """Weak ETag for the versions a response was built from"""
+    tokens = '.'.join(version for version, _ in versions.values())
+    accept = request.META.get('HTTP_ACCEPT', '')
+    digest = hashlib.sha1(f'{tokens}|{accept}'.encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def version_last_modified(versions):
+    """Unix timestamp of the most recent bump, or None if never bumped"""
+    timestamps = [updated_at for _, updated_at in versions.values() if updated_at is not None]
+    return int(max(timestamps).timestamp()) if timestamps else None
+
+
+def condition_on_version(*domains):
+    """
+    Answer GET/HEAD requests with 304 when the content version of
+    ``domains`` is unchanged, and add ETag/Last-Modified to 200 responses.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_func(request, *args, **kwargs)
+
+            user = getattr(request, 'user', None)
+            if user and user.is_authenticated:
+                response = view_func(request, *args, **kwargs)
+                if not response.has_header('Cache-Control'):
+                    patch_cache_control(response, private=True, no_cache=True)
+                return response
+
+            versions = get_request_versions(request, *domains)
+            etag = version_etag(versions, request)
+            last_modified = version_last_modified(versions)
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view_func(request, *args, **kwargs)
+
+            if response.status_code in (200, 304):
+                if not response.has_header('ETag'):
+                    response['ETag'] = etag
+                if last_modified is not None and not response.has_header('Last-Modified'):
+                    response['Last-Modified'] = http_date(last_modified)
+                # Clients may keep the body but must revalidate before reuse
+                if not response.has_header('Cache-Control'):
+                    patch_cache_control(response, no_cache=True)
+                patch_vary_headers(response, ('Accept',))
+            return response
+
+        return wrapper
+    return decorator
@@ -0,0 +1,296 @@
+"""
+Resized and re-encoded variants ("derivatives") of stored images.
+
+Each image can be requested in a few named sizes, bounded on their longest
+side, in JPEG, WebP or AVIF; ``negotiate_format`` picks the best format the
+client's ``Accept`` header allows and this Pillow build can encode.
+
+Derivatives are derived from the source blob's digest, so they never go
+stale and need no invalidation. They are rendered on first request (or in
+bulk by ``build_image_derivatives``) into ``DerivativeCache``, an on-disk
+cache that evicts the least recently used files once it outgrows its size
+limit.
+
+Nothing in this module touches the database, so process-pool workers can
+use it without a Django connection.
+"""
+import io
+import logging
+import os
+import tempfile
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+from .storage import BlobNotFound, get_blob_store, versioned_url
+
+logger = logging.getLogger(__name__)
+
+SIZE_PARAM = 'size'
+
+# Longest side in pixels; images are never upscaled
+SIZES = {
+    'thumb': 160,
+    'card': 400,
+    'detail': 800,
+    'full': 1600,
+}
+
+# Most preferred first
+FORMATS = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+}
+
+SAVE_OPTIONS = {
+    'avif': {'quality': 60, 'speed': 6},
+    'webp': {'quality': 80, 'method': 4},
+    'jpeg': {'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+# Part of every cache key; bump when sizes or encoder settings change
+RENDER_VERSION = 1
+
+
+def sized_url(url, size, digest=''):
+    """URL of one size of the image at ``url``, fingerprinted when ``digest`` is known"""
+    return versioned_url(url, digest, **{SIZE_PARAM: size})
+
+
+def srcset(url, digest=''):
+    """``srcset`` attribute value offering every size of the image at ``url``"""
+    return ', '.join(f'{sized_url(url, size, digest)} {width}w' for size, width in SIZES.items())
+
+
+class DerivativeError(Exception):
+    """The source could not be decoded as an image"""
+
+
+@lru_cache(maxsize=None)
+def available_formats():
+    """Formats this Pillow build can encode, most preferred first"""
+    return tuple(fmt for fmt in FORMATS if fmt == 'jpeg' or features.check(fmt))
+
+
+def negotiate_format(accept):
+    """
+    Pick the output format for an ``Accept`` header. AVIF and WebP are only
+    chosen when listed explicitly, since ``image/*`` and ``*/*`` are sent by
+    clients that cannot decode them.
+    """
+    accepted = {}
+    for item in (accept or '').split(','):
+        mime, _, params = item.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[mime.strip().lower()] = quality
+    for fmt in available_formats():
+        if fmt != 'jpeg' and accepted.get(FORMATS[fmt], 0) > 0:
+            return fmt
+    return 'jpeg'
+
+
+def _prepare(image, fmt):
+    """Convert to a mode the encoder accepts, keeping alpha where it can"""
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    if fmt == 'jpeg':
+        if has_alpha:
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image.convert('RGBA'), mask=image.convert('RGBA').getchannel('A'))
+            return background
+        return image if image.mode in ('RGB', 'L') else image.convert('RGB')
+    if has_alpha:
+        return image if image.mode == 'RGBA' else image.convert('RGBA')
+    return image if image.mode == 'RGB' else image.convert('RGB')
+
+
+def render(source, sizes, formats):
+    """
+    Decode ``source`` (a binary file object) once and yield
+    ``(size, fmt, bytes)`` for every combination, largest size first so
+    each step downsamples the previous one.
+    """
+    largest = max(SIZES[size] for size in sizes)
+    try:
+        image = Image.open(source)
+        # Lets the JPEG decoder downscale by a power of two while decoding
+        image.draft(None, (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as error:
+        raise DerivativeError(str(error))
+
+    for size in sorted(sizes, key=SIZES.get, reverse=True):
+        bound = SIZES[size]
+        image.thumbnail((bound, bound), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        for fmt in formats:
+            output = io.BytesIO()
+            _prepare(image, fmt).save(output, format=fmt.upper(), **SAVE_OPTIONS[fmt])
+            yield size, fmt, output.getvalue()
+
+
+class DerivativeCache:
+    """
+    Size-bounded LRU directory of rendered derivatives.
+
+    Hits refresh the file's mtime, which is the recency the evictor sorts
+    on. Eviction scans the directory, so it runs only after another tenth
+    of ``max_size`` has been written by this process, and trims the cache
+    to 90% of ``max_size`` so it does not run again straight away.
+    """
+    touch_interval = 60
+
+    def __init__(self, location, max_size):
+        self.location = os.fspath(location)
+        self.max_size = max_size
+        self.written_since_eviction = 0
+
+    @staticmethod
+    def key(digest, size, fmt):
+        return f'{digest}-{size}-v{RENDER_VERSION}.{fmt}'
+
+    def path(self, key):
+        return os.path.join(self.location, key[:2], key)
+
+    def get(self, key):
+        """Path of the cached file, or None"""
+        path = self.path(key)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+        now = time.time()
+        if now - mtime > self.touch_interval:
+            try:
+                os.utime(path, (now, now))
+            except FileNotFoundError:
+                # Evicted by another process in the meantime
+                return None
+        return path
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as temp:
+                temp.write(data)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+        self.written_since_eviction += len(data)
+        if self.written_since_eviction > self.max_size // 10:
+            self.evict()
+        return path
+
+    def entries(self):
+        """``(mtime, size, path)`` of every cached file"""
+        if not os.path.isdir(self.location):
+            return []
+        found = []
+        for directory in os.scandir(self.location):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                if entry.name.startswith('.tmp-'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, entry.path))
+        return found
+
+    def evict(self):
+        """Drop least recently used files until the cache fits; returns files removed"""
+        self.written_since_eviction = 0
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_size:
+            return 0
+        target = self.max_size * 9 // 10
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        logger.info(f"Evicted {removed} image derivatives, cache now {total} bytes")
+        return removed
+
+    def stats(self):
+        entries = self.entries()
+        return {
+            'files': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_size,
+        }
+
+
+def get_derivative_cache():
+    config = settings.IMAGE_DERIVATIVE_CACHE
+    return DerivativeCache(config['location'], config['max_size'])
+
+
+def get_derivative(digest, size, fmt, store=None, cache=None):
+    """
+    Path of the ``size``/``fmt`` derivative of the blob ``digest``,
+    rendering it on a cache miss. Raises BlobNotFound or DerivativeError.
+    """
+    cache = cache or get_derivative_cache()
+    key = cache.key(digest, size, fmt)
+    path = cache.get(key)
+    if path is None:
+        with (store or get_blob_store()).open(digest) as source:
+            [(_, _, data)] = render(source, [size], [fmt])
+        path = cache.put(key, data)
+    return path
+
+
+def build_derivatives(digest, store_config, cache_config, sizes=tuple(SIZES), formats=None):
+    """
+    Render every missing derivative of one blob. Takes plain configuration
+    instead of reading settings so it can run in a process pool. Returns
+    ``(digest, files written, bytes written, error or None)``.
+    """
+    from django.utils.module_loading import import_string
+
+    store = import_string(store_config['BACKEND'])(**store_config.get('OPTIONS', {}))
+    cache = DerivativeCache(cache_config['location'], cache_config['max_size'])
+    formats = formats or available_formats()
+    missing_sizes = [
+        size for size in sizes
+        if any(cache.get(cache.key(digest, size, fmt)) is None for fmt in formats)
+    ]
+    if not missing_sizes:
+        return digest, 0, 0, None
+
+    written = written_bytes = 0
+    try:
+        with store.open(digest) as source:
+            for size, fmt, data in render(source, missing_sizes, formats):
+                key = cache.key(digest, size, fmt)
+                if cache.get(key) is None:
+                    cache.put(key, data)
+                    written += 1
+                    written_bytes += len(data)
+    except (BlobNotFound, DerivativeError) as error:
+        return digest, written, written_bytes, str(error)
+    return digest, written, written_bytes, None
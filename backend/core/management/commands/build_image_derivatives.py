@@ -0,0 +1,80 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from core.images import SIZES, available_formats, build_derivatives
+from core.models import stored_blob_models
+
+
+class Command(BaseCommand):
+    help = 'Render every image size and format into the derivative cache, in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Worker processes (default: number of CPUs)'
+        )
+        parser.add_argument(
+            '--sizes',
+            default=','.join(SIZES),
+            help=f"Comma-separated sizes to render (default: {','.join(SIZES)})"
+        )
+        parser.add_argument(
+            '--formats',
+            default=','.join(available_formats()),
+            help=f"Comma-separated formats to render (default: {','.join(available_formats())})"
+        )
+
+    def handle(self, *args, **options):
+        sizes = [size.strip() for size in options['sizes'].split(',') if size.strip()]
+        formats = [fmt.strip() for fmt in options['formats'].split(',') if fmt.strip()]
+        unknown = set(sizes) - set(SIZES) | set(formats) - set(available_formats())
+        if unknown:
+            raise CommandError(f"Unknown or unsupported sizes/formats: {', '.join(sorted(unknown))}")
+
+        digests = set()
+        for model in stored_blob_models():
+            if model.image_derivatives:
+                digests.update(model.objects.exclude(blob_sha256='').values_list('blob_sha256', flat=True))
+        digests = sorted(digests)
+
+        start_time = timezone.now()
+        self.stdout.write(
+            f"Rendering {len(sizes)} sizes x {len(formats)} formats for {len(digests)} images "
+            f"with {options['workers']} workers..."
+        )
+        job = (settings.BLOB_STORE, settings.IMAGE_DERIVATIVE_CACHE, tuple(sizes), tuple(formats))
+
+        if options['workers'] > 1:
+            # Workers only touch files; do not hand them our database connection
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+                futures = [pool.submit(build_derivatives, digest, *job) for digest in digests]
+                results = [future.result() for future in as_completed(futures)]
+        else:
+            results = [build_derivatives(digest, *job) for digest in digests]
+
+        written = sum(files for _, files, _, _ in results)
+        written_bytes = sum(size for _, _, size, _ in results)
+        failed = [(digest, error) for digest, _, _, error in results if error]
+        for digest, error in failed:
+            self.stdout.write(self.style.WARNING(f'{digest}: {error}'))
+        if written_bytes > settings.IMAGE_DERIVATIVE_CACHE['max_size']:
+            self.stdout.write(self.style.WARNING(
+                'The derivatives do not fit in IMAGE_DERIVATIVE_CACHE max_size; '
+                'the least recently used ones were evicted again'
+            ))
+
+        duration = timezone.now() - start_time
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Wrote {written} derivatives ({written_bytes} bytes) for {len(digests) - len(failed)} images '
+                f'in {duration.total_seconds():.2f} seconds'
+            )
+        )
@@ -0,0 +1,49 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import outbox
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued emails from the outbox over SMTP'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--watch',
+            action='store_true',
+            help='Keep running, polling for due messages'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2.0,
+            help='Seconds between polls with --watch (default: 2)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=outbox.BATCH_SIZE,
+            help=f'Messages sent per SMTP connection (default: {outbox.BATCH_SIZE})'
+        )
+        parser.add_argument(
+            '--stats',
+            action='store_true',
+            help='Print queue depth and delivery latency, and exit'
+        )
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(json.dumps(outbox.stats(), indent=2))
+            return
+
+        while True:
+            sent, failed = outbox.deliver_due(options['batch_size'])
+            if sent or failed or not options['watch']:
+                self.stdout.write(self.style.SUCCESS(f'Sent {sent} emails, {failed} failed'))
+            if not options['watch']:
+                return
+            # A full batch means more are due
+            if sent + failed < options['batch_size']:
+                time.sleep(options['interval'])
@@ -0,0 +1,70 @@
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from core.models import stored_blob_models
+from core.storage import get_blob_store
+
+
+class Command(BaseCommand):
+    help = 'Delete blob store files that no row references any more'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-period',
+            type=int,
+            default=3600,
+            help='Keep unreferenced files younger than this many seconds; a save() '
+                 'writes the file before its row is committed (default: 3600)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report what would be deleted without deleting anything'
+        )
+
+    def handle(self, *args, **options):
+        store = get_blob_store()
+        references = self.count_references()
+        dry_run = options['dry_run']
+
+        cutoff = time.time() - options['grace_period']
+        seen = set()
+        deleted = freed = shared = 0
+        for digest, size, mtime in store.iter_blobs():
+            seen.add(digest)
+            count = references.get(digest, 0)
+            if count > 1:
+                shared += 1
+            if count or mtime >= cutoff:
+                continue
+            deleted += 1
+            freed += size
+            if not dry_run:
+                store.delete(digest)
+        temporary = 0 if dry_run else store.clear_temporary(options['grace_period'])
+
+        self.stdout.write(
+            f'{len(seen)} files, {len(references)} referenced by {sum(references.values())} rows '
+            f'({shared} shared by several rows)'
+        )
+        missing = len(set(references) - seen)
+        if missing:
+            self.stdout.write(self.style.WARNING(f'{missing} referenced blobs are missing from the store'))
+        verb = 'Would delete' if dry_run else 'Deleted'
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'{verb} {deleted} unreferenced blobs ({freed} bytes) and removed {temporary} partial writes'
+            )
+        )
+
+    @staticmethod
+    def count_references():
+        """{digest: number of rows pointing at it} across all blob models"""
+        references = Counter()
+        for model in stored_blob_models():
+            references.update(
+                model.objects.exclude(blob_sha256='').values_list('blob_sha256', flat=True).iterator(chunk_size=5000)
+            )
+        return references
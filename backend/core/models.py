@@ -0,0 +1,112 @@
+from django.db import models
+
+
+class ContentVersion(models.Model):
+    """
+    Change stamp for a group of catalog models (a "domain" such as products
+    or galleries). The version is replaced with a fresh random token every
+    time a model in the domain is saved or deleted, so anything derived from
+    the domain's data can be keyed on it.
+    """
+    domain = models.CharField(max_length=50, unique=True)
+    version = models.CharField(max_length=32)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.domain} @ {self.version}"
+
+
+
+class OutboxMessage(models.Model):
+    """
+    An email waiting for the deliver_outbox worker (see core.outbox).
+    Written in the same transaction as the change it reports.
+    """
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=998)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254, blank=True)
+    to = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # Not tried again before this time (exponential backoff after failures)
+    next_attempt_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)} ({self.status})"
+
+
+class StoredBlobModel(models.Model):
+    """
+    Base for models whose file lives in the blob store (core.storage).
+
+    ``blob_field`` names the model's BinaryField. Bytes assigned to it are
+    written to the store on save() and the column is emptied, leaving only
+    ``blob_sha256`` and ``blob_size`` in the row. Rows saved before the
+    store existed keep their bytes in the column until ``migrate_blobs``
+    moves them; ``read_blob()`` and ``has_blob`` handle both.
+
+    Models with ``image_derivatives`` are images that can be served in the
+    sizes and formats of core.images.
+    """
+    blob_field = None
+    image_derivatives = False
+
+    blob_sha256 = models.CharField(max_length=64, blank=True, default='', db_index=True, editable=False)
+    blob_size = models.PositiveBigIntegerField(null=True, blank=True, editable=False)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def has_blob(self):
+        return bool(self.blob_sha256) or bool(getattr(self, self.blob_field))
+
+    def read_blob(self):
+        """The file's bytes, from the store or the legacy column"""
+        from .storage import get_blob_store
+
+        if self.blob_sha256:
+            return get_blob_store().read(self.blob_sha256)
+        data = getattr(self, self.blob_field)
+        return bytes(data) if data else b''
+
+    def store_blob(self):
+        """Move bytes assigned to ``blob_field`` into the blob store"""
+        from .storage import get_blob_store
+
+        # Not loaded (deferred) means not assigned either
+        data = self.__dict__.get(self.blob_field)
+        if not data:
+            return False
+        self.blob_sha256, self.blob_size = get_blob_store().save(data)
+        setattr(self, self.blob_field, b'')
+        return True
+
+    def save(self, *args, **kwargs):
+        if self.store_blob() and kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], self.blob_field, 'blob_sha256', 'blob_size'}
+        super().save(*args, **kwargs)
+
+
+def stored_blob_models():
+    """Every installed model that keeps its file in the blob store"""
+    from django.apps import apps
+
+    return [model for model in apps.get_models() if issubclass(model, StoredBlobModel)]
@@ -0,0 +1,167 @@
+"""
+Transactional email outbox.
+
+Sending mail over SMTP inside a request adds seconds to it, and the email
+is lost if the server is down. Code that sends email calls ``queue_mail``
+instead, which stores an ``OutboxMessage``. It is written in the caller's
+transaction, so a message exists exactly when the change it reports was
+committed.
+
+The ``deliver_outbox`` command delivers due messages in batches of
+``BATCH_SIZE``, over one SMTP connection per batch. A message that fails
+is retried after ``RETRY_BASE_DELAY`` seconds, doubling with every
+attempt up to ``RETRY_MAX_DELAY``, and marked failed after
+``MAX_ATTEMPTS``. When the server cannot be reached at all, no attempt
+is counted: every due message waits ``RETRY_BASE_DELAY`` seconds and is
+tried again, however long the outage lasts. Run a single worker; two
+would send a batch twice.
+
+``stats()`` reports the queue depth and the delivery latency (queued to
+sent) of recent messages.
+"""
+import logging
+import statistics
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 8
+RETRY_BASE_DELAY = 30
+RETRY_MAX_DELAY = 60 * 60
+
+# Sent messages counted in the latency figures
+STATS_WINDOW = timedelta(hours=24)
+
+
+def queue_mail(subject, message, recipient_list, from_email=None):
+    """
+    Queue a plain-text email; arguments as for Django's ``send_mail``.
+    Empty addresses are dropped, and nothing is queued without any.
+    """
+    recipients = [address for address in recipient_list if address]
+    if not recipients:
+        logger.warning(f"Email {subject!r} has no recipients; not queued")
+        return None
+    return OutboxMessage.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=recipients,
+        next_attempt_at=timezone.now(),
+    )
+
+
+def retry_delay(attempts):
+    """Seconds to wait after the ``attempts``-th failed attempt"""
+    return min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+
+
+def _record_failure(message, error, now):
+    attempts = message.attempts + 1
+    if attempts >= MAX_ATTEMPTS:
+        status = OutboxMessage.FAILED
+        logger.error(f"Giving up on outbox message {message.pk} after {attempts} attempts: {error}")
+    else:
+        status = OutboxMessage.PENDING
+        logger.warning(f"Outbox message {message.pk} failed (attempt {attempts}): {error}")
+    OutboxMessage.objects.filter(pk=message.pk).update(
+        attempts=attempts,
+        status=status,
+        last_error=str(error),
+        next_attempt_at=now + timedelta(seconds=retry_delay(attempts)),
+    )
+
+
+def deliver_due(limit=BATCH_SIZE, now=None):
+    """
+    Deliver up to ``limit`` messages that are due, oldest first, over one
+    connection. Returns ``(sent, failed)``; failed messages are retried later.
+    """
+    now = now or timezone.now()
+    batch = list(
+        OutboxMessage.objects.filter(status=OutboxMessage.PENDING, next_attempt_at__lte=now)
+        .order_by('next_attempt_at', 'pk')[:limit]
+    )
+    if not batch:
+        return 0, 0
+
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        # The server is unreachable, which says nothing about the messages:
+        # every due message waits without being charged an attempt
+        logger.warning(f"Could not connect to the mail server: {e}")
+        OutboxMessage.objects.filter(status=OutboxMessage.PENDING, next_attempt_at__lte=now).update(
+            last_error=str(e),
+            next_attempt_at=now + timedelta(seconds=RETRY_BASE_DELAY),
+        )
+        return 0, len(batch)
+
+    sent = failed = 0
+    try:
+        for message in batch:
+            email = EmailMessage(
+                subject=message.subject,
+                body=message.body,
+                from_email=message.from_email or None,
+                to=message.to,
+                connection=connection,
+            )
+            try:
+                email.send()
+            except Exception as e:
+                _record_failure(message, e, now)
+                failed += 1
+                continue
+            OutboxMessage.objects.filter(pk=message.pk).update(
+                status=OutboxMessage.SENT,
+                attempts=message.attempts + 1,
+                last_error='',
+                sent_at=timezone.now(),
+            )
+            sent += 1
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def stats(now=None):
+    """Queue depth, and delivery latency of the messages sent in the last ``STATS_WINDOW``"""
+    now = now or timezone.now()
+    counts = dict(OutboxMessage.objects.values_list('status').annotate(count=Count('pk')).order_by())
+    pending = OutboxMessage.objects.filter(status=OutboxMessage.PENDING)
+    oldest = pending.aggregate(oldest=Min('created_at'))['oldest']
+
+    latencies = sorted(
+        (sent_at - created_at).total_seconds()
+        for created_at, sent_at in OutboxMessage.objects.filter(
+            status=OutboxMessage.SENT, sent_at__gte=now - STATS_WINDOW
+        ).values_list('created_at', 'sent_at')
+    )
+    latency = None
+    if latencies:
+        latency = {
+            'count': len(latencies),
+            'median_seconds': round(statistics.median(latencies), 3),
+            'p95_seconds': round(
+                statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0], 3
+            ),
+            'max_seconds': round(latencies[-1], 3),
+        }
+    return {
+        'pending': counts.get(OutboxMessage.PENDING, 0),
+        'due': pending.filter(next_attempt_at__lte=now).count(),
+        'failed': counts.get(OutboxMessage.FAILED, 0),
+        'sent': counts.get(OutboxMessage.SENT, 0),
+        'oldest_pending_seconds': round((now - oldest).total_seconds(), 3) if oldest else None,
+        'delivery_latency': latency,
+    }
@@ -0,0 +1,24 @@
+"""
+orjson-based JSON parser, the default for request bodies (see
+``REST_FRAMEWORK`` in settings). Like DRF's ``JSONParser`` it rejects
+NaN and Infinity and reports bad input as a ParseError.
+"""
+import codecs
+
+import orjson
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+
+class ORJSONParser(JSONParser):
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        if codecs.lookup(encoding).name != 'utf-8':
+            # orjson only reads UTF-8
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
@@ -0,0 +1,51 @@
+"""
+Faster renderers for the API.
+
+``ORJSONRenderer`` is the default renderer (see ``REST_FRAMEWORK`` in
+settings). It produces the same bytes as DRF's ``JSONRenderer`` for the
+data our views return: types orjson does not encode natively, and
+datetimes, go through DRF's own encoder, so Decimals still become
+numbers, UUIDs strings and UTC datetimes end in "Z". Output it cannot
+produce identically (indented JSON for the browsable API, integers over
+64 bits) is left to ``JSONRenderer``.
+
+``MessagePackRenderer`` is used when a client sends
+``Accept: application/msgpack``, with the same value conversions.
+"""
+import msgpack
+import orjson
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# DRF's conversions for values JSON has no type for
+encode_default = JSONEncoder().default
+
+
+class ORJSONRenderer(JSONRenderer):
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            rendered = orjson.dumps(data, default=encode_default, option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escaped like JSONRenderer does, for JSON embedded in JavaScript
+        if b'\xe2\x80\xa8' in rendered or b'\xe2\x80\xa9' in rendered:
+            rendered = rendered.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return rendered
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encode_default, use_bin_type=True)
@@ -0,0 +1,203 @@
+"""
+Content-addressed blob store.
+
+Files are written once under their SHA-256 digest and never modified, so
+identical uploads share one file and a digest stored in a row always
+points at the same bytes. Rows keep only the digest and the size (see
+``StoredBlobModel``); files no row refers to any more are removed by the
+``gc_blobs`` command.
+
+The backend is configured like a cache backend::
+
+    BLOB_STORE = {
+        'BACKEND': 'core.storage.FileSystemBlobStore',
+        'OPTIONS': {'location': '/app/database/blobs'},
+    }
+"""
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# Query parameter carrying a blob's content fingerprint in URLs
+VERSION_PARAM = 'v'
+FINGERPRINT_LENGTH = 16
+
+
+class BlobNotFound(Exception):
+    pass
+
+
+class BlobStore:
+    """Interface for blob store backends"""
+
+    def save(self, content):
+        """
+        Store ``content`` (bytes or a binary file object) and return its
+        ``(sha256 hex digest, size)``
+        """
+        raise NotImplementedError
+
+    def open(self, digest):
+        """Open the blob for reading; raises BlobNotFound"""
+        raise NotImplementedError
+
+    def read(self, digest):
+        with self.open(digest) as blob:
+            return blob.read()
+
+    def exists(self, digest):
+        raise NotImplementedError
+
+    def delete(self, digest):
+        raise NotImplementedError
+
+    def path(self, digest):
+        """Local filesystem path of the blob, or None if the backend has none"""
+        return None
+
+    def relative_path(self, digest):
+        """Path of the blob relative to the store root, for X-Accel-Redirect"""
+        return None
+
+    def iter_blobs(self):
+        """Yield ``(digest, size, mtime)`` for every stored blob"""
+        raise NotImplementedError
+
+    def clear_temporary(self, older_than):
+        """Remove abandoned partial writes older than ``older_than`` seconds"""
+        return 0
+
+
+class FileSystemBlobStore(BlobStore):
+    """
+    Blobs under ``<location>/ab/cd/abcd...``. Two levels of fan-out keep
+    directories small. A write goes to ``<location>/tmp`` first and is
+    renamed into place, so readers never see a partial file.
+    """
+    chunk_size = 1024 * 1024
+
+    def __init__(self, location):
+        self.location = os.fspath(location)
+        self.temp_dir = os.path.join(self.location, 'tmp')
+
+    def relative_path(self, digest):
+        if not DIGEST_RE.match(digest or ''):
+            raise BlobNotFound(f'Invalid blob digest {digest!r}')
+        return os.path.join(digest[:2], digest[2:4], digest)
+
+    def path(self, digest):
+        return os.path.join(self.location, self.relative_path(digest))
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def open(self, digest):
+        try:
+            return open(self.path(digest), 'rb')
+        except FileNotFoundError:
+            raise BlobNotFound(f'Blob {digest} is missing from {self.location}')
+
+    def save(self, content):
+        os.makedirs(self.temp_dir, exist_ok=True)
+        hasher = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.temp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as temp:
+                for chunk in self._chunks(content):
+                    hasher.update(chunk)
+                    temp.write(chunk)
+                    size += len(chunk)
+                temp.flush()
+                os.fsync(temp.fileno())
+
+            digest = hasher.hexdigest()
+            final_path = self.path(digest)
+            if os.path.exists(final_path):
+                # Deduplicated; the existing file has the same bytes
+                os.unlink(temp_path)
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.chmod(temp_path, 0o644)
+                os.replace(temp_path, final_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        return digest, size
+
+    def _chunks(self, content):
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            view = memoryview(content)
+            for offset in range(0, len(view), self.chunk_size):
+                yield view[offset:offset + self.chunk_size]
+            return
+        if hasattr(content, 'chunks'):
+            # Django UploadedFile
+            yield from content.chunks(self.chunk_size)
+            return
+        while chunk := content.read(self.chunk_size):
+            yield chunk
+
+    def delete(self, digest):
+        try:
+            os.unlink(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+    def iter_blobs(self):
+        if not os.path.isdir(self.location):
+            return
+        for outer in sorted(os.listdir(self.location)):
+            if len(outer) != 2:
+                continue
+            outer_path = os.path.join(self.location, outer)
+            for inner in sorted(os.listdir(outer_path)):
+                inner_path = os.path.join(outer_path, inner)
+                with os.scandir(inner_path) as entries:
+                    for entry in entries:
+                        if DIGEST_RE.match(entry.name):
+                            stat = entry.stat()
+                            yield entry.name, stat.st_size, stat.st_mtime
+
+    def clear_temporary(self, older_than):
+        if not os.path.isdir(self.temp_dir):
+            return 0
+        cutoff = time.time() - older_than
+        removed = 0
+        with os.scandir(self.temp_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+                    removed += 1
+        return removed
+
+
+def get_blob_store():
+    """Return the configured blob store backend"""
+    config = settings.BLOB_STORE
+    return import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+
+
+def fingerprint(digest):
+    return digest[:FINGERPRINT_LENGTH] if digest else None
+
+
+def versioned_url(url, digest, **params):
+    """
+    ``url`` with ``params`` and, when the blob's digest is known, its
+    fingerprint as query string. The fingerprint changes with the bytes,
+    so responses to such a URL can be cached for good (see core.blobs).
+    """
+    if digest:
+        params[VERSION_PARAM] = fingerprint(digest)
+    return f'{url}?{urlencode(params)}' if params else url
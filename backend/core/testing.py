@@ -0,0 +1,30 @@
+import os
+import shutil
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """Runs the suite against a throwaway blob store and derivative cache"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.files_location = tempfile.mkdtemp(prefix='test-blobs-')
+        self.files_override = override_settings(
+            BLOB_STORE={
+                'BACKEND': 'core.storage.FileSystemBlobStore',
+                'OPTIONS': {'location': os.path.join(self.files_location, 'blobs')},
+            },
+            IMAGE_DERIVATIVE_CACHE={
+                'location': os.path.join(self.files_location, 'derivatives'),
+                'max_size': 64 * 1024 * 1024,
+            },
+        )
+        self.files_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.files_override.disable()
+        shutil.rmtree(self.files_location, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,716 @@
+import hashlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.http import FileResponse
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+
+from company.models import CompanyInfo
+from equipment.models import Manufacturer, Section
+from galleries.models import GalleryCategory, GalleryImage
+from products.models import Category, Product, ProductImage
+from .images import SIZES, DerivativeCache, negotiate_format
+from .storage import BlobNotFound, get_blob_store, versioned_url
+from .caching import get_cache_stats, reset_cache_stats
+from .models import ContentVersion, OutboxMessage
+from .versioning import INITIAL_VERSION, bump_version, domains_for_model, get_version
+
+
+class ContentVersionTestCase(TestCase):
+    def test_unknown_domain_reports_initial_version(self):
+        self.assertEqual(get_version('nothing-here'), INITIAL_VERSION)
+
+    def test_bump_changes_version(self):
+        first = bump_version('products')
+        second = bump_version('products')
+        self.assertNotEqual(first, second)
+        self.assertEqual(get_version('products'), second)
+        self.assertEqual(ContentVersion.objects.filter(domain='products').count(), 1)
+
+    def test_saving_and_deleting_registered_models_bumps_domain(self):
+        before = get_version('products')
+        category = Category.objects.create(name='Pumps')
+        after_create = get_version('products')
+        self.assertNotEqual(before, after_create)
+
+        category.delete()
+        self.assertNotEqual(after_create, get_version('products'))
+
+    def test_domains_are_independent(self):
+        equipment = get_version('equipment')
+        Category.objects.create(name='Pumps')
+        self.assertEqual(get_version('equipment'), equipment)
+
+
+class ResponseCacheTestCase(TestCase):
+    def setUp(self):
+        caches['responses'].clear()
+        reset_cache_stats()
+        self.category = Category.objects.create(name='Pumps')
+        self.product = Product.objects.create(
+            name='Centrifugal Pump',
+            description='Single stage',
+            price=100,
+            category=self.category,
+            quantity=5,
+        )
+
+    def test_second_request_is_served_from_cache(self):
+        first = self.client.get('/api/categories/')
+        self.assertEqual(first['X-Cache'], 'MISS')
+
+        with self.assertNumQueries(1):
+            second = self.client.get('/api/categories/')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.content, first.content)
+
+        stats = get_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+    def test_query_string_is_part_of_the_key(self):
+        self.client.get('/api/products/', {'page': 1})
+        response = self.client.get('/api/products/', {'page': 1, 'category': self.category.id})
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+    def test_model_change_invalidates_cached_response(self):
+        self.client.get('/api/categories/')
+        Category.objects.create(name='Seals')
+
+        response = self.client.get('/api/categories/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual({c['name'] for c in response.json()}, {'Pumps', 'Seals'})
+
+    def test_stale_copy_served_while_another_request_rebuilds(self):
+        self.client.get('/api/categories/')
+        Category.objects.create(name='Seals')
+
+        # Simulate a concurrent request already holding the rebuild lock
+        with mock.patch.object(type(caches['responses']), 'add', return_value=False):
+            response = self.client.get('/api/categories/')
+        self.assertEqual(response['X-Cache'], 'STALE')
+        self.assertEqual([c['name'] for c in response.json()], ['Pumps'])
+        self.assertEqual(get_cache_stats()['stale_hits'], 1)
+
+    @override_settings(RESPONSE_CACHE_TIMEOUT=0)
+    def test_expired_entry_is_rebuilt(self):
+        self.client.get('/api/company/info/')
+        response = self.client.get('/api/company/info/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+    def test_company_info_invalidated_by_its_own_domain(self):
+        CompanyInfo.objects.create(name='Acme')
+        self.client.get('/api/company/info/')
+        self.assertEqual(self.client.get('/api/company/info/')['X-Cache'], 'HIT')
+
+        CompanyInfo.objects.update(name='Acme Ltd')  # bypasses signals
+        self.assertEqual(self.client.get('/api/company/info/')['X-Cache'], 'HIT')
+
+        company = CompanyInfo.objects.get()
+        company.save()
+        response = self.client.get('/api/company/info/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['name'], 'Acme Ltd')
+
+    def test_authenticated_requests_bypass_cache(self):
+        staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        self.client.force_login(staff)
+        self.client.get('/api/categories/')
+        response = self.client.get('/api/categories/')
+        self.assertNotIn('X-Cache', response)
+
+        stats = self.client.get('/api/cache/stats/').json()
+        self.assertEqual(stats['bypassed'], 2)
+
+    def test_stats_endpoint_requires_staff(self):
+        response = self.client.get('/api/cache/stats/')
+        self.assertIn(response.status_code, (401, 403))
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        caches['responses'].clear()
+        self.category = Category.objects.create(name='Pumps')
+
+    def test_response_carries_validators(self):
+        response = self.client.get('/api/categories/')
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        self.assertIn('Last-Modified', response)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_matching_etag_returns_304_without_running_the_view(self):
+        etag = self.client.get('/api/products/featured/')['ETag']
+
+        # Only the content version lookup runs
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/products/featured/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+    def test_if_modified_since_returns_304(self):
+        last_modified = self.client.get('/api/categories/')['Last-Modified']
+        response = self.client.get('/api/categories/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_change_invalidates_etag(self):
+        etag = self.client.get('/api/categories/')['ETag']
+        Category.objects.create(name='Seals')
+
+        response = self.client.get('/api/categories/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_depends_on_accept(self):
+        json_etag = self.client.get('/api/categories/', HTTP_ACCEPT='application/json')['ETag']
+        html_etag = self.client.get('/api/categories/', HTTP_ACCEPT='text/html')['ETag']
+        self.assertNotEqual(json_etag, html_etag)
+
+    def test_domains_do_not_share_validators(self):
+        etag = self.client.get('/api/galleries/categories/')['ETag']
+        Category.objects.create(name='Seals')
+        response = self.client.get('/api/galleries/categories/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_staff_responses_are_not_validated(self):
+        product = Product.objects.create(name='Pump', description='Test', price=100, category=self.category, quantity=5)
+        url = f'/api/products/{product.id}/'
+        anonymous = self.client.get(url)
+
+        self.client.force_login(User.objects.create_user('staff', password='secret', is_staff=True))
+        response = self.client.get(
+            url, HTTP_IF_NONE_MATCH=anonymous['ETag'], HTTP_IF_MODIFIED_SINCE=anonymous['Last-Modified']
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_errors_are_not_validated(self):
+        response = self.client.get('/api/equipment/categories/missing/')
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('ETag', response)
+
+
+class BlobServingTestCase(TestCase):
+    def setUp(self):
+        caches['responses'].clear()
+        category = Category.objects.create(name='Pumps')
+        self.product = Product.objects.create(
+            name='Pump', description='Test', price=100, category=category, quantity=5
+        )
+        self.image = ProductImage.objects.create(
+            product=self.product, image_data=b'product-image', content_type='image/png'
+        )
+        self.gallery = GalleryCategory.objects.create(name='Repairs', slug='repairs', description='x', order=100)
+        self.gallery_image = GalleryImage.objects.create(
+            category=self.gallery, title='Rebuild', image_data=b'gallery-image'
+        )
+        self.manufacturer = Manufacturer.objects.create(label='Goulds', image_data=b'logo-bytes')
+        self.urls = [
+            f'/api/products/{self.product.id}/image/{self.image.id}/',
+            f'/api/galleries/repairs/images/{self.gallery_image.id}/',
+            f'/api/equipment/manufacturers/{self.manufacturer.id}/logo/',
+        ]
+
+    @staticmethod
+    def body(response):
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def blob_queries(self, queries):
+        """Queries selecting image_data itself (LENGTH() of it is fine)"""
+        selects_blob = re.compile(r'(?<!LENGTH\()"\w+"\."image_data"')
+        return [q['sql'] for q in queries.captured_queries if selects_blob.search(q['sql'].split(' FROM ')[0])]
+
+    def test_images_are_served(self):
+        for url, body in zip(self.urls, (b'product-image', b'gallery-image', b'logo-bytes')):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertEqual(self.body(response), body)
+            self.assertEqual(response['Content-Length'], str(len(body)))
+            self.assertEqual(response['Cache-Control'], 'public, no-cache')
+            self.assertIn('Last-Modified', response)
+        self.assertEqual(self.client.get(self.urls[0])['Content-Type'], 'image/png')
+
+    def test_revalidation_does_not_read_the_blob(self):
+        for url in self.urls:
+            etag = self.client.get(url)['ETag']
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(self.blob_queries(queries), [], url)
+
+    def test_stored_blob_is_served_from_disk_after_one_metadata_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.urls[1])
+        self.assertIsInstance(response, FileResponse)
+        image_queries = [q['sql'] for q in queries.captured_queries if 'galleries_galleryimage' in q['sql']]
+        # Slug is validated in the metadata query; no separate category lookup
+        self.assertEqual(len(image_queries), 1)
+        self.assertNotIn('"title"', image_queries[0])
+
+    def test_legacy_row_bytes_come_from_a_second_narrow_query(self):
+        GalleryImage.objects.filter(pk=self.gallery_image.pk).update(
+            image_data=b'legacy-image', blob_sha256='', blob_size=None
+        )
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.urls[1])
+        self.assertEqual(self.body(response), b'legacy-image')
+        image_queries = [q['sql'] for q in queries.captured_queries if 'galleries_galleryimage' in q['sql']]
+        self.assertEqual(len(image_queries), 2)
+        self.assertIn('LENGTH', image_queries[0])
+        self.assertNotIn('"title"', image_queries[1])
+
+    def test_missing_file_is_not_found(self):
+        get_blob_store().delete(self.manufacturer.blob_sha256)
+        self.assertEqual(self.client.get(self.urls[2]).status_code, 404)
+
+    def test_range_request(self):
+        response = self.client.get(self.urls[2], HTTP_RANGE='bytes=0-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.body(response), b'logo')
+        self.assertEqual(response['Content-Range'], 'bytes 0-3/10')
+
+    def test_missing_or_inactive(self):
+        self.assertEqual(self.client.get(f'/api/galleries/other/images/{self.gallery_image.id}/').status_code, 404)
+        GalleryCategory.objects.filter(pk=self.gallery.pk).update(active=False)
+        self.assertEqual(self.client.get(self.urls[1]).status_code, 404)
+        self.assertEqual(self.client.get('/api/equipment/manufacturers/999/logo/').status_code, 404)
+
+    def test_manufacturer_serializers_link_to_logo(self):
+        section = Section.objects.create(label='Pumps')
+        self.manufacturer.sections.add(section)
+        with CaptureQueriesContext(connection) as queries:
+            manufacturers = self.client.get('/api/equipment/manufacturers/').json()
+            sections = self.client.get('/api/equipment/sections/with-manufacturers/').json()
+        results = manufacturers.get('results', manufacturers)
+        expected = f'{self.urls[2]}?size=card&v={self.manufacturer.blob_sha256[:16]}'
+        self.assertEqual(results[0]['image_url'], expected)
+        self.assertEqual(sections[0]['manufacturers'][0]['image_url'], expected)
+        self.assertEqual(self.blob_queries(queries), [])
+
+    def test_fingerprinted_urls_are_immutable(self):
+        for url, obj in zip(self.urls, (self.image, self.gallery_image, self.manufacturer)):
+            versioned = versioned_url(url, obj.blob_sha256)
+            self.assertEqual(versioned, f'{url}?v={obj.blob_sha256[:16]}')
+            response = self.client.get(versioned)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+            # A stale fingerprint gets the current bytes, revalidated
+            response = self.client.get(url, {'v': '0' * 16})
+            self.assertEqual(response['Cache-Control'], 'public, no-cache')
+
+    def test_replaced_image_gets_a_new_url(self):
+        url = '/api/galleries/repairs/'
+        old = self.client.get(url).json()['images'][0]['image_url']
+        image = GalleryImage.objects.get(pk=self.gallery_image.pk)
+        image.image_data = b'new-gallery-image'
+        image.save()
+        new = self.client.get(url).json()['images'][0]['image_url']
+        self.assertNotEqual(old, new)
+        self.assertEqual(new, f'{self.urls[1]}?size=detail&v={image.blob_sha256[:16]}')
+        # The old URL no longer earns a year of caching
+        self.assertEqual(self.client.get(old)['Cache-Control'], 'public, no-cache')
+        self.assertEqual(self.client.get(new)['Cache-Control'], 'public, max-age=31536000, immutable')
+
+    @override_settings(BLOB_ACCEL_REDIRECT_PREFIX='/protected-blobs/')
+    def test_accel_redirect_handoff(self):
+        response = self.client.get(self.urls[2])
+        digest = self.manufacturer.blob_sha256
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-blobs/{digest[:2]}/{digest[2:4]}/{digest}')
+        self.assertEqual(response.content, b'')
+
+
+class BlobStoreTestCase(TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location, ignore_errors=True)
+        settings_override = override_settings(BLOB_STORE={
+            'BACKEND': 'core.storage.FileSystemBlobStore',
+            'OPTIONS': {'location': self.location},
+        })
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.store = get_blob_store()
+
+    def test_save_is_content_addressed_and_deduplicated(self):
+        digest, size = self.store.save(b'hello')
+        self.assertEqual(digest, hashlib.sha256(b'hello').hexdigest())
+        self.assertEqual(size, 5)
+        self.assertEqual(self.store.save(io.BytesIO(b'hello')), (digest, size))
+        self.assertEqual(self.store.path(digest), os.path.join(self.location, digest[:2], digest[2:4], digest))
+        self.assertEqual(self.store.read(digest), b'hello')
+        self.assertEqual([d for d, _, _ in self.store.iter_blobs()], [digest])
+        self.assertEqual(os.listdir(os.path.join(self.location, 'tmp')), [])
+
+    def test_invalid_digest_is_rejected(self):
+        with self.assertRaises(BlobNotFound):
+            self.store.open('../../settings.py')
+
+    def test_model_save_moves_bytes_to_the_store(self):
+        manufacturer = Manufacturer.objects.create(label='Goulds', image_data=b'logo-bytes')
+        row = Manufacturer.objects.values('image_data', 'blob_sha256', 'blob_size').get(pk=manufacturer.pk)
+        self.assertEqual(bytes(row['image_data']), b'')
+        self.assertEqual(row['blob_size'], 10)
+        self.assertEqual(Manufacturer.objects.get(pk=manufacturer.pk).read_blob(), b'logo-bytes')
+
+        # Saving without touching the file keeps it
+        manufacturer = Manufacturer.objects.defer('image_data').get(pk=manufacturer.pk)
+        manufacturer.label = 'Goulds Pumps'
+        manufacturer.save()
+        self.assertEqual(Manufacturer.objects.get(pk=manufacturer.pk).blob_sha256, row['blob_sha256'])
+
+    def test_migrate_blobs_moves_legacy_rows(self):
+        for label in ('A', 'B', 'C'):
+            Manufacturer.objects.create(label=label)
+        Manufacturer.objects.update(image_data=b'legacy')
+
+        out = io.StringIO()
+        version = get_version('equipment')
+        call_command('migrate_blobs', batch_size=2, stdout=out)
+        self.assertIn('Moved 3 blobs (18 bytes)', out.getvalue())
+        # Serialized logo URLs changed to fingerprinted ones
+        self.assertEqual(domains_for_model(Manufacturer), ['equipment'])
+        self.assertNotEqual(get_version('equipment'), version)
+
+        digest = hashlib.sha256(b'legacy').hexdigest()
+        self.assertEqual(set(Manufacturer.objects.values_list('blob_sha256', flat=True)), {digest})
+        self.assertEqual(len(list(self.store.iter_blobs())), 1)
+        self.assertEqual(Manufacturer.objects.filter(image_data=b'').count(), 3)
+
+        call_command('migrate_blobs', stdout=out)
+        self.assertIn('Moved 0 blobs', out.getvalue())
+
+    def test_gc_blobs_deletes_only_old_unreferenced_files(self):
+        kept = Manufacturer.objects.create(label='Kept', image_data=b'kept')
+        orphan, _ = self.store.save(b'orphan')
+        recent, _ = self.store.save(b'recent')
+        old = time.time() - 7200
+        os.utime(self.store.path(orphan), (old, old))
+        os.utime(self.store.path(kept.blob_sha256), (old, old))
+
+        out = io.StringIO()
+        call_command('gc_blobs', dry_run=True, stdout=out)
+        self.assertIn('Would delete 1 unreferenced blobs (6 bytes)', out.getvalue())
+        self.assertTrue(self.store.exists(orphan))
+
+        call_command('gc_blobs', stdout=out)
+        self.assertFalse(self.store.exists(orphan))
+        self.assertTrue(self.store.exists(recent))
+        self.assertTrue(self.store.exists(kept.blob_sha256))
+
+
+def make_jpeg(width, height, color='navy'):
+    output = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(output, format='JPEG')
+    return output.getvalue()
+
+
+class ImageDerivativeTestCase(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Pumps')
+        self.product = Product.objects.create(
+            name='Pump', description='Test', price=100, category=category, quantity=5
+        )
+        self.image = ProductImage.objects.create(
+            product=self.product, image_data=make_jpeg(1200, 800), content_type='image/jpeg'
+        )
+        self.url = f'/api/products/{self.product.id}/image/{self.image.id}/'
+
+    def get(self, size, accept='*/*', **extra):
+        return self.client.get(self.url, {'size': size}, HTTP_ACCEPT=accept, **extra)
+
+    def test_negotiation(self):
+        self.assertEqual(negotiate_format('image/avif,image/webp,image/apng,*/*;q=0.8'), 'avif')
+        self.assertEqual(negotiate_format('image/avif;q=0,image/webp'), 'webp')
+        self.assertEqual(negotiate_format('image/*,*/*'), 'jpeg')
+        self.assertEqual(negotiate_format(''), 'jpeg')
+
+    def test_sizes_and_formats(self):
+        for size, fmt, accept in (('card', 'jpeg', '*/*'), ('thumb', 'webp', 'image/webp,*/*'),
+                                  ('detail', 'avif', 'image/avif,image/webp,*/*')):
+            response = self.get(size, accept)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], f'image/{fmt}')
+            self.assertIn('Accept', response['Vary'])
+            with Image.open(io.BytesIO(b''.join(response.streaming_content))) as image:
+                self.assertEqual(image.format.lower(), fmt)
+                self.assertEqual(max(image.size), SIZES[size])
+
+    def test_small_images_are_not_upscaled(self):
+        ProductImage.objects.filter(pk=self.image.pk).delete()
+        image = ProductImage.objects.create(product=self.product, image_data=make_jpeg(120, 90))
+        response = self.client.get(f'/api/products/{self.product.id}/image/{image.id}/', {'size': 'full'})
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as rendered:
+            self.assertEqual(rendered.size, (120, 90))
+
+    def test_cached_derivative_is_not_rendered_again(self):
+        etag = self.get('card')['ETag']
+        with mock.patch('core.images.render') as render:
+            response = self.get('card')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.get('card', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        render.assert_not_called()
+        self.assertNotEqual(self.get('card', 'image/webp')['ETag'], etag)
+
+    def test_unknown_size_is_rejected(self):
+        self.assertEqual(self.get('huge').status_code, 400)
+
+    def test_undecodable_image_falls_back_to_original(self):
+        image = ProductImage.objects.create(product=self.product, image_data=b'<svg/>', order=1,
+                                            content_type='image/svg+xml')
+        response = self.client.get(f'/api/products/{self.product.id}/image/{image.id}/', {'size': 'card'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertEqual(b''.join(response.streaming_content), b'<svg/>')
+
+    def test_cache_evicts_least_recently_used(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        cache = DerivativeCache(location, max_size=1000)
+        for number in range(3):
+            path = cache.put(f'{number:02d}-key', b'x' * 300)
+            os.utime(path, (number, number))
+        cache.get('00-key')  # refreshes the oldest entry
+        cache.put('03-key', b'x' * 300)
+
+        remaining = sorted(os.path.basename(path) for _, _, path in cache.entries())
+        self.assertEqual(remaining, ['00-key', '02-key', '03-key'])
+
+    def test_backfill_command(self):
+        out = io.StringIO()
+        call_command('build_image_derivatives', workers=1, sizes='thumb,card', formats='jpeg,webp', stdout=out)
+        self.assertIn('Wrote 4 derivatives', out.getvalue())
+
+        call_command('build_image_derivatives', workers=1, sizes='thumb,card', formats='jpeg,webp', stdout=out)
+        self.assertIn('Wrote 0 derivatives', out.getvalue())
+        with mock.patch('core.images.render') as render:
+            self.assertEqual(self.get('thumb', 'image/webp').status_code, 200)
+        render.assert_not_called()
+
+
+class RendererTestCase(TestCase):
+    def sample(self):
+        import datetime
+        import decimal
+        import uuid
+        from django.utils import timezone
+        from django.utils.translation import gettext_lazy
+        return {
+            'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+            'price': decimal.Decimal('2499.99'),
+            'created': timezone.make_aware(datetime.datetime(2024, 5, 1, 12, 30, 15, 123456), datetime.timezone.utc),
+            'naive': datetime.datetime(2024, 5, 1, 12, 30),
+            'day': datetime.date(2024, 5, 1),
+            'took': datetime.timedelta(seconds=1.5),
+            'label': gettext_lazy('Name'),
+            'text': 'Ünïcode   "quoted" </script>',
+            'counts': {1: 'one', 2: 'two'},
+            'nested': [1, 2.5, None, True, ('a', 'b')],
+            'queryset': Category.objects.values_list('name', flat=True),
+            'big': 2 ** 70,
+        }
+
+    def test_orjson_output_matches_json_renderer(self):
+        from rest_framework.renderers import JSONRenderer
+        from .renderers import ORJSONRenderer
+        Category.objects.create(name='Pumps')
+        data = self.sample()
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        del data['big']
+        with mock.patch.object(JSONRenderer, 'render') as fallback:
+            rendered = ORJSONRenderer().render(data)
+        fallback.assert_not_called()
+        self.assertEqual(rendered, JSONRenderer().render(data))
+        # Indented output for the browsable API
+        context = {'indent': 4}
+        self.assertEqual(ORJSONRenderer().render(data, renderer_context=context), JSONRenderer().render(data, renderer_context=context))
+
+    def test_msgpack_uses_the_same_conversions(self):
+        import json
+        import msgpack
+        from rest_framework.renderers import JSONRenderer
+        from .renderers import MessagePackRenderer
+        data = self.sample()
+        del data['counts'], data['big']  # msgpack keeps integer keys as integers
+        self.assertEqual(
+            msgpack.unpackb(MessagePackRenderer().render(data)),
+            json.loads(JSONRenderer().render(data)),
+        )
+
+    def test_accept_header_selects_the_renderer(self):
+        import msgpack
+        Product.objects.create(
+            name='Pump', description='Test', price='2499.99', category=Category.objects.create(name='Pumps'), quantity=1,
+        )
+        response = self.client.get('/api/products/')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        json_data = response.json()
+        self.assertEqual(json_data['results'][0]['price'], '2499.99')
+
+        response = self.client.get('/api/products/', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), json_data)
+
+    def test_parser(self):
+        from rest_framework.exceptions import ParseError
+        from .parsers import ORJSONParser
+        self.assertEqual(ORJSONParser().parse(io.BytesIO('{"a": [1, 2.5, "é"]}'.encode())), {'a': [1, 2.5, 'é']})
+        for body in (b'{"a": NaN}', b'{', '{"a": "é"}'.encode('latin-1')):
+            with self.assertRaises(ParseError):
+                ORJSONParser().parse(io.BytesIO(body))
+        self.assertEqual(
+            ORJSONParser().parse(io.BytesIO('{"a": "é"}'.encode('latin-1')), parser_context={'encoding': 'latin-1'}),
+            {'a': 'é'},
+        )
+
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    DEFAULT_FROM_EMAIL='shop@example.com',
+    OWNER_EMAIL='owner@example.com',
+)
+class OutboxTestCase(TestCase):
+    def test_queued_mail_is_delivered_by_the_worker(self):
+        from django.core import mail
+        from . import outbox
+
+        message = outbox.queue_mail('Order paid', 'Body', ['owner@example.com'])
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(outbox.deliver_due(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Order paid')
+        self.assertEqual(mail.outbox[0].from_email, 'shop@example.com')
+        self.assertEqual(mail.outbox[0].to, ['owner@example.com'])
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), (OutboxMessage.SENT, 1))
+        self.assertEqual(outbox.deliver_due(), (0, 0))
+
+    def test_mail_is_only_queued_with_its_transaction(self):
+        from django.db import transaction
+        from . import outbox
+
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                outbox.queue_mail('Order paid', 'Body', ['owner@example.com'])
+                raise RuntimeError('rolled back')
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_empty_recipients_are_dropped(self):
+        from . import outbox
+
+        with self.assertLogs('core.outbox', 'WARNING'):
+            self.assertIsNone(outbox.queue_mail('Order paid', 'Body', ['']))
+        self.assertEqual(outbox.queue_mail('Order paid', 'Body', ['', 'a@example.com']).to, ['a@example.com'])
+
+    def test_batch_uses_one_connection(self):
+        from django.core.mail import get_connection
+        from . import outbox
+
+        for i in range(5):
+            outbox.queue_mail(f'Message {i}', 'Body', ['owner@example.com'])
+        with mock.patch('core.outbox.get_connection', wraps=get_connection) as connect:
+            self.assertEqual(outbox.deliver_due(limit=3), (3, 0))
+            self.assertEqual(outbox.deliver_due(limit=3), (2, 0))
+        self.assertEqual(connect.call_count, 2)
+
+    def test_failures_back_off_exponentially(self):
+        from datetime import timedelta
+        from django.core import mail
+        from django.utils import timezone
+        from . import outbox
+
+        message = outbox.queue_mail('Order paid', 'Body', ['owner@example.com'])
+        now = timezone.now()
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            with self.assertLogs('core.outbox', 'WARNING'):
+                self.assertEqual(outbox.deliver_due(now=now), (0, 1))
+                message.refresh_from_db()
+                self.assertEqual(message.next_attempt_at, now + timedelta(seconds=outbox.RETRY_BASE_DELAY))
+                # Not due again until then
+                self.assertEqual(outbox.deliver_due(now=now), (0, 0))
+                later = message.next_attempt_at
+                self.assertEqual(outbox.deliver_due(now=later), (0, 1))
+        message.refresh_from_db()
+        self.assertEqual(message.attempts, 2)
+        self.assertEqual(message.last_error, 'down')
+        self.assertEqual(message.next_attempt_at, later + timedelta(seconds=outbox.RETRY_BASE_DELAY * 2))
+
+        self.assertEqual(outbox.deliver_due(now=message.next_attempt_at), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_gives_up_after_max_attempts(self):
+        from . import outbox
+
+        message = outbox.queue_mail('Order paid', 'Body', ['owner@example.com'])
+        message.attempts = outbox.MAX_ATTEMPTS - 1
+        message.save()
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            with self.assertLogs('core.outbox', 'ERROR'):
+                outbox.deliver_due()
+        message.refresh_from_db()
+        self.assertEqual(message.status, OutboxMessage.FAILED)
+        self.assertEqual(outbox.stats()['failed'], 1)
+
+    def test_unreachable_server_does_not_use_up_attempts(self):
+        from datetime import timedelta
+        from django.core import mail
+        from django.utils import timezone
+        from . import outbox
+
+        messages = [outbox.queue_mail(f'Message {i}', 'Body', ['owner@example.com']) for i in range(3)]
+        now = timezone.now()
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open', side_effect=OSError('refused')):
+            with self.assertLogs('core.outbox', 'WARNING'):
+                for _ in range(outbox.MAX_ATTEMPTS + 2):
+                    self.assertEqual(outbox.deliver_due(limit=2, now=now), (0, 2))
+                    # The whole queue was put back, not just the batch
+                    self.assertEqual(outbox.deliver_due(limit=2, now=now), (0, 0))
+                    now += timedelta(seconds=outbox.RETRY_BASE_DELAY)
+        for message in messages:
+            message.refresh_from_db()
+            self.assertEqual((message.status, message.attempts), (OutboxMessage.PENDING, 0))
+            self.assertEqual(message.last_error, 'refused')
+
+        self.assertEqual(outbox.deliver_due(now=now), (3, 0))
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_retry_delay_is_capped(self):
+        from . import outbox
+
+        self.assertEqual(outbox.retry_delay(1), outbox.RETRY_BASE_DELAY)
+        self.assertEqual(outbox.retry_delay(3), outbox.RETRY_BASE_DELAY * 4)
+        self.assertEqual(outbox.retry_delay(50), outbox.RETRY_MAX_DELAY)
+
+    def test_stats(self):
+        from . import outbox
+
+        outbox.queue_mail('First', 'Body', ['owner@example.com'])
+        outbox.deliver_due()
+        outbox.queue_mail('Second', 'Body', ['owner@example.com'])
+        stats = outbox.stats()
+        self.assertEqual((stats['pending'], stats['due'], stats['sent']), (1, 1, 1))
+        self.assertIsNotNone(stats['oldest_pending_seconds'])
+        self.assertEqual(stats['delivery_latency']['count'], 1)
+
+        out = io.StringIO()
+        call_command('deliver_outbox', stdout=out)
+        self.assertIn('Sent 1 emails, 0 failed', out.getvalue())
+
+    def test_stats_endpoint_requires_staff(self):
+        response = self.client.get('/api/outbox/stats/')
+        self.assertIn(response.status_code, (401, 403))
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        self.assertEqual(self.client.get('/api/outbox/stats/').json()['pending'], 0)
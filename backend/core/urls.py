@@ -0,0 +1,7 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('cache/stats/', views.response_cache_stats, name='response-cache-stats'),
+    path('outbox/stats/', views.outbox_stats, name='outbox-stats'),
+]
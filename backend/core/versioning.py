@@ -0,0 +1,97 @@
+"""
+Per-domain content versions for cache invalidation.
+
+Each app registers the models that make up its public catalog data with
+``register_versioned_models``. Saving or deleting any of them bumps the
+domain's version inside the same transaction, so every gunicorn worker
+sees the new version as soon as the change is committed.
+"""
+import uuid
+
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.utils import timezone
+
+from .models import ContentVersion
+
+# Version reported for a domain that has never been bumped
+INITIAL_VERSION = '0'
+
+# Model label -> domains it is registered in
+_model_domains = {}
+
+
+def get_versions(*domains):
+    """Return {domain: (version, updated_at)} with one query"""
+    versions = {domain: (INITIAL_VERSION, None) for domain in domains}
+    for domain, version, updated_at in ContentVersion.objects.filter(
+        domain__in=domains
+    ).values_list('domain', 'version', 'updated_at'):
+        versions[domain] = (version, updated_at)
+    return versions
+
+
+def get_request_versions(request, *domains):
+    """
+    ``get_versions`` memoized on the request, so stacked decorators
+    (conditional GET, response cache) share one query
+    """
+    memo = request.__dict__.setdefault('_content_versions', {})
+    if domains not in memo:
+        memo[domains] = get_versions(*domains)
+    return memo[domains]
+
+
+def get_version(*domains):
+    """Return a single string that changes whenever any of the domains change"""
+    versions = get_versions(*domains)
+    return '.'.join(versions[domain][0] for domain in domains)
+
+
+def bump_version(domain):
+    """Give ``domain`` a new version token"""
+    token = uuid.uuid4().hex
+    updated = ContentVersion.objects.filter(domain=domain).update(
+        version=token, updated_at=timezone.now()
+    )
+    if not updated:
+        try:
+            with transaction.atomic():
+                ContentVersion.objects.create(domain=domain, version=token)
+        except IntegrityError:
+            # Another request created the row first
+            ContentVersion.objects.filter(domain=domain).update(
+                version=token, updated_at=timezone.now()
+            )
+    return token
+
+
+def register_versioned_models(domain, *models):
+    """Bump ``domain`` whenever one of ``models`` is saved or deleted"""
+
+    def handle_change(sender, raw=False, **kwargs):
+        if raw:
+            return
+        bump_version(domain)
+
+    def handle_m2m_change(sender, action, **kwargs):
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            bump_version(domain)
+
+    for model in models:
+        _model_domains.setdefault(model._meta.label_lower, set()).add(domain)
+        uid = f'content_version:{domain}:{model._meta.label}'
+        post_save.connect(handle_change, sender=model, weak=False, dispatch_uid=uid)
+        post_delete.connect(handle_change, sender=model, weak=False, dispatch_uid=uid)
+        for field in model._meta.local_many_to_many:
+            m2m_changed.connect(
+                handle_m2m_change,
+                sender=field.remote_field.through,
+                weak=False,
+                dispatch_uid=f'{uid}:{field.name}',
+            )
+
+
+def domains_for_model(model):
+    """Domains ``model`` is registered in, for changes made without signals"""
+    return sorted(_model_domains.get(model._meta.label_lower, ()))
@@ -0,0 +1,24 @@
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+from . import outbox
+from .caching import get_cache_stats
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def response_cache_stats(request):
+    """
+    Response cache hit/miss counters for the worker that served the request
+    """
+    return Response(get_cache_stats())
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def outbox_stats(request):
+    """
+    Email outbox queue depth and recent delivery latency
+    """
+    return Response(outbox.stats())
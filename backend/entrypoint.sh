@@ -39,6 +39,23 @@ python manage.py check --database default
 echo "Ensuring superuser exists..."
 python manage.py ensure_superuser
 
+# Move any file bytes still stored in the database into the blob store
+echo "Migrating blobs to the blob store..."
+python manage.py migrate_blobs
+
+# Reparse specification values (picks up changes to the unit table)
+echo "Rebuilding specification index..."
+python manage.py rebuild_spec_index
+
+# Precompute related products (re-run periodically to pick up new views/orders)
+echo "Building related products..."
+python manage.py build_related_products
+
+# Return stock held by checkouts abandoned while the server was down
+# (the reservation-sweeper service keeps doing so while it runs)
+echo "Releasing expired stock reservations..."
+python manage.py release_expired_reservations
+
 # Collect static files
 echo "Collecting static files..."
 python manage.py collectstatic --noinput
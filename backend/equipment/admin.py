@@ -45,7 +45,7 @@ class ManufacturerAdminForm(forms.ModelForm):
         # Make URL field explicitly optional
         self.fields['url'].required = False
         # If this is an existing instance with image data, show a preview
-        if self.instance and self.instance.pk and self.instance.image_data:
+        if self.instance and self.instance.pk and self.instance.has_blob:
             self.fields['current_image'] = forms.CharField(
                 required=False,
                 widget=forms.HiddenInput(),
@@ -61,7 +61,7 @@ class ManufacturerAdminForm(forms.ModelForm):
             raise forms.ValidationError("An image file is required for new manufacturers.")
         
         # For existing instances without image_data, require an image file
-        if self.instance.pk and not self.instance.image_data and not image_file:
+        if self.instance.pk and not self.instance.has_blob and not image_file:
             raise forms.ValidationError("An image file is required.")
             
         return cleaned_data
@@ -94,7 +94,7 @@ class ManufacturerAdmin(admin.ModelAdmin):
     ordering = ['label']
     
     def image_preview(self, obj):
-        if obj and obj.image_data:
+        if obj and obj.has_blob:
             return mark_safe(f'<img src="{obj.data_url}" style="max-height: 200px; max-width: 200px; border: 1px solid #ddd;" />')
         return "No image"
     image_preview.short_description = "Current Image"
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class EquipmentConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'equipment'
+
+    def ready(self):
+        from core.versioning import register_versioned_models
+        from .models import EquipmentCategory, Section, Manufacturer
+
+        register_versioned_models('equipment', EquipmentCategory, Section, Manufacturer)
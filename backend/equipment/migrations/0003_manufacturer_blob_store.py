@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipment', '0002_move_data_from_products'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='manufacturer',
+            name='blob_sha256',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='manufacturer',
+            name='blob_size',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='manufacturer',
+            name='image_data',
+            field=models.BinaryField(blank=True, default=b'', help_text='Manufacturer logo image'),
+        ),
+    ]
@@ -1,7 +1,7 @@
 from django.db import models
+from django.db.models.functions import Coalesce, Length
 import base64
-from PIL import Image
-import io
+from core.models import StoredBlobModel
 
 
 class EquipmentCategory(models.Model):
@@ -43,13 +43,27 @@ class Section(models.Model):
         return f"{self.label} ({self.equipment_category.name})"
 
 
-class Manufacturer(models.Model):
+class ManufacturerQuerySet(models.QuerySet):
+    def without_logo_data(self):
+        """
+        Defer the logo bytes and annotate ``logo_size`` instead, so
+        serializers can link to the logo endpoint without loading it.
+        """
+        return self.defer('image_data').annotate(
+            logo_size=Coalesce('blob_size', Length('image_data'), output_field=models.BigIntegerField())
+        )
+
+
+class Manufacturer(StoredBlobModel):
     """
     Manufacturers with logos, URLs, and section tags
     """
+    blob_field = 'image_data'
+    image_derivatives = True
+
     label = models.CharField(max_length=100)
     url = models.URLField(help_text="Manufacturer's website URL", blank=True, null=True)
-    image_data = models.BinaryField(help_text="Manufacturer logo image")
+    image_data = models.BinaryField(blank=True, default=b'', help_text="Manufacturer logo image")
     order = models.PositiveIntegerField(default=0)
     filename = models.CharField(max_length=255, blank=True, null=True)
     content_type = models.CharField(max_length=100, default='image/jpeg')
@@ -57,44 +71,29 @@ class Manufacturer(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ManufacturerQuerySet.as_manager()
+
     class Meta:
         ordering = ['label']
 
     def __str__(self):
         return self.label
 
+    @property
+    def logo_url(self):
+        return f'/api/equipment/manufacturers/{self.id}/logo/'
+
     @property
     def image_base64(self):
         """Return base64 encoded image data"""
-        if self.image_data:
-            return base64.b64encode(self.image_data).decode('utf-8')
+        if self.has_blob:
+            return base64.b64encode(self.read_blob()).decode('utf-8')
         return None
 
     @property
     def data_url(self):
         """Return data URL for the image"""
-        if self.image_data:
+        if self.has_blob:
             base64_data = self.image_base64
             return f"data:{self.content_type};base64,{base64_data}"
         return None
-
-    def save(self, *args, **kwargs):
-        if self.image_data and isinstance(self.image_data, bytes):
-            try:
-                image = Image.open(io.BytesIO(self.image_data))
-
-                if image.mode in ('RGBA', 'P'):
-                    image = image.convert('RGB')
-
-                # Resize longest side to 300px, keep aspect ratio
-                image.thumbnail((300, 300), Image.Resampling.LANCZOS)
-
-                output = io.BytesIO()
-                image.save(output, format='JPEG', quality=90)
-                self.image_data = output.getvalue()
-                self.content_type = 'image/jpeg'
-
-            except Exception:
-                pass
-
-        super().save(*args, **kwargs)
\ No newline at end of file
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from core.images import sized_url
 from .models import EquipmentCategory, Section, Manufacturer
 import base64
 
@@ -27,9 +28,10 @@ class ManufacturerSerializer(serializers.ModelSerializer):
         fields = ['id', 'label', 'url', 'image_url', 'order', 'sections', 'created_at', 'updated_at']
 
     def get_image_url(self, obj):
-        if obj.image_data:
-            return obj.data_url
-        return None
+        # logo_size comes from Manufacturer.objects.without_logo_data()
+        size = getattr(obj, 'logo_size', None)
+        has_logo = size if size is not None else obj.has_blob
+        return sized_url(obj.logo_url, 'card', obj.blob_sha256) if has_logo else None
 
 
 class ManufacturerUploadSerializer(serializers.ModelSerializer):
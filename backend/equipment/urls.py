@@ -14,5 +14,6 @@ urlpatterns = [
     # Manufacturers
     path('manufacturers/', views.ManufacturerListView.as_view(), name='manufacturers'),
     path('manufacturers/<int:pk>/', views.ManufacturerDetailView.as_view(), name='manufacturer-detail'),
+    path('manufacturers/<int:pk>/logo/', views.ManufacturerLogoView.as_view(), name='manufacturer-logo'),
     path('manufacturers/upload/', views.upload_manufacturer, name='upload-manufacturer'),
 ]
\ No newline at end of file
@@ -4,6 +4,11 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
 from django.db.models import Prefetch
+from django.utils.decorators import method_decorator
+
+from core.blobs import BlobServer, IgnoreClientContentNegotiation
+from core.caching import cache_response
+from core.conditional import condition_on_version
 
 from .models import EquipmentCategory, Section, Manufacturer
 from .serializers import (
@@ -14,7 +19,10 @@ from .serializers import (
     SectionWithManufacturersSerializer
 )
 
+manufacturer_logo_server = BlobServer(Manufacturer, 'image_data', default_content_type='image/jpeg')
+
 
+@method_decorator(condition_on_version('equipment'), name='dispatch')
 class EquipmentCategoryListView(APIView):
     """
     List all active equipment categories
@@ -25,6 +33,8 @@ class EquipmentCategoryListView(APIView):
         return Response(serializer.data)
 
 
+@condition_on_version('equipment')
+@cache_response('equipment')
 @api_view(['GET'])
 def equipment_category_detail(request, slug):
     """
@@ -39,7 +49,7 @@ def equipment_category_detail(request, slug):
     sections = Section.objects.filter(equipment_category=category).prefetch_related(
         Prefetch(
             'manufacturers',
-            queryset=Manufacturer.objects.order_by('order')
+            queryset=Manufacturer.objects.without_logo_data().order_by('order')
         )
     )
     
@@ -57,6 +67,7 @@ def equipment_category_detail(request, slug):
     return Response(category_data)
 
 
+@method_decorator(condition_on_version('equipment'), name='dispatch')
 class SectionListView(APIView):
     """
     List all sections without pagination
@@ -74,13 +85,15 @@ class SectionListView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@method_decorator(condition_on_version('equipment'), name='dispatch')
 class SectionDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Section.objects.all()
     serializer_class = SectionSerializer
 
 
+@method_decorator(condition_on_version('equipment'), name='dispatch')
 class ManufacturerListView(generics.ListAPIView):
-    queryset = Manufacturer.objects.prefetch_related('sections')
+    queryset = Manufacturer.objects.without_logo_data().prefetch_related('sections')
     serializer_class = ManufacturerSerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter]
     filterset_fields = ['sections']
@@ -97,11 +110,27 @@ class ManufacturerListView(generics.ListAPIView):
         return queryset
 
 
+@method_decorator(condition_on_version('equipment'), name='dispatch')
 class ManufacturerDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Manufacturer.objects.prefetch_related('sections')
+    queryset = Manufacturer.objects.without_logo_data().prefetch_related('sections')
     serializer_class = ManufacturerSerializer
 
 
+class ManufacturerLogoView(APIView):
+    """
+    Serve a manufacturer's logo with caching headers
+    """
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request, pk):
+        manufacturer = manufacturer_logo_server.get_metadata(Manufacturer.objects.all(), pk=pk)
+        if manufacturer is None:
+            return Response({'error': 'Logo not found'}, status=404)
+        return manufacturer_logo_server.respond(request, manufacturer) or Response(
+            {'error': 'Logo not found'}, status=404
+        )
+
+
 @api_view(['POST'])
 def upload_manufacturer(request):
     """
@@ -118,6 +147,8 @@ def upload_manufacturer(request):
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@condition_on_version('equipment')
+@cache_response('equipment')
 @api_view(['GET'])
 def sections_with_manufacturers(request):
     """
@@ -127,7 +158,7 @@ def sections_with_manufacturers(request):
     sections = Section.objects.prefetch_related(
         Prefetch(
             'manufacturers',
-            queryset=Manufacturer.objects.order_by('order')
+            queryset=Manufacturer.objects.without_logo_data().order_by('order')
         )
     ).select_related('equipment_category').all()
     
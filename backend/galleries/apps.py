@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class GalleriesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'galleries'
+
+    def ready(self):
+        from core.versioning import register_versioned_models
+        from .models import GalleryCategory, GalleryImage
+
+        register_versioned_models('galleries', GalleryCategory, GalleryImage)
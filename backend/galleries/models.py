@@ -1,7 +1,6 @@
 from django.db import models
 import base64
-from PIL import Image
-import io
+from core.models import StoredBlobModel
 
 
 class GalleryCategory(models.Model):
@@ -26,14 +25,17 @@ class GalleryCategory(models.Model):
         return self.name
 
 
-class GalleryImage(models.Model):
+class GalleryImage(StoredBlobModel):
     """
     Gallery images associated with categories
     """
+    blob_field = 'image_data'
+    image_derivatives = True
+
     category = models.ForeignKey(GalleryCategory, on_delete=models.CASCADE, related_name='images')
     title = models.CharField(max_length=200)
     description = models.TextField(blank=True)
-    image_data = models.BinaryField()
+    image_data = models.BinaryField(blank=True, default=b'')
     filename = models.CharField(max_length=255, blank=True, null=True)
     content_type = models.CharField(max_length=100, default='image/jpeg')
     alt_text = models.CharField(max_length=200, blank=True)
@@ -56,35 +58,14 @@ class GalleryImage(models.Model):
     @property
     def image_base64(self):
         """Return base64 encoded image data"""
-        if self.image_data:
-            return base64.b64encode(self.image_data).decode('utf-8')
+        if self.has_blob:
+            return base64.b64encode(self.read_blob()).decode('utf-8')
         return None
 
     @property
     def data_url(self):
         """Return data URL for the image"""
-        if self.image_data:
+        if self.has_blob:
             base64_data = self.image_base64
             return f"data:{self.content_type};base64,{base64_data}"
         return None
-
-    def save(self, *args, **kwargs):
-        if self.image_data and isinstance(self.image_data, bytes):
-            try:
-                image = Image.open(io.BytesIO(self.image_data))
-
-                if image.mode in ('RGBA', 'P'):
-                    image = image.convert('RGB')
-
-                # Resize to max width/height of 1200px, keep aspect ratio
-                image.thumbnail((1200, 1200), Image.Resampling.LANCZOS)
-
-                output = io.BytesIO()
-                image.save(output, format='JPEG', quality=90)
-                self.image_data = output.getvalue()
-                self.content_type = 'image/jpeg'
-
-            except Exception:
-                pass
-
-        super().save(*args, **kwargs)
@@ -1,14 +1,17 @@
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from django.http import HttpResponse
-from django.utils.http import http_date
-from django.utils import timezone
-from datetime import timedelta
-import hashlib
+from core.blobs import BlobServer, IgnoreClientContentNegotiation
+from core.images import sized_url, srcset
+from core.caching import cache_response
+from core.conditional import condition_on_version
 from .models import GalleryCategory, GalleryImage
 
+gallery_image_server = BlobServer(GalleryImage, 'image_data', default_content_type='image/jpeg')
 
+
+@condition_on_version('galleries')
+@cache_response('galleries')
 @api_view(['GET'])
 def gallery_categories(request):
     """
@@ -32,6 +35,7 @@ def gallery_categories(request):
     return Response(data)
 
 
+@condition_on_version('galleries')
 @api_view(['GET'])
 def gallery_category_detail(request, slug):
     """
@@ -43,7 +47,7 @@ def gallery_category_detail(request, slug):
         return Response({'error': 'Gallery category not found'}, status=404)
     
     # Get images for this category
-    images = GalleryImage.objects.filter(category=category).order_by('order', 'created_at')
+    images = GalleryImage.objects.filter(category=category).defer('image_data').order_by('order', 'created_at')
     
     # Build response data
     category_data = {
@@ -64,7 +68,8 @@ def gallery_category_detail(request, slug):
             'description': image.description,
             'alt_text': image.alt_text,
             'order': image.order,
-            'image_url': f'/api/galleries/{category.slug}/images/{image.id}/',
+            'image_url': sized_url(f'/api/galleries/{category.slug}/images/{image.id}/', 'detail', image.blob_sha256),
+            'image_srcset': srcset(f'/api/galleries/{category.slug}/images/{image.id}/', image.blob_sha256),
             'created_at': image.created_at,
         })
     
@@ -75,41 +80,13 @@ class GalleryImageView(APIView):
     """
     Serve individual gallery images with caching headers
     """
+    content_negotiation_class = IgnoreClientContentNegotiation
+
     def get(self, request, slug, image_id):
-        try:
-            # Get the category first to validate slug
-            category = GalleryCategory.objects.get(slug=slug, active=True)
-            image = GalleryImage.objects.get(id=image_id, category=category)
-        except (GalleryCategory.DoesNotExist, GalleryImage.DoesNotExist):
-            return Response({'error': 'Image not found'}, status=404)
-        
-        if not image.image_data:
-            return Response({'error': 'No image data'}, status=404)
-        
-        # Generate ETag based on metadata only (never touch image_data)
-        etag_data = f"{image.id}-{image.updated_at.isoformat()}"
-        etag = hashlib.md5(etag_data.encode()).hexdigest()
-        
-        # Check if client has cached version
-        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
-        if if_none_match == f'"{etag}"':
-            response = HttpResponse(status=304)
-            response['ETag'] = f'"{etag}"'
-            return response
-        
-        # Create response with image data
-        response = HttpResponse(
-            image.image_data,
-            content_type=image.content_type or 'image/jpeg'
+        # One query validates the slug and loads the image metadata
+        image = gallery_image_server.get_metadata(
+            GalleryImage.objects.all(), id=image_id, category__slug=slug, category__active=True
         )
-        
-        # Add caching headers
-        max_age = 86400  # 24 hours
-        expires = timezone.now() + timedelta(seconds=max_age)
-        
-        response['Cache-Control'] = f'public, max-age={max_age}, immutable'
-        response['ETag'] = f'"{etag}"'
-        response['Expires'] = http_date(expires.timestamp())
-        response['Last-Modified'] = http_date(image.updated_at.timestamp())
-        
-        return response
+        if image is None:
+            return Response({'error': 'Image not found'}, status=404)
+        return gallery_image_server.respond(request, image) or Response({'error': 'No image data'}, status=404)
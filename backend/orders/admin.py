@@ -3,7 +3,7 @@ from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
 from django.db.models import Sum, Count
-from .models import Order, OrderItem
+from .models import Order, OrderItem, StockReservation, StripeEvent, StripePriceMapping
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -20,6 +20,16 @@ class OrderItemInline(admin.TabularInline):
         return "$0.00"
     formatted_total.short_description = "Total"
 
+class StockReservationInline(admin.TabularInline):
+    model = StockReservation
+    extra = 0
+    can_delete = False
+    fields = ['product', 'quantity', 'status', 'expires_at', 'updated_at']
+    readonly_fields = fields
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = [
@@ -29,7 +39,7 @@ class OrderAdmin(admin.ModelAdmin):
     list_filter = ['status', 'payment_status', 'created_at', 'billing_country']
     search_fields = ['order_number', 'customer_email', 'customer_first_name', 'customer_last_name']
     readonly_fields = ['order_number', 'created_at', 'updated_at', 'confirmation_token', 'order_summary', 'secure_links']
-    inlines = [OrderItemInline]
+    inlines = [OrderItemInline, StockReservationInline]
     list_per_page = 25
     date_hierarchy = 'created_at'
     
@@ -274,3 +284,25 @@ class OrderItemAdmin(admin.ModelAdmin):
         )
     total_display.short_description = "Total"
     readonly_fields = ['total_price']
+
+
+@admin.register(StripeEvent)
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ['event_id', 'type', 'status', 'attempts', 'received_at', 'processed_at', 'processing_ms']
+    list_filter = ['status', 'type']
+    search_fields = ['event_id']
+    readonly_fields = [field.name for field in StripeEvent._meta.fields]
+    date_hierarchy = 'received_at'
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(StripePriceMapping)
+class StripePriceMappingAdmin(admin.ModelAdmin):
+    list_display = ['product_name', 'unit_amount', 'currency', 'stripe_product_id', 'stripe_price_id', 'updated_at']
+    search_fields = ['product_name', 'stripe_product_id', 'stripe_price_id']
+    readonly_fields = [field.name for field in StripePriceMapping._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
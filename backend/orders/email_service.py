@@ -1,15 +1,22 @@
-from django.core.mail import send_mail
 from django.conf import settings
+from django.db import DatabaseError
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from decimal import Decimal
 import logging
 from company.models import CompanyInfo
+from core.outbox import queue_mail
 
 logger = logging.getLogger(__name__)
 
 class OrderEmailService:
-    """Service to handle order-related email notifications"""
+    """
+    Service to handle order-related email notifications. Emails are queued
+    in the outbox (core.outbox), in the caller's transaction, and delivered
+    by the deliver_outbox worker. A database error while queueing is raised,
+    not reported as False: it leaves the caller's transaction unusable, and
+    the change the email reports must roll back with it.
+    """
     
     @staticmethod
     def _get_admin_order_url(order):
@@ -141,20 +148,21 @@ View Order: {admin_url}
 You can click the link above to view and manage the full order details in the admin panel.
             """
             
-            # Send email to owner
-            send_mail(
+            # Queue email to owner
+            queue_mail(
                 subject=subject,
                 message=email_body,
-                from_email=settings.DEFAULT_FROM_EMAIL,
                 recipient_list=[settings.OWNER_EMAIL],
-                fail_silently=False,
+                from_email=settings.DEFAULT_FROM_EMAIL,
             )
             
-            logger.info(f"Payment success notification sent for order {order.order_number}")
+            logger.info(f"Payment success notification queued for order {order.order_number}")
             return True
             
+        except DatabaseError:
+            raise
         except Exception as e:
-            logger.error(f"Failed to send payment success notification for order {order.order_number}: {str(e)}")
+            logger.error(f"Failed to queue payment success notification for order {order.order_number}: {str(e)}")
             return False
     
     @staticmethod
@@ -238,20 +246,21 @@ View Order: {admin_url}
 You can click the link above to view the order details in the admin panel.
             """
             
-            # Send email to owner
-            send_mail(
+            # Queue email to owner
+            queue_mail(
                 subject=subject,
                 message=email_body,
-                from_email=settings.DEFAULT_FROM_EMAIL,
                 recipient_list=[settings.OWNER_EMAIL],
-                fail_silently=False,
+                from_email=settings.DEFAULT_FROM_EMAIL,
             )
             
-            logger.info(f"Payment {action_type.lower()} notification sent for order {order.order_number}")
+            logger.info(f"Payment {action_type.lower()} notification queued for order {order.order_number}")
             return True
             
+        except DatabaseError:
+            raise
         except Exception as e:
-            logger.error(f"Failed to send payment {action_type.lower()} notification for order {order.order_number}: {str(e)}")
+            logger.error(f"Failed to queue payment {action_type.lower()} notification for order {order.order_number}: {str(e)}")
             return False
     
     @staticmethod
@@ -301,17 +310,18 @@ Phone: [Your phone number]
 Email: {settings.DEFAULT_FROM_EMAIL}
             """
             
-            send_mail(
+            queue_mail(
                 subject=subject,
                 message=email_body,
-                from_email=settings.DEFAULT_FROM_EMAIL,
                 recipient_list=[order.customer_email],
-                fail_silently=True,  # Don't fail if customer email fails
+                from_email=settings.DEFAULT_FROM_EMAIL,
             )
             
-            logger.info(f"Customer confirmation sent for order {order.order_number}")
+            logger.info(f"Customer confirmation queued for order {order.order_number}")
             return True
             
+        except DatabaseError:
+            raise
         except Exception as e:
-            logger.error(f"Failed to send customer confirmation for order {order.order_number}: {str(e)}")
+            logger.error(f"Failed to queue customer confirmation for order {order.order_number}: {str(e)}")
             return False
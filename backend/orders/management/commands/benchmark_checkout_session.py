@@ -0,0 +1,88 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from orders.models import Order, StripePriceMapping
+from orders.stripe_service import StripeService
+from orders.stripe_stub import StripeStub
+from products.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Time creating a checkout session against a local Stripe stub with a fixed '
+        'round-trip latency: the first checkout of new products, checkouts that look '
+        'every price up in Stripe (no local mapping), and checkouts served from the '
+        'mapping. Seeds its data inside a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--items',
+            type=int,
+            default=5,
+            help='Cart lines per checkout (default: 5)'
+        )
+        parser.add_argument(
+            '--latency',
+            type=float,
+            default=40,
+            help='Milliseconds the stub waits before answering each request (default: 40)'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=10,
+            help='Timed checkouts per case (default: 10)'
+        )
+
+    def handle(self, *args, **options):
+        with StripeStub(latency=options['latency'] / 1000) as stub, transaction.atomic():
+            order, items = self.seed(options['items'])
+
+            self.stdout.write(f"{'case':<12}{'median ms':>12}{'stripe calls':>14}")
+            cases = [
+                ('cold', 1, lambda: None),
+                ('no mapping', options['repeat'], lambda: StripePriceMapping.objects.all().delete()),
+                ('mapped', options['repeat'], lambda: None),
+            ]
+            for name, repeat, prepare in cases:
+                timings = []
+                for _ in range(repeat):
+                    prepare()
+                    stub.reset_requests()
+                    start = time.perf_counter()
+                    StripeService.create_checkout_session(order, items)
+                    timings.append((time.perf_counter() - start) * 1000)
+                self.stdout.write(f'{name:<12}{statistics.median(timings):>12.1f}{len(stub.requests):>14}')
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS('Benchmark completed'))
+
+    @staticmethod
+    def seed(size):
+        category = Category.objects.create(name='Benchmark Category')
+        products = [
+            Product.objects.create(
+                name=f'Benchmark Pump {i}',
+                description='Benchmark product',
+                price=Decimal(100 + i),
+                category=category,
+                quantity=10,
+            )
+            for i in range(size)
+        ]
+        order = Order.objects.create(
+            customer_email='benchmark@example.com', customer_first_name='Bench', customer_last_name='Mark',
+            billing_address_line1='1 Test St', billing_city='Toronto', billing_state='ON',
+            billing_postal_code='M5V 1A1', shipping_address_line1='1 Test St', shipping_city='Toronto',
+            shipping_state='ON', shipping_postal_code='M5V 1A1', subtotal=Decimal('0.00'),
+            tax_amount=Decimal('0.00'), total_amount=Decimal('0.00'), payment_method='card',
+        )
+        items = [
+            {'product_id': str(product.id), 'name': product.name, 'price': product.price, 'quantity': 1}
+            for product in products
+        ]
+        return order, items
@@ -0,0 +1,126 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from orders.pricing import price_cart
+from products.models import Category, Product
+from products.snapshot import CatalogSnapshot
+
+
+class Command(BaseCommand):
+    help = (
+        'Time pricing 1, 10 and 100-line carts: a query per line, one in_bulk query, '
+        'and orders.pricing against the catalog snapshot. Seeds a catalog inside a '
+        'transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--catalog-size',
+            type=int,
+            default=5000,
+            help='Products to seed (default: 5000)'
+        )
+        parser.add_argument(
+            '--lines',
+            type=int,
+            nargs='+',
+            default=[1, 10, 100],
+            help='Cart sizes to benchmark (default: 1 10 100)'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=50,
+            help='Timed runs per cart (default: 50)'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            product_ids = self.seed_catalog(options['catalog_size'])
+            CatalogSnapshot.clear()
+            CatalogSnapshot.current()
+
+            rng = random.Random(0)
+            methods = [
+                ('per line', self.price_per_line),
+                ('in_bulk', self.price_in_bulk),
+                ('pricing', price_cart),
+            ]
+            self.stdout.write(
+                f"{'lines':>6}" + ''.join(f'{name + " ms":>14}{"queries":>9}' for name, _ in methods)
+            )
+            for size in options['lines']:
+                items = [
+                    {'product_id': str(product_id), 'quantity': rng.randint(1, 3)}
+                    for product_id in rng.sample(product_ids, size)
+                ]
+                row = f'{size:>6}'
+                for _, method in methods:
+                    milliseconds, queries = self.time_pricing(method, items, options['repeat'])
+                    row += f'{milliseconds:>14.3f}{queries:>9}'
+                self.stdout.write(row)
+            transaction.set_rollback(True)
+        CatalogSnapshot.clear()
+        self.stdout.write(self.style.SUCCESS('Benchmark completed'))
+
+    def seed_catalog(self, size):
+        self.stdout.write(f'Seeding {size} products...')
+        rng = random.Random(size)
+        category = Category.objects.create(name='Benchmark Category')
+        Product.objects.bulk_create(
+            [
+                Product(
+                    name=f'Benchmark Pump {i}',
+                    description='Benchmark product',
+                    price=Decimal(rng.randint(100, 1000000)) / 100,
+                    category=category,
+                    quantity=rng.randint(0, 50),
+                )
+                for i in range(size)
+            ],
+            batch_size=1000,
+        )
+        return list(Product.objects.values_list('id', flat=True))
+
+    @staticmethod
+    def price_per_line(items):
+        """One query per line, the way the cart views looked products up before the catalog snapshot"""
+        subtotal = Decimal('0.00')
+        for item in items:
+            try:
+                product = Product.objects.get(pk=item['product_id'])
+            except Product.DoesNotExist:
+                continue
+            if product.is_available and item['quantity'] <= product.quantity:
+                subtotal += product.price * item['quantity']
+        return subtotal
+
+    @staticmethod
+    def price_in_bulk(items):
+        products = {
+            str(product_id): product
+            for product_id, product in Product.objects.in_bulk([item['product_id'] for item in items]).items()
+        }
+        subtotal = Decimal('0.00')
+        for item in items:
+            product = products.get(item['product_id'])
+            if product and product.is_available and item['quantity'] <= product.quantity:
+                subtotal += product.price * item['quantity']
+        return subtotal
+
+    @staticmethod
+    def time_pricing(method, items, repeat):
+        with CaptureQueriesContext(connection) as queries:
+            method(items)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            method(items)
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings), len(queries.captured_queries)
@@ -0,0 +1,69 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from orders.models import StripeEvent
+from orders.stripe_events import BATCH_SIZE, StripeEventProcessor
+
+
+class Command(BaseCommand):
+    help = 'Apply pending Stripe webhook events from the StripeEvent inbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--watch',
+            action='store_true',
+            help='Keep running, polling for new events'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1.0,
+            help='Seconds between polls with --watch (default: 1)'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=BATCH_SIZE,
+            help=f'Events applied per batch (default: {BATCH_SIZE})'
+        )
+        parser.add_argument(
+            '--stats',
+            action='store_true',
+            help='Report processing times and lag of processed events, and exit'
+        )
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.report()
+            return
+
+        while True:
+            processed, errors = StripeEventProcessor.process_pending(options['limit'])
+            if processed or errors or not options['watch']:
+                self.stdout.write(self.style.SUCCESS(f'Processed {processed} Stripe events, {errors} errors'))
+            if not options['watch']:
+                return
+            # A full batch means more are waiting
+            if processed + errors < options['limit']:
+                time.sleep(options['interval'])
+
+    def report(self):
+        for event_status, count in StripeEvent.objects.values_list('status').annotate(count=Count('pk')).order_by('status'):
+            self.stdout.write(f'{event_status:>10}: {count}')
+
+        events = StripeEvent.objects.filter(status=StripeEvent.PROCESSED, processed_at__isnull=False)
+        timings = []
+        lags = []
+        for processing_ms, received_at, processed_at in events.values_list('processing_ms', 'received_at', 'processed_at'):
+            timings.append(processing_ms)
+            lags.append((processed_at - received_at).total_seconds() * 1000)
+        if not timings:
+            return
+        for label, values in (('processing ms', timings), ('lag ms', lags)):
+            p95 = statistics.quantiles(values, n=20)[-1] if len(values) > 1 else values[0]
+            self.stdout.write(
+                f'{label:>14}: median {statistics.median(values):.1f}, p95 {p95:.1f}, max {max(values):.1f}'
+            )
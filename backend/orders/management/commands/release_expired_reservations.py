@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.reservations import StockReservationService
+
+
+class Command(BaseCommand):
+    help = 'Give back the stock held by unpaid orders whose reservations have expired'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--watch',
+            action='store_true',
+            help='Keep running, sweeping expired reservations periodically'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=60.0,
+            help='Seconds between sweeps with --watch (default: 60)'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            released = StockReservationService.release_expired()
+            if released or not options['watch']:
+                self.stdout.write(self.style.SUCCESS(f'Released {released} expired stock reservations'))
+            if not options['watch']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def record_paid_orders(apps, schema_editor):
+    """Paid orders already had their stock taken; record it so it is never taken again"""
+    Order = apps.get_model('orders', 'Order')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    StockReservation = apps.get_model('orders', 'StockReservation')
+    now = timezone.now()
+    quantities = {}
+    for order_id, product_id, quantity in OrderItem.objects.filter(
+        order__in=Order.objects.filter(payment_status='completed')
+    ).values_list('order_id', 'product_id', 'quantity'):
+        key = (order_id, product_id)
+        quantities[key] = quantities.get(key, 0) + quantity
+    StockReservation.objects.bulk_create([
+        StockReservation(order_id=order_id, product_id=product_id, quantity=quantity, status='converted', expires_at=now)
+        for (order_id, product_id), quantity in quantities.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0001_initial'),
+        ('products', '0014_search_vocabulary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('held', 'Held'), ('converted', 'Converted to sale'), ('released', 'Released')], default='held', max_length=20)),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='orders.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='products.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'expires_at'], name='reservation_status_expiry_idx')],
+                'constraints': [models.UniqueConstraint(fields=('order', 'product'), name='unique_order_product_reservation')],
+            },
+        ),
+        migrations.RunPython(record_paid_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_stripe_event'),
+        ('products', '0014_search_vocabulary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripePriceMapping',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stripe_product_id', models.CharField(max_length=255)),
+                ('stripe_price_id', models.CharField(max_length=255)),
+                ('unit_amount', models.PositiveIntegerField(help_text='In cents')),
+                ('currency', models.CharField(default='cad', max_length=3)),
+                ('product_name', models.CharField(max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stripe_price_mapping', to='products.product')),
+            ],
+        ),
+    ]
@@ -96,3 +96,101 @@ class OrderItem(models.Model):
         if self.quantity is not None and self.price is not None:
             return self.quantity * self.price
         return 0
+
+
+class StockReservation(models.Model):
+    """
+    Stock held for an order until it is paid for (see orders.reservations).
+    The held quantity has already been taken off ``Product.quantity``.
+    """
+    HELD = 'held'
+    CONVERTED = 'converted'
+    RELEASED = 'released'
+    STATUS_CHOICES = [
+        (HELD, 'Held'),
+        (CONVERTED, 'Converted to sale'),
+        (RELEASED, 'Released'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=HELD)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'], name='unique_order_product_reservation'),
+        ]
+        indexes = [
+            # The sweeper's scan for expired holds
+            models.Index(fields=['status', 'expires_at'], name='reservation_status_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.order.order_number} - {self.product.name} x{self.quantity} ({self.status})"
+
+
+class StripeEvent(models.Model):
+    """
+    A Stripe webhook event, stored when it arrives and applied later by
+    the process_stripe_events worker (see orders.stripe_events)
+    """
+    PENDING = 'pending'
+    PROCESSED = 'processed'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSED, 'Processed'),
+        (FAILED, 'Failed'),
+    ]
+
+    # Stripe's event id; a redelivered event is stored once
+    event_id = models.CharField(max_length=255, primary_key=True)
+    type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    # Time spent applying the event, in milliseconds
+    processing_ms = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['received_at']
+        indexes = [
+            models.Index(fields=['status', 'received_at'], name='stripe_event_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_id} {self.type} ({self.status})"
+
+    @property
+    def lag(self):
+        """Time from arrival to processing, or None while unprocessed"""
+        if self.processed_at is None:
+            return None
+        return self.processed_at - self.received_at
+
+
+class StripePriceMapping(models.Model):
+    """
+    The Stripe product and price a catalog product is sold under at
+    checkout (see orders.stripe_prices). Only used while the product's
+    price and name still match the ones it was created for.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='stripe_price_mapping')
+    stripe_product_id = models.CharField(max_length=255)
+    stripe_price_id = models.CharField(max_length=255)
+    # The price and name the Stripe objects were created for
+    unit_amount = models.PositiveIntegerField(help_text="In cents")
+    currency = models.CharField(max_length=3, default='cad')
+    product_name = models.CharField(max_length=200)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.product_name} -> {self.stripe_price_id}"
@@ -0,0 +1,158 @@
+"""
+Cart pricing shared by the cart, checkout and payment code.
+
+``price_cart(items, billing_country)`` resolves every line of a cart
+against the catalog snapshot in one ``in_bulk`` lookup and returns a
+``CartPricing``: each line with its product and status, and the subtotal,
+tax and total of the lines that can be ordered. ``validate_cart``,
+``calculate_order_total``, ``OrderCreateSerializer`` and
+``StripeService.create_payment_intent`` all read their answers from it and
+only differ in how they report problems.
+
+``price_request_cart`` memoizes the result on the request, so validating
+an order and creating its payment intent price the cart once.
+"""
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from products.snapshot import CatalogSnapshot
+
+CENTS = Decimal('0.01')
+
+DEFAULT_COUNTRY = 'CA'
+# No tax is collected on US orders
+TAX_RATES = {'US': Decimal('0.00')}
+DEFAULT_TAX_RATE = Decimal('0.13')
+
+# Line statuses
+AVAILABLE = 'available'
+NOT_FOUND = 'not_found'
+INACTIVE = 'inactive'
+OUT_OF_STOCK = 'out_of_stock'
+INSUFFICIENT_QUANTITY = 'insufficient_quantity'
+
+
+def get_tax_rate(billing_country):
+    return TAX_RATES.get(billing_country, DEFAULT_TAX_RATE)
+
+
+def _quantity(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _price(value):
+    """The client's unit price as a Decimal, or None if it sent none"""
+    if value is None or value == '':
+        return None
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        return None
+
+
+class CartLine:
+    """One cart item resolved against the catalog"""
+
+    __slots__ = ('product_id', 'product', 'quantity', 'requested_price', 'status')
+
+    def __init__(self, product_id, product, quantity, requested_price):
+        self.product_id = product_id
+        self.product = product
+        self.quantity = quantity
+        self.requested_price = requested_price
+        if product is None:
+            self.status = NOT_FOUND
+        elif not product.active:
+            self.status = INACTIVE
+        elif not product.in_stock:
+            self.status = OUT_OF_STOCK
+        elif quantity > product.quantity:
+            self.status = INSUFFICIENT_QUANTITY
+        else:
+            self.status = AVAILABLE
+
+    @property
+    def is_valid(self):
+        return self.status == AVAILABLE
+
+    @property
+    def price(self):
+        """Current unit price"""
+        return self.product.price
+
+    @property
+    def total(self):
+        return self.product.price * self.quantity
+
+    @property
+    def price_changed(self):
+        """True if the client sent a unit price that is no longer current"""
+        return self.requested_price is not None and self.requested_price != self.product.price
+
+    def __repr__(self):
+        return f'<CartLine {self.product_id} x{self.quantity} {self.status}>'
+
+
+class CartPricing:
+    """A priced cart; totals cover the valid lines only, at current prices"""
+
+    __slots__ = ('lines', 'billing_country', 'subtotal', 'tax_rate', 'tax_amount', 'total')
+
+    def __init__(self, lines, billing_country):
+        self.lines = lines
+        self.billing_country = billing_country
+        self.subtotal = sum((line.total for line in lines if line.is_valid), Decimal('0.00'))
+        self.tax_rate = get_tax_rate(billing_country)
+        self.tax_amount = (self.subtotal * self.tax_rate).quantize(CENTS, rounding=ROUND_HALF_UP)
+        self.total = (self.subtotal + self.tax_amount).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+    @property
+    def valid_lines(self):
+        return [line for line in self.lines if line.is_valid]
+
+    @property
+    def issues(self):
+        """Lines that cannot be ordered as requested"""
+        return [line for line in self.lines if not line.is_valid]
+
+    @property
+    def price_changes(self):
+        return [line for line in self.lines if line.is_valid and line.price_changed]
+
+    @property
+    def is_valid(self):
+        return all(line.is_valid for line in self.lines)
+
+
+def price_cart(items, billing_country=None):
+    """
+    Price cart ``items`` (dicts with ``product_id``, ``quantity`` and
+    optionally the ``price`` the client showed) for ``billing_country``
+    """
+    product_ids = [str(item.get('product_id')) for item in items]
+    products = CatalogSnapshot.current().in_bulk(product_ids)
+    lines = [
+        CartLine(product_id, products.get(product_id), _quantity(item.get('quantity')), _price(item.get('price')))
+        for product_id, item in zip(product_ids, items)
+    ]
+    return CartPricing(lines, billing_country or DEFAULT_COUNTRY)
+
+
+def price_request_cart(request, items, billing_country=None):
+    """
+    ``price_cart`` memoized on the request: the same items and country
+    priced twice while handling one request share the result
+    """
+    key = (
+        billing_country or DEFAULT_COUNTRY,
+        tuple(
+            (str(item.get('product_id')), _quantity(item.get('quantity')), _price(item.get('price')))
+            for item in items
+        ),
+    )
+    memo = request.__dict__.setdefault('_cart_pricing', {})
+    if key not in memo:
+        memo[key] = price_cart(items, billing_country)
+    return memo[key]
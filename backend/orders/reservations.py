@@ -0,0 +1,183 @@
+"""
+Stock reservations for orders awaiting payment.
+
+Creating an order holds the stock of every product in it with a
+conditional update::
+
+    UPDATE products_product SET quantity = quantity - n
+    WHERE id = ... AND quantity >= n
+
+The database applies concurrent updates of a row one after the other, so
+two checkouts can never both take the last unit and stock never goes
+below zero. A hold then either becomes a sale when the payment is
+confirmed (``convert``), or gives its stock back when the payment is
+cancelled (``release``) or nobody paid before ``expires_at``
+(``release_expired``). Expired holds are released before every new
+order is validated, and by the ``release_expired_reservations --watch``
+worker so the catalog stops showing their stock as sold out.
+
+Reservations change state with a conditional update on their status as
+well, so however many webhooks, redirects and sweeps race for the same
+order, each hold is converted or released exactly once.
+
+Hold lengths default to ``settings.STOCK_RESERVATION_TTL`` seconds.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.versioning import bump_version, domains_for_model
+from products.models import Product
+
+from .models import StockReservation
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 30 * 60
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_name, available):
+        self.product_name = product_name
+        self.available = available
+        super().__init__(f'Only {available} units of "{product_name}" are available')
+
+
+def get_reservation_ttl():
+    return timedelta(seconds=getattr(settings, 'STOCK_RESERVATION_TTL', DEFAULT_TTL))
+
+
+def _take_stock(product_id, quantity, now):
+    """Take ``quantity`` units if the product has them; True if it did"""
+    return Product.objects.filter(pk=product_id, quantity__gte=quantity).update(
+        quantity=F('quantity') - quantity, updated_at=now
+    ) == 1
+
+
+def _return_stock(product_id, quantity, now):
+    Product.objects.filter(pk=product_id).update(quantity=F('quantity') + quantity, updated_at=now)
+
+
+def _stock_changed():
+    # Queryset updates send no signals; stock levels are part of the catalog
+    for domain in domains_for_model(Product):
+        bump_version(domain)
+
+
+class StockReservationService:
+    @staticmethod
+    def order_quantities(order):
+        """``{product id: quantity}`` of an order's items"""
+        quantities = {}
+        for product_id, quantity in order.items.values_list('product_id', 'quantity'):
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        return quantities
+
+    @classmethod
+    def hold(cls, order, ttl=None):
+        """
+        Hold the stock of every item of ``order`` until ``ttl`` from now.
+        Raises InsufficientStock, holding nothing, if a product is short.
+        """
+        now = timezone.now()
+        expires_at = now + (ttl if ttl is not None else get_reservation_ttl())
+        quantities = cls.order_quantities(order)
+
+        with transaction.atomic():
+            # Always in the same order, so concurrent holds cannot deadlock
+            for product_id in sorted(quantities):
+                quantity = quantities[product_id]
+                if _take_stock(product_id, quantity, now):
+                    continue
+                # Stock abandoned in expired checkouts is put back first
+                if cls._release(StockReservation.objects.filter(
+                    product_id=product_id, status=StockReservation.HELD, expires_at__lte=now
+                )) and _take_stock(product_id, quantity, now):
+                    continue
+                name, available = Product.objects.values_list('name', 'quantity').get(pk=product_id)
+                raise InsufficientStock(name, available)
+
+            reservations = StockReservation.objects.bulk_create([
+                StockReservation(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+                for product_id, quantity in quantities.items()
+            ])
+            if reservations:
+                _stock_changed()
+        return reservations
+
+    @classmethod
+    def convert(cls, order):
+        """
+        Turn the order's holds into a sale. Returns the number of
+        reservations this call converted; 0 if the order was already sold.
+
+        A hold that expired before the payment arrived takes its stock
+        again. If the stock has gone in the meantime the shortfall is
+        logged: the customer has paid, but stock is not taken below zero.
+        """
+        now = timezone.now()
+        converted = 0
+        with transaction.atomic():
+            if not order.reservations.exists():
+                # Orders placed before reservations existed hold nothing;
+                # recorded as released, they take their stock below
+                StockReservation.objects.bulk_create([
+                    StockReservation(
+                        order=order, product_id=product_id, quantity=quantity,
+                        status=StockReservation.RELEASED, expires_at=now,
+                    )
+                    for product_id, quantity in cls.order_quantities(order).items()
+                ], ignore_conflicts=True)
+
+            pending = order.reservations.exclude(status=StockReservation.CONVERTED).order_by('product_id')
+            for reservation in pending:
+                claimed = StockReservation.objects.filter(pk=reservation.pk, status=reservation.status).update(
+                    status=StockReservation.CONVERTED, updated_at=now
+                )
+                if not claimed:
+                    # Converted or released by a concurrent request
+                    continue
+                converted += 1
+                if reservation.status == StockReservation.RELEASED and not _take_stock(
+                    reservation.product_id, reservation.quantity, now
+                ):
+                    logger.warning(
+                        f"Order {order.order_number} was paid after its hold on product "
+                        f"{reservation.product_id} expired, and the {reservation.quantity} "
+                        f"units it needs are no longer in stock"
+                    )
+            if converted:
+                _stock_changed()
+        return converted
+
+    @classmethod
+    def release(cls, order):
+        """Give back the stock the order still holds; returns the number of holds released"""
+        return cls._release(order.reservations.filter(status=StockReservation.HELD))
+
+    @classmethod
+    def release_expired(cls, now=None):
+        """Give back the stock of every hold past its expiry; returns the number released"""
+        now = now or timezone.now()
+        return cls._release(StockReservation.objects.filter(status=StockReservation.HELD, expires_at__lte=now))
+
+    @staticmethod
+    def _release(reservations):
+        now = timezone.now()
+        released = 0
+        with transaction.atomic():
+            for pk, product_id, quantity in reservations.order_by('product_id').values_list(
+                'pk', 'product_id', 'quantity'
+            ):
+                if StockReservation.objects.filter(pk=pk, status=StockReservation.HELD).update(
+                    status=StockReservation.RELEASED, updated_at=now
+                ):
+                    _return_stock(product_id, quantity, now)
+                    released += 1
+            if released:
+                _stock_changed()
+        return released
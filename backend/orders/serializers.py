@@ -60,36 +60,44 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         ]
 
     def validate(self, data):
-        from products.models import Product
+        from .pricing import INSUFFICIENT_QUANTITY, NOT_FOUND, price_cart, price_request_cart
+        from .reservations import StockReservationService
+        
+        # Stock held by abandoned checkouts is available again before the
+        # cart is checked against it (one indexed query when none expired)
+        StockReservationService.release_expired()
         
         order_items_data = data.get('order_items', [])
+        billing_country = data.get('billing_country')
+        request = self.context.get('request')
+        if request is not None:
+            pricing = price_request_cart(request, order_items_data, billing_country)
+        else:
+            pricing = price_cart(order_items_data, billing_country)
         
-        for item_data in order_items_data:
-            try:
-                product = Product.objects.get(id=item_data.get('product_id'))
-                
-                # Check if product is available
-                if not product.is_available:
-                    raise serializers.ValidationError(
-                        f'Product "{product.name}" is out of stock'
-                    )
-                
-                # Check if requested quantity is available
-                quantity = item_data.get('quantity', 0)
-                if quantity > product.quantity:
-                    raise serializers.ValidationError(
-                        f'Only {product.quantity} units of "{product.name}" are available'
-                    )
-                
-                # Use current product price instead of validating against frontend price
-                # This prevents validation errors due to price sync issues
-                from decimal import Decimal
-                item_data['price'] = product.price
-                    
-            except Product.DoesNotExist:
+        for item_data, line in zip(order_items_data, pricing.lines):
+            if line.status == NOT_FOUND:
                 raise serializers.ValidationError(
                     f'Product with id {item_data.get("product_id")} not found'
                 )
+            if line.status == INSUFFICIENT_QUANTITY:
+                raise serializers.ValidationError(
+                    f'Only {line.product.quantity} units of "{line.product.name}" are available'
+                )
+            if not line.is_valid:
+                raise serializers.ValidationError(
+                    f'Product "{line.product.name}" is out of stock'
+                )
+            
+            # Use current product price instead of validating against frontend price
+            # This prevents validation errors due to price sync issues
+            item_data['price'] = line.price
+        
+        # Totals are the server's, not whatever the client computed
+        data['subtotal'] = pricing.subtotal
+        data['tax_amount'] = pricing.tax_amount
+        data['total_amount'] = pricing.total
+        self.pricing = pricing
         
         return data
 
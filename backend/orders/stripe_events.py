@@ -0,0 +1,172 @@
+"""
+Stripe webhook events, stored on arrival and applied by a worker.
+
+``stripe_webhook`` verifies an event, records it in the ``StripeEvent``
+inbox and answers 200 straight away. Stripe retries deliveries that are
+slow to be acknowledged, so nothing is done while it waits; a redelivered
+event has the same id and is stored once.
+
+``StripeEventProcessor.process_pending`` (the ``process_stripe_events``
+command) applies pending events oldest first. An event is claimed,
+applied and marked processed in one transaction, so its changes, and
+the emails it queues in the outbox (core.outbox), are committed exactly
+once.
+An event whose handler raises is retried on later runs, up to
+``MAX_ATTEMPTS`` times.
+
+Each processed event records how long its handler took
+(``processing_ms``) and when it finished, for the lag from arrival.
+"""
+import logging
+import time
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .email_service import OrderEmailService
+from .models import Order, StripeEvent
+from .reservations import StockReservationService
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+BATCH_SIZE = 100
+
+
+# Handlers, called with the event's data object inside the processing transaction
+
+def payment_intent_succeeded(payment_intent):
+    try:
+        order = Order.objects.get(stripe_payment_intent_id=payment_intent['id'])
+    except Order.DoesNotExist:
+        return  # Not one of our orders
+    order.payment_status = 'completed'
+    order.status = 'processing'
+    order.save()
+    StockReservationService.convert(order)
+    OrderEmailService.send_payment_success_notification(order)
+
+
+def payment_intent_payment_failed(payment_intent):
+    try:
+        order = Order.objects.get(stripe_payment_intent_id=payment_intent['id'])
+    except Order.DoesNotExist:
+        return
+    order.payment_status = 'failed'
+    order.save()
+    # The customer can retry with the same intent; the hold stays until it expires
+    failure_reason = (payment_intent.get('last_payment_error') or {}).get('message', 'Payment failed')
+    OrderEmailService.send_payment_failed_notification(order, failure_reason)
+
+
+def payment_intent_canceled(payment_intent):
+    try:
+        order = Order.objects.get(stripe_payment_intent_id=payment_intent['id'])
+    except Order.DoesNotExist:
+        return
+    order.payment_status = 'failed'
+    order.save()
+    StockReservationService.release(order)
+    cancellation_reason = payment_intent.get('cancellation_reason') or 'Payment cancelled'
+    OrderEmailService.send_payment_failed_notification(order, f"Payment cancelled: {cancellation_reason}")
+
+
+def _session_order(session):
+    order_number = (session.get('metadata') or {}).get('order_number')
+    if not order_number:
+        return None
+    return Order.objects.filter(order_number=order_number).first()
+
+
+def checkout_session_completed(session):
+    order = _session_order(session)
+    if order is None or session.get('payment_status') != 'paid':
+        return
+    order.payment_status = 'completed'
+    order.status = 'processing'
+    order.save()
+    StockReservationService.convert(order)
+    OrderEmailService.send_payment_success_notification(order)
+
+
+def checkout_session_expired(session):
+    order = _session_order(session)
+    if order is None:
+        return
+    order.payment_status = 'failed'
+    order.save()
+    StockReservationService.release(order)
+    OrderEmailService.send_payment_failed_notification(order, "Payment session expired")
+
+
+HANDLERS = {
+    'payment_intent.succeeded': payment_intent_succeeded,
+    'payment_intent.payment_failed': payment_intent_payment_failed,
+    'payment_intent.canceled': payment_intent_canceled,
+    'checkout.session.completed': checkout_session_completed,
+    'checkout.session.expired': checkout_session_expired,
+}
+
+
+class StripeEventProcessor:
+    @staticmethod
+    def record(payload):
+        """
+        Store a verified event (its JSON as a dict) in the inbox. Returns
+        False if an event with its id was stored before.
+        """
+        try:
+            with transaction.atomic():
+                StripeEvent.objects.create(event_id=payload['id'], type=payload['type'], payload=payload)
+        except IntegrityError:
+            return False
+        return True
+
+    @classmethod
+    def process(cls, event):
+        """
+        Apply one stored event. Returns the event's new status, or None if
+        another worker had already taken it.
+        """
+        started = time.perf_counter()
+        try:
+            with transaction.atomic():
+                # Claimed inside the transaction: a failure puts it back
+                claimed = StripeEvent.objects.filter(pk=event.pk, status=StripeEvent.PENDING).update(
+                    status=StripeEvent.PROCESSED, attempts=F('attempts') + 1
+                )
+                if not claimed:
+                    return None
+                handler = HANDLERS.get(event.type)
+                if handler is not None:
+                    handler(event.payload['data']['object'])
+                StripeEvent.objects.filter(pk=event.pk).update(
+                    processed_at=timezone.now(),
+                    processing_ms=(time.perf_counter() - started) * 1000,
+                    last_error='',
+                )
+        except Exception as e:
+            logger.exception(f"Failed to process Stripe event {event.pk} ({event.type})")
+            new_status = StripeEvent.FAILED if event.attempts + 1 >= MAX_ATTEMPTS else StripeEvent.PENDING
+            StripeEvent.objects.filter(pk=event.pk, status=StripeEvent.PENDING).update(
+                attempts=F('attempts') + 1, last_error=str(e), status=new_status
+            )
+            return new_status
+        return StripeEvent.PROCESSED
+
+    @classmethod
+    def process_pending(cls, limit=BATCH_SIZE):
+        """
+        Apply up to ``limit`` pending events, oldest first. Returns
+        ``(processed, errors)``: events applied, and events whose handler
+        raised (left pending for a retry, or failed for good).
+        """
+        processed = errors = 0
+        for event in StripeEvent.objects.filter(status=StripeEvent.PENDING).order_by('received_at')[:limit]:
+            status = cls.process(event)
+            if status == StripeEvent.PROCESSED:
+                processed += 1
+            elif status is not None:
+                errors += 1
+        return processed, errors
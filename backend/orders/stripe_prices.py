@@ -0,0 +1,120 @@
+"""
+Stripe products and prices for checkout sessions, cached locally.
+
+Every line of a checkout session names a Stripe price. Finding one means
+searching Stripe for the product, then for a price with the right
+amount, and creating whichever is missing: two to four round trips per
+line, one after the other, while the customer waits to be redirected.
+
+``StripePriceCache.price_ids`` keeps the answer in ``StripePriceMapping``,
+one row per catalog product, filled the first time the product goes
+through checkout and read for every line in one query after that. A row
+records the price and name its Stripe objects were made for and is only
+used while the product still has both:
+
+* a new price finds (or creates) a Stripe price for the new amount under
+  the same Stripe product;
+* a new name renames the Stripe product.
+
+Rows are checked on every lookup rather than cleared by a signal, so
+queryset updates, which send none, are caught as well. A checkout whose
+products are all mapped and unchanged calls Stripe once, to create the
+session.
+"""
+import logging
+from decimal import Decimal
+
+import stripe
+
+from .models import StripePriceMapping
+from .stripe_service import StripeService
+
+logger = logging.getLogger(__name__)
+
+CURRENCY = 'cad'
+
+
+def unit_amount(price):
+    """A price in cents, as Stripe takes it"""
+    return int(Decimal(str(price)) * 100)
+
+
+class StripePriceCache:
+    @classmethod
+    def price_ids(cls, products):
+        """
+        ``{product id: Stripe price id}`` for ``products`` at their current
+        price. Products Stripe could not be reached for are left out.
+        """
+        mappings = {
+            mapping.product_id: mapping
+            for mapping in StripePriceMapping.objects.filter(product__in=[product.id for product in products])
+        }
+        price_ids = {}
+        for product in products:
+            mapping = mappings.get(product.id)
+            if mapping is None or not cls.is_current(mapping, product):
+                mapping = cls.refresh(product, mapping)
+            if mapping is not None:
+                price_ids[product.id] = mapping.stripe_price_id
+        return price_ids
+
+    @staticmethod
+    def is_current(mapping, product):
+        return (
+            mapping.unit_amount == unit_amount(product.price)
+            and mapping.product_name == product.name
+            and mapping.currency == CURRENCY
+        )
+
+    @staticmethod
+    def refresh(product, mapping=None):
+        """
+        Bring the Stripe product and price of ``product`` up to date and
+        store them. Returns the mapping, or None if Stripe failed; a
+        stored mapping is then dropped, and the next checkout starts over.
+        """
+        amount = unit_amount(product.price)
+        try:
+            if mapping is not None:
+                stripe_product_id = mapping.stripe_product_id
+                stripe_name = mapping.product_name
+            else:
+                stripe_product = StripeService.create_or_get_stripe_product(product)
+                if stripe_product is None:
+                    return None
+                stripe_product_id = stripe_product.id
+                stripe_name = stripe_product.name
+
+            if stripe_name != product.name:
+                stripe.Product.modify(stripe_product_id, name=product.name)
+
+            if mapping is not None and mapping.unit_amount == amount and mapping.currency == CURRENCY:
+                stripe_price_id = mapping.stripe_price_id
+            else:
+                existing_prices = stripe.Price.list(
+                    product=stripe_product_id, unit_amount=amount, currency=CURRENCY, active=True
+                )
+                if existing_prices.data:
+                    stripe_price_id = existing_prices.data[0].id
+                else:
+                    stripe_price = StripeService.create_stripe_price(stripe_product_id, product.price)
+                    if stripe_price is None:
+                        raise stripe.error.StripeError(f"Could not create a price for {product.name}")
+                    stripe_price_id = stripe_price.id
+        except stripe.error.StripeError as e:
+            logger.warning(f"Could not map {product.name} to a Stripe price: {e}")
+            StripePriceMapping.objects.filter(product_id=product.id).delete()
+            return None
+
+        mapping, _ = StripePriceMapping.objects.update_or_create(
+            product_id=product.id,
+            defaults={
+                'stripe_product_id': stripe_product_id,
+                'stripe_price_id': stripe_price_id,
+                'unit_amount': amount,
+                'currency': CURRENCY,
+                'product_name': product.name,
+            },
+        )
+        return mapping
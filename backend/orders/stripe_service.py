@@ -1,7 +1,7 @@
 import stripe
 from django.conf import settings
 from decimal import Decimal
-from .models import Order
+from .models import Order, StockReservation
 
 # Configure Stripe with the secret key
 stripe.api_key = settings.STRIPE_SECRET_KEY
@@ -41,13 +41,13 @@ class StripeService:
             return None
 
     @staticmethod
-    def create_stripe_price(stripe_product, price_amount):
+    def create_stripe_price(stripe_product_id, price_amount):
         """
         Create a Stripe price for a product
         """
         try:
             stripe_price = stripe.Price.create(
-                product=stripe_product.id,
+                product=stripe_product_id,
                 unit_amount=int(price_amount * 100),  # Convert to cents
                 currency='cad',
             )
@@ -57,72 +57,59 @@ class StripeService:
             return None
 
     @staticmethod
-    def create_payment_intent(order_data, order_items):
+    def create_payment_intent(order_data, order_items, pricing=None):
         """
-        Create a Stripe payment intent for the order
+        Create a Stripe payment intent for the order.
+        ``pricing`` is the order's CartPricing if the caller already has it;
+        the amount charged is its total.
         """
         try:
-            from products.models import Product
+            from .pricing import INSUFFICIENT_QUANTITY, NOT_FOUND, price_cart
+            
+            if pricing is None:
+                pricing = price_cart(order_items, order_data.get('billing_country', 'CA'))
+            
+            # Validate availability, quantities and prices before charging anything
+            for line in pricing.lines:
+                if line.status == NOT_FOUND:
+                    raise Exception(f'Product with ID {line.product_id} not found')
+                product = line.product
+                if line.status == INSUFFICIENT_QUANTITY:
+                    raise Exception(f'Only {product.quantity} units of "{product.name}" are available')
+                if not line.is_valid:
+                    raise Exception(f'Product "{product.name}" is no longer available')
+                if line.requested_price != product.price:
+                    raise Exception(f'Price for "{product.name}" has changed. Please refresh your cart.')
             
             # Calculate the total amount in cents (Stripe requires cents)
-            total_amount_cents = int(order_data['total_amount'] * 100)
+            total_amount_cents = int(pricing.total * 100)
             
             # Build detailed metadata with product information
             metadata = {
                 'customer_email': order_data['customer_email'],
                 'customer_name': f"{order_data['customer_first_name']} {order_data['customer_last_name']}",
                 'order_items_count': len(order_items),
-                'subtotal': str(order_data.get('subtotal', 0)),
-                'tax_amount': str(order_data.get('tax_amount', 0)),
-                'total_amount': str(order_data['total_amount']),
-                'billing_country': order_data.get('billing_country', 'CA'),
+                'subtotal': str(pricing.subtotal),
+                'tax_amount': str(pricing.tax_amount),
+                'total_amount': str(pricing.total),
+                'billing_country': pricing.billing_country,
                 'custom_tax_applied': 'true',  # Flag to indicate we're using custom tax calculation
             }
             
-            # Add individual product details to metadata AND validate availability
-            for i, item in enumerate(order_items):
-                try:
-                    product = Product.objects.get(id=item['product_id'])
-                    
-                    # Validate product availability before creating payment intent
-                    if not product.is_available:
-                        raise Exception(f'Product "{product.name}" is no longer available')
-                    
-                    # Validate quantity availability
-                    if item['quantity'] > product.quantity:
-                        raise Exception(f'Only {product.quantity} units of "{product.name}" are available')
-                    
-                    # Validate price hasn't changed
-                    from decimal import Decimal
-                    try:
-                        frontend_price = Decimal(str(item['price']))
-                    except Exception:
-                        frontend_price = None  # fallback if missing/invalid
-                    if frontend_price != product.price:
-                        raise Exception(f'Price for "{product.name}" has changed. Please refresh your cart.')
-                    
-                    metadata[f'item_{i+1}_name'] = product.name
-                    metadata[f'item_{i+1}_id'] = str(product.id)
-                    metadata[f'item_{i+1}_category'] = product.category.name
-                    metadata[f'item_{i+1}_quantity'] = str(item['quantity'])
-                    metadata[f'item_{i+1}_price'] = str(item['price'])
-                    metadata[f'item_{i+1}_total'] = str(float(item['price']) * item['quantity'])
-                    # Add product URL for admin access
-                    production_domain = settings.PRODUCTION_DOMAIN
-                    base_url = f"https://{production_domain}" if production_domain != 'localhost:3000' else 'http://localhost:3000'
-                    metadata[f'item_{i+1}_url'] = f"{base_url}/admin/products/product/{product.id}"
-                except Product.DoesNotExist:
-                    raise Exception(f'Product with ID {item["product_id"]} not found')
-            
-            # Create a descriptive order summary (products already validated above)
+            # Add product URL for admin access
+            production_domain = settings.PRODUCTION_DOMAIN
+            base_url = f"https://{production_domain}" if production_domain != 'localhost:3000' else 'http://localhost:3000'
             product_names = []
-            for item in order_items:
-                try:
-                    product = Product.objects.get(id=item['product_id'])
-                    product_names.append(f"{product.name} x{item['quantity']}")
-                except Product.DoesNotExist:
-                    # This shouldn't happen since we validated above, but just in case
-                    product_names.append(f"Product ID {item['product_id']} x{item['quantity']}")
+            for i, line in enumerate(pricing.lines):
+                product = line.product
+                metadata[f'item_{i+1}_name'] = product.name
+                metadata[f'item_{i+1}_id'] = str(product.id)
+                metadata[f'item_{i+1}_category'] = product.category_name
+                metadata[f'item_{i+1}_quantity'] = str(line.quantity)
+                metadata[f'item_{i+1}_price'] = str(line.price)
+                metadata[f'item_{i+1}_total'] = str(line.total)
+                metadata[f'item_{i+1}_url'] = f"{base_url}/admin/products/product/{product.id}"
+                product_names.append(f"{product.name} x{line.quantity}")
             
             description = f"Order for {order_data['customer_email']} - Items: {'; '.join(product_names)}"
             
@@ -213,129 +200,68 @@ class StripeService:
         """Create a Stripe Checkout Session for hosted checkout."""
         try:
             from products.models import Product
+            from .stripe_prices import StripePriceCache
+            
+            # Every product in one query, validated before anything is sent to Stripe
+            products = {
+                str(product_id): product
+                for product_id, product in Product.objects.select_related('category').in_bulk(
+                    [item['product_id'] for item in order_items if 'product_id' in item]
+                ).items()
+            }
+            # The order's own holds were taken off Product.quantity when it was created
+            held = dict(
+                order.reservations.filter(status=StockReservation.HELD).values_list('product_id', 'quantity')
+            )
+            for item in order_items:
+                product = products.get(str(item['product_id'])) if 'product_id' in item else None
+                if product is None:
+                    continue
+                available = product.quantity + held.get(product.id, 0)
+                
+                # Validate product availability before creating checkout session
+                if not product.active or available <= 0:
+                    raise Exception(f'Product "{product.name}" is no longer available')
+                
+                # Validate quantity availability
+                if item['quantity'] > available:
+                    raise Exception(f'Only {available} units of "{product.name}" are available')
+                
+                # Validate price hasn't changed
+                if item['price'] != product.price:
+                    raise Exception(f'Price for "{product.name}" has changed. Please refresh your cart.')
+            
+            # Stripe prices from the local mapping; only new or changed products call Stripe
+            price_ids = StripePriceCache.price_ids(list(products.values()))
             
             line_items = []
             for item in order_items:
-                # Get product details if product_id is available
-                if 'product_id' in item:
-                    try:
-                        product = Product.objects.select_related('category').get(id=item['product_id'])
-                        
-                        # Validate product availability before creating checkout session
-                        if not product.is_available:
-                            raise Exception(f'Product "{product.name}" is no longer available')
-                        
-                        # Validate quantity availability
-                        if item['quantity'] > product.quantity:
-                            raise Exception(f'Only {product.quantity} units of "{product.name}" are available')
-                        
-                        # Validate price hasn't changed
-                        if item['price'] != product.price:
-                            raise Exception(f'Price for "{product.name}" has changed. Please refresh your cart.')
-                        
-                        # Try to use existing Stripe product/price or create new ones
-                        stripe_product = StripeService.create_or_get_stripe_product(product)
-                        
-                        if stripe_product:
-                            # Check if we have an existing price for this amount
-                            existing_prices = stripe.Price.list(
-                                product=stripe_product.id,
-                                unit_amount=int(Decimal(str(item['price'])) * 100)
-                            )
-                            
-                            if existing_prices.data:
-                                # Use existing price
-                                line_item = {
-                                    'price': existing_prices.data[0].id,
-                                    'quantity': item['quantity'],
-                                }
-                            else:
-                                # Create new price for this product
-                                stripe_price = StripeService.create_stripe_price(stripe_product, Decimal(str(item['price'])))
-                                
-                                if stripe_price:
-                                    line_item = {
-                                        'price': stripe_price.id,
-                                        'quantity': item['quantity'],
-                                    }
-                                else:
-                                    # Fallback to price_data if price creation fails
-                                    line_item = {
-                                        'price_data': {
-                                            'currency': 'cad',
-                                            'product': stripe_product.id,
-                                            'unit_amount': int(Decimal(str(item['price'])) * 100),
-                                        },
-                                        'quantity': item['quantity'],
-                                    }
-                        else:
-                            # Fallback to inline product creation
-                            product_name = product.name
-                            product_description = product.description[:500] if product.description else None
-                            category_name = product.category.name if product.category else 'Unknown'
-                            
-                            line_item = {
-                                'price_data': {
-                                    'currency': 'cad',
-                                    'product_data': {
-                                        'name': product_name,
-                                        'metadata': {
-                                            'product_id': str(item.get('product_id', 'unknown')),
-                                            'category': category_name,
-                                            'product_url': f"{settings.BASE_URL}/admin/products/product/{item.get('product_id', 'unknown')}"
-                                        }
-                                    },
-                                    'unit_amount': int(Decimal(str(item['price'])) * 100),
-                                },
-                                'quantity': item['quantity'],
-                            }
-                            
-                            # Add description if available
-                            if product_description:
-                                line_item['price_data']['product_data']['description'] = product_description
-                                
-                    except Product.DoesNotExist:
-                        # Product not found in database
-                        product_name = item.get('name', f'Product ID {item["product_id"]}')
-                        line_item = {
-                            'price_data': {
-                                'currency': 'cad',
-                                'product_data': {
-                                    'name': product_name,
-                                    'metadata': {
-                                        'product_id': str(item.get('product_id', 'unknown')),
-                                        'category': 'Unknown',
-                                        'product_url': f"{settings.BASE_URL}/admin/products/product/{item.get('product_id', 'unknown')}"
-                                    }
-                                },
-                                'unit_amount': int(Decimal(str(item['price'])) * 100),
-                            },
-                            'quantity': item['quantity'],
-                        }
-                else:
-                    # No product_id provided, use basic product data
-                    product_name = item.get('name', 'Product')
-                    product_description = item.get('description', None)
-                    
+                product = products.get(str(item['product_id'])) if 'product_id' in item else None
+                
+                if product is not None and product.id in price_ids:
                     line_item = {
-                        'price_data': {
-                            'currency': 'cad',
-                            'product_data': {
-                                'name': product_name,
-                                'metadata': {
-                                    'product_id': 'unknown',
-                                    'category': 'Unknown',
-                                    'product_url': f"{settings.BASE_URL}/admin/products/unknown"
-                                }
-                            },
-                            'unit_amount': int(Decimal(str(item['price'])) * 100),
-                        },
+                        'price': price_ids[product.id],
                         'quantity': item['quantity'],
                     }
-                    
-                    # Add description if available
-                    if product_description:
-                        line_item['price_data']['product_data']['description'] = product_description
+                elif product is not None:
+                    # Stripe could not be reached for this product; create it inline
+                    line_item = StripeService.inline_line_item(
+                        product.name,
+                        product.description[:500] if product.description else None,
+                        item['product_id'],
+                        product.category.name if product.category else 'Unknown',
+                        item,
+                    )
+                elif 'product_id' in item:
+                    # Product not found in database
+                    line_item = StripeService.inline_line_item(
+                        item.get('name', f'Product ID {item["product_id"]}'), None, item['product_id'], 'Unknown', item
+                    )
+                else:
+                    # No product_id provided, use basic product data
+                    line_item = StripeService.inline_line_item(
+                        item.get('name', 'Product'), item.get('description', None), None, 'Unknown', item
+                    )
                 
                 line_items.append(line_item)
 
@@ -392,6 +318,34 @@ class StripeService:
         except Exception as e:
             raise Exception(f"Checkout session error: {str(e)}")
 
+    @staticmethod
+    def inline_line_item(name, description, product_id, category_name, item):
+        """A checkout line that creates its product and price inline, for items without a Stripe price"""
+        if product_id is None:
+            product_url = f"{settings.BASE_URL}/admin/products/unknown"
+        else:
+            product_url = f"{settings.BASE_URL}/admin/products/product/{product_id}"
+        line_item = {
+            'price_data': {
+                'currency': 'cad',
+                'product_data': {
+                    'name': name,
+                    'metadata': {
+                        'product_id': str(product_id or 'unknown'),
+                        'category': category_name,
+                        'product_url': product_url,
+                    }
+                },
+                'unit_amount': int(Decimal(str(item['price'])) * 100),
+            },
+            'quantity': item['quantity'],
+        }
+        
+        # Add description if available
+        if description:
+            line_item['price_data']['product_data']['description'] = description
+        return line_item
+
     @staticmethod
     def get_checkout_session(session_id):
         """Retrieve a Stripe Checkout Session."""
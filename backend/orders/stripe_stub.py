@@ -0,0 +1,202 @@
+"""
+A stand-in for the Stripe API, for tests and latency benchmarks.
+
+``StripeStub`` serves the part of the API the checkout code uses
+(products, prices and checkout sessions) from memory, over HTTP on a
+local port. Inside ``with StripeStub() as stub:`` the ``stripe`` library
+talks to it instead of api.stripe.com, and every request it receives is
+listed in ``stub.requests`` as ``(method, path)``. ``latency`` (seconds)
+is added to every response to stand in for the round trip to Stripe.
+"""
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import stripe
+
+
+class StripeStub:
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.requests = []
+        self.products = {}
+        self.prices = {}
+        self.sessions = {}
+        # The form fields each session was created with
+        self.session_params = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self._saved = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        handler = type('Handler', (StripeStubHandler,), {'stub': self})
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        self._saved = (stripe.api_base, stripe.api_key, stripe.max_network_retries)
+        stripe.api_base = self.url
+        stripe.api_key = stripe.api_key or 'sk_test_stub'
+        stripe.max_network_retries = 0
+        return self
+
+    def stop(self):
+        stripe.api_base, stripe.api_key, stripe.max_network_retries = self._saved
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_requests(self):
+        with self._lock:
+            self.requests.clear()
+
+    def new_id(self, prefix):
+        return f'{prefix}_stub{next(self._ids):06d}'
+
+    # Endpoints: each takes the form fields and returns (status, body)
+
+    def list_products(self, params):
+        metadata = {key[len('metadata['):-1]: value for key, value in params.items() if key.startswith('metadata[')}
+        data = [
+            product for product in self.products.values()
+            if all(product['metadata'].get(key) == value for key, value in metadata.items())
+        ]
+        return 200, {'object': 'list', 'url': '/v1/products', 'has_more': False, 'data': data}
+
+    def create_product(self, params):
+        product = {
+            'id': self.new_id('prod'),
+            'object': 'product',
+            'active': True,
+            'name': params.get('name', ''),
+            'description': params.get('description'),
+            'metadata': {
+                key[len('metadata['):-1]: value for key, value in params.items() if key.startswith('metadata[')
+            },
+        }
+        self.products[product['id']] = product
+        return 200, product
+
+    def update_product(self, product_id, params):
+        product = self.products.get(product_id)
+        if product is None:
+            return self.missing('product', product_id)
+        if 'name' in params:
+            product['name'] = params['name']
+        return 200, product
+
+    def list_prices(self, params):
+        data = [
+            price for price in self.prices.values()
+            if ('product' not in params or price['product'] == params['product'])
+            and ('unit_amount' not in params or price['unit_amount'] == int(params['unit_amount']))
+        ]
+        return 200, {'object': 'list', 'url': '/v1/prices', 'has_more': False, 'data': data}
+
+    def create_price(self, params):
+        if params.get('product') not in self.products:
+            return self.missing('product', params.get('product'))
+        price = {
+            'id': self.new_id('price'),
+            'object': 'price',
+            'active': True,
+            'product': params['product'],
+            'unit_amount': int(params['unit_amount']),
+            'currency': params.get('currency', 'cad'),
+        }
+        self.prices[price['id']] = price
+        return 200, price
+
+    def create_session(self, params):
+        for key, value in params.items():
+            if key.startswith('line_items[') and key.endswith('[price]') and value not in self.prices:
+                return self.missing('price', value)
+        session_id = self.new_id('cs_test')
+        session = {
+            'id': session_id,
+            'object': 'checkout.session',
+            'url': f'{self.url}/pay/{session_id}',
+            'payment_status': 'unpaid',
+            'status': 'open',
+            'metadata': {
+                key[len('metadata['):-1]: value for key, value in params.items() if key.startswith('metadata[')
+            },
+        }
+        self.sessions[session_id] = session
+        self.session_params[session_id] = params
+        return 200, session
+
+    def retrieve_session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            return self.missing('checkout.session', session_id)
+        return 200, session
+
+    @staticmethod
+    def missing(resource, resource_id):
+        return 404, {'error': {
+            'type': 'invalid_request_error',
+            'code': 'resource_missing',
+            'message': f"No such {resource}: '{resource_id}'",
+        }}
+
+    def dispatch(self, method, path, params):
+        parts = path.strip('/').split('/')[1:]  # Without the "v1"
+        if parts == ['products']:
+            return self.list_products(params) if method == 'GET' else self.create_product(params)
+        if len(parts) == 2 and parts[0] == 'products' and method == 'POST':
+            return self.update_product(parts[1], params)
+        if parts == ['prices']:
+            return self.list_prices(params) if method == 'GET' else self.create_price(params)
+        if parts == ['checkout', 'sessions'] and method == 'POST':
+            return self.create_session(params)
+        if len(parts) == 3 and parts[:2] == ['checkout', 'sessions'] and method == 'GET':
+            return self.retrieve_session(parts[2])
+        return 404, {'error': {'type': 'invalid_request_error', 'message': f'Unrecognized request URL ({method}: {path})'}}
+
+
+class StripeStubHandler(BaseHTTPRequestHandler):
+    stub = None
+
+    def handle_request(self, method):
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(url.query))
+        if method == 'POST':
+            length = int(self.headers.get('Content-Length') or 0)
+            params.update(parse_qsl(self.rfile.read(length).decode()))
+        if self.stub.latency:
+            time.sleep(self.stub.latency)
+        with self.stub._lock:
+            self.stub.requests.append((method, url.path))
+            status, body = self.stub.dispatch(method, url.path, params)
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def log_message(self, format, *args):
+        pass
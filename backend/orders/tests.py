@@ -1,4 +1,9 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import time
+from pathlib import Path
+from unittest import mock
+from django.test import TestCase, TransactionTestCase, override_settings
 from rest_framework.exceptions import ValidationError
 from decimal import Decimal
 from products.models import Category, Product
@@ -149,4 +154,748 @@ class OrderInventoryValidationTestCase(TestCase):
         with self.assertRaises(ValidationError) as context:
             serializer.is_valid(raise_exception=True)
         
-        self.assertIn('out of stock', str(context.exception))
\ No newline at end of file
+        self.assertIn('out of stock', str(context.exception))
+
+class OrderDetailQueryCountTestCase(TestCase):
+    def test_order_items_resolve_primary_images_in_one_query(self):
+        from products.models import ProductImage
+        from .models import Order, OrderItem
+        from .views import OrderDetailByTokenView
+        from .serializers import OrderSerializer
+
+        category = Category.objects.create(name="Test Category")
+        order = Order.objects.create(
+            customer_email='test@example.com', customer_first_name='Test', customer_last_name='User',
+            billing_address_line1='123 Test St', billing_city='Test City', billing_state='ON',
+            billing_postal_code='12345', shipping_address_line1='123 Test St', shipping_city='Test City',
+            shipping_state='ON', shipping_postal_code='12345', subtotal=Decimal('300.00'),
+            tax_amount=Decimal('0.00'), total_amount=Decimal('300.00'), payment_method='card'
+        )
+        for i in range(3):
+            product = Product.objects.create(
+                name=f"Product {i}", description="Test", price=Decimal('100.00'),
+                category=category, quantity=5
+            )
+            ProductImage.objects.create(product=product, image_data=b"image-bytes", order=0)
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+
+        # order, items, products, primary images
+        with self.assertNumQueries(4):
+            fetched = OrderDetailByTokenView.queryset.get(confirmation_token=order.confirmation_token)
+            data = OrderSerializer(fetched).data
+        self.assertTrue(all(item['product']['primary_image'] for item in data['items']))
+
+
+class CartPricingTestCase(TestCase):
+    def setUp(self):
+        from products.snapshot import CatalogSnapshot
+
+        CatalogSnapshot.clear()
+        category = Category.objects.create(name="Test Category")
+        self.pump = Product.objects.create(
+            name="Pump", description="Test", price=Decimal('19.99'), category=category, quantity=5
+        )
+        self.valve = Product.objects.create(
+            name="Valve", description="Test", price=Decimal('100.00'), category=category, quantity=2
+        )
+        self.retired = Product.objects.create(
+            name="Retired", description="Test", price=Decimal('10.00'), category=category, quantity=3, active=False
+        )
+
+    def test_totals_cover_valid_lines(self):
+        from .pricing import INACTIVE, INSUFFICIENT_QUANTITY, NOT_FOUND, price_cart
+
+        pricing = price_cart([
+            {'product_id': str(self.pump.id), 'quantity': 3},
+            {'product_id': str(self.valve.id), 'quantity': 5},
+            {'product_id': str(self.retired.id), 'quantity': 1},
+            {'product_id': '00000000-0000-0000-0000-000000000000', 'quantity': 1},
+        ], 'CA')
+
+        self.assertEqual(
+            [line.status for line in pricing.issues],
+            [INSUFFICIENT_QUANTITY, INACTIVE, NOT_FOUND]
+        )
+        self.assertEqual(pricing.subtotal, Decimal('59.97'))
+        self.assertEqual(pricing.tax_amount, Decimal('7.80'))
+        self.assertEqual(pricing.total, Decimal('67.77'))
+        self.assertFalse(pricing.is_valid)
+
+    def test_no_tax_for_us(self):
+        from .pricing import price_cart
+
+        pricing = price_cart([{'product_id': str(self.valve.id), 'quantity': 1}], 'US')
+        self.assertEqual(pricing.tax_amount, Decimal('0.00'))
+        self.assertEqual(pricing.total, Decimal('100.00'))
+
+    def test_float_prices_match_current_price(self):
+        from .pricing import price_cart
+
+        pricing = price_cart([
+            {'product_id': str(self.pump.id), 'quantity': 1, 'price': 19.99},
+            {'product_id': str(self.valve.id), 'quantity': 1, 'price': 90},
+        ])
+        self.assertEqual([line.product.name for line in pricing.price_changes], ['Valve'])
+
+    def test_whole_cart_resolved_with_one_query(self):
+        from products.snapshot import CatalogSnapshot
+        from .pricing import price_cart
+
+        items = [{'product_id': str(product.id), 'quantity': 1} for product in (self.pump, self.valve)]
+        CatalogSnapshot.current()
+        # content version only
+        with self.assertNumQueries(1):
+            price_cart(items)
+
+    def test_memoized_on_request(self):
+        from django.test import RequestFactory
+        from .pricing import price_request_cart
+
+        request = RequestFactory().post('/')
+        items = [{'product_id': str(self.pump.id), 'quantity': '2', 'price': '19.99'}]
+        pricing = price_request_cart(request, items, 'CA')
+        with self.assertNumQueries(0):
+            same = price_request_cart(request, [{'product_id': str(self.pump.id), 'quantity': 2, 'price': 19.99}], 'CA')
+        self.assertIs(same, pricing)
+        self.assertIsNot(price_request_cart(request, items, 'US'), pricing)
+
+    def test_order_totals_come_from_pricing(self):
+        order_data = {
+            'customer_email': 'test@example.com', 'customer_first_name': 'Test', 'customer_last_name': 'User',
+            'billing_address_line1': '123 Test St', 'billing_city': 'Test City', 'billing_state': 'ON',
+            'billing_postal_code': '12345', 'billing_country': 'CA', 'shipping_address_line1': '123 Test St',
+            'shipping_city': 'Test City', 'shipping_state': 'ON', 'shipping_postal_code': '12345',
+            'subtotal': Decimal('1.00'), 'tax_amount': Decimal('0.00'), 'total_amount': Decimal('1.00'),
+            'payment_method': 'purchase_order',
+            'order_items': [{'product_id': str(self.valve.id), 'quantity': 2, 'price': '100.00'}],
+        }
+        serializer = OrderCreateSerializer(data=order_data)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertEqual(serializer.validated_data['subtotal'], Decimal('200.00'))
+        self.assertEqual(serializer.validated_data['tax_amount'], Decimal('26.00'))
+        self.assertEqual(serializer.validated_data['total_amount'], Decimal('226.00'))
+
+
+def create_test_order(**fields):
+    from .models import Order
+
+    values = dict(
+        customer_email='test@example.com', customer_first_name='Test', customer_last_name='User',
+        billing_address_line1='123 Test St', billing_city='Test City', billing_state='ON',
+        billing_postal_code='12345', shipping_address_line1='123 Test St', shipping_city='Test City',
+        shipping_state='ON', shipping_postal_code='12345', subtotal=Decimal('0.00'),
+        tax_amount=Decimal('0.00'), total_amount=Decimal('0.00'), payment_method='card'
+    )
+    values.update(fields)
+    return Order.objects.create(**values)
+
+
+class StockReservationTestCase(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Test Category")
+        self.product = Product.objects.create(
+            name="Pump", description="Test", price=Decimal('100.00'), category=category, quantity=5
+        )
+
+    def order_for(self, quantity):
+        from .models import OrderItem
+
+        order = create_test_order()
+        OrderItem.objects.create(order=order, product=self.product, quantity=quantity, price=self.product.price)
+        return order
+
+    def stock(self):
+        self.product.refresh_from_db()
+        return self.product.quantity
+
+    def test_hold_takes_stock(self):
+        from .reservations import StockReservationService
+
+        StockReservationService.hold(self.order_for(3))
+        self.assertEqual(self.stock(), 2)
+
+    def test_hold_fails_without_enough_stock(self):
+        from .models import StockReservation
+        from .reservations import InsufficientStock, StockReservationService
+
+        StockReservationService.hold(self.order_for(3))
+        with self.assertRaises(InsufficientStock) as context:
+            StockReservationService.hold(self.order_for(3))
+        self.assertIn('Only 2 units of "Pump"', str(context.exception))
+        self.assertEqual(self.stock(), 2)
+        self.assertEqual(StockReservation.objects.count(), 1)
+
+    def test_checkout_session_for_the_last_units(self):
+        from .reservations import StockReservationService
+        from .stripe_stub import StripeStub
+
+        order = self.order_for(5)
+        StockReservationService.hold(order)
+        self.assertEqual(self.stock(), 0)
+
+        with StripeStub():
+            response = self.client.post(f'/api/orders/{order.order_number}/create-checkout-session/')
+            self.assertEqual(response.status_code, 200, response.content)
+
+            # Another order's holds are not counted as available to this one
+            other = self.order_for(1)
+            response = self.client.post(f'/api/orders/{other.order_number}/create-checkout-session/')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('no longer available', response.json()['error'])
+
+    def test_hold_converts_to_sale_once(self):
+        from .models import StockReservation
+        from .reservations import StockReservationService
+
+        order = self.order_for(3)
+        StockReservationService.hold(order)
+        self.assertEqual(StockReservationService.convert(order), 1)
+        # Payment confirmation, webhook and checkout verification all convert
+        self.assertEqual(StockReservationService.convert(order), 0)
+        self.assertEqual(StockReservationService.convert(order), 0)
+        self.assertEqual(StockReservationService.release(order), 0)
+        self.assertEqual(self.stock(), 2)
+        self.assertEqual(order.reservations.get().status, StockReservation.CONVERTED)
+
+    def test_release_returns_stock(self):
+        from .reservations import StockReservationService
+
+        order = self.order_for(3)
+        StockReservationService.hold(order)
+        self.assertEqual(StockReservationService.release(order), 1)
+        self.assertEqual(StockReservationService.release(order), 0)
+        self.assertEqual(self.stock(), 5)
+
+    def test_expired_holds_are_released(self):
+        from datetime import timedelta
+        from .reservations import StockReservationService
+
+        StockReservationService.hold(self.order_for(2), ttl=timedelta(seconds=-1))
+        StockReservationService.hold(self.order_for(1))
+        self.assertEqual(self.stock(), 2)
+        self.assertEqual(StockReservationService.release_expired(), 1)
+        self.assertEqual(self.stock(), 4)
+
+    def test_hold_reclaims_expired_holds(self):
+        from datetime import timedelta
+        from .reservations import StockReservationService
+
+        StockReservationService.hold(self.order_for(4), ttl=timedelta(seconds=-1))
+        StockReservationService.hold(self.order_for(5))
+        self.assertEqual(self.stock(), 0)
+
+    def test_payment_after_expiry_takes_stock_again(self):
+        from datetime import timedelta
+        from .reservations import StockReservationService
+
+        order = self.order_for(2)
+        StockReservationService.hold(order, ttl=timedelta(seconds=-1))
+        StockReservationService.release_expired()
+        self.assertEqual(StockReservationService.convert(order), 1)
+        self.assertEqual(self.stock(), 3)
+
+    def test_order_without_reservations_converts_once(self):
+        from .reservations import StockReservationService
+
+        order = self.order_for(2)
+        StockReservationService.convert(order)
+        StockReservationService.convert(order)
+        self.assertEqual(self.stock(), 3)
+
+    def test_stock_change_bumps_catalog_version(self):
+        from core.versioning import get_version
+        from .reservations import StockReservationService
+
+        version = get_version('products')
+        StockReservationService.hold(self.order_for(1))
+        self.assertNotEqual(get_version('products'), version)
+
+    def test_order_creation_holds_stock(self):
+        from rest_framework.test import APIClient
+
+        data = {
+            'customer_email': 'test@example.com', 'customer_first_name': 'Test', 'customer_last_name': 'User',
+            'billing_address_line1': '123 Test St', 'billing_city': 'Test City', 'billing_state': 'ON',
+            'billing_postal_code': '12345', 'billing_country': 'CA', 'shipping_address_line1': '123 Test St',
+            'shipping_city': 'Test City', 'shipping_state': 'ON', 'shipping_postal_code': '12345',
+            'subtotal': '400.00', 'tax_amount': '52.00', 'total_amount': '452.00',
+            'payment_method': 'purchase_order',
+            'order_items': [{'product_id': str(self.product.id), 'quantity': 4, 'price': '100.00'}],
+        }
+        client = APIClient()
+        response = client.post('/api/orders/', data, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(self.stock(), 1)
+
+
+    def test_expired_hold_does_not_block_an_order_for_the_last_units(self):
+        from datetime import timedelta
+        from rest_framework.test import APIClient
+        from .reservations import StockReservationService
+
+        # An abandoned checkout held all the stock, and nothing has swept it yet
+        abandoned = self.order_for(5)
+        StockReservationService.hold(abandoned, ttl=timedelta(seconds=-1))
+        self.assertEqual(self.stock(), 0)
+
+        data = {
+            'customer_email': 'test@example.com', 'customer_first_name': 'Test', 'customer_last_name': 'User',
+            'billing_address_line1': '123 Test St', 'billing_city': 'Test City', 'billing_state': 'ON',
+            'billing_postal_code': '12345', 'billing_country': 'CA', 'shipping_address_line1': '123 Test St',
+            'shipping_city': 'Test City', 'shipping_state': 'ON', 'shipping_postal_code': '12345',
+            'subtotal': '500.00', 'tax_amount': '65.00', 'total_amount': '565.00',
+            'payment_method': 'purchase_order',
+            'order_items': [{'product_id': str(self.product.id), 'quantity': 5, 'price': '100.00'}],
+        }
+        response = APIClient().post('/api/orders/', data, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(self.stock(), 0)
+        self.assertFalse(abandoned.reservations.filter(status='held').exists())
+
+    def test_sweeper_command_releases_expired_holds(self):
+        from datetime import timedelta
+        from io import StringIO
+        from django.core.management import call_command
+        from .reservations import StockReservationService
+
+        StockReservationService.hold(self.order_for(2), ttl=timedelta(seconds=-1))
+        out = StringIO()
+        call_command('release_expired_reservations', stdout=out)
+        self.assertIn('Released 1 expired', out.getvalue())
+        self.assertEqual(self.stock(), 5)
+
+
+class StockReservationConcurrencyTestCase(TransactionTestCase):
+    """Many checkouts racing for the same stock, each on its own connection"""
+
+    THREADS = 8
+    ORDERS_PER_THREAD = 10
+    STOCK = 25
+
+    def test_concurrent_holds_never_oversell(self):
+        import threading
+        import time
+        from django.db import OperationalError, connection
+        from .models import OrderItem, StockReservation
+        from .reservations import InsufficientStock, StockReservationService
+
+        category = Category.objects.create(name="Test Category")
+        product = Product.objects.create(
+            name="Pump", description="Test", price=Decimal('100.00'), category=category, quantity=self.STOCK
+        )
+        orders = []
+        for _ in range(self.THREADS * self.ORDERS_PER_THREAD):
+            order = create_test_order()
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+            orders.append(order)
+
+        held = []
+        refused = []
+        converted = []
+        errors = []
+        start = threading.Barrier(self.THREADS)
+
+        def retrying(operation):
+            # Shared-cache SQLite reports a locked table instead of waiting
+            for _ in range(1000):
+                try:
+                    return operation()
+                except OperationalError as e:
+                    if 'locked' not in str(e):
+                        raise
+                    time.sleep(0.001)
+            raise AssertionError('Gave up waiting for the database lock')
+
+        def run(work, batches):
+            def worker(batch):
+                try:
+                    start.wait()
+                    for item in batch:
+                        work(item)
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    connection.close()
+
+            threads = [threading.Thread(target=worker, args=(batch,)) for batch in batches]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        def checkout(order):
+            try:
+                retrying(lambda: StockReservationService.hold(order))
+                held.append(order)
+            except InsufficientStock:
+                refused.append(order)
+
+        run(checkout, [orders[i::self.THREADS] for i in range(self.THREADS)])
+
+        self.assertEqual(errors, [])
+        product.refresh_from_db()
+        self.assertEqual(len(held), self.STOCK)
+        self.assertEqual(len(refused), len(orders) - self.STOCK)
+        self.assertEqual(product.quantity, 0)
+        self.assertEqual(StockReservation.objects.filter(status=StockReservation.HELD).count(), self.STOCK)
+
+        # Every held order's payment is confirmed by each thread, concurrently
+        def confirm(order):
+            converted.append(retrying(lambda: StockReservationService.convert(order)))
+
+        run(confirm, [held] * self.THREADS)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sum(converted), self.STOCK)
+        product.refresh_from_db()
+        self.assertEqual(product.quantity, 0)
+        self.assertEqual(StockReservation.objects.filter(status=StockReservation.CONVERTED).count(), self.STOCK)
+
+    def test_concurrent_reduce_quantity_never_oversells(self):
+        import threading
+        import time
+        from django.db import OperationalError, connection
+
+        category = Category.objects.create(name="Test Category")
+        product = Product.objects.create(
+            name="Pump", description="Test", price=Decimal('100.00'), category=category, quantity=self.STOCK
+        )
+        sold = []
+        errors = []
+        start = threading.Barrier(self.THREADS)
+
+        def buyer():
+            try:
+                # Each buyer loaded the product before anyone bought it
+                mine = Product.objects.get(pk=product.pk)
+                start.wait()
+                for _ in range(self.ORDERS_PER_THREAD):
+                    for _ in range(1000):
+                        try:
+                            if mine.reduce_quantity(1):
+                                sold.append(1)
+                            break
+                        except OperationalError as e:
+                            if 'locked' not in str(e):
+                                raise
+                            time.sleep(0.001)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buyer) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        product.refresh_from_db()
+        self.assertEqual(len(sold), self.STOCK)
+        self.assertEqual(product.quantity, 0)
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test_secret')
+class StripeWebhookInboxTestCase(TestCase):
+    """Recorded Stripe events through the webhook and the worker; no network"""
+
+    FIXTURES = Path(__file__).resolve().parent / 'fixtures' / 'stripe_events'
+
+    def setUp(self):
+        from .models import OrderItem
+        from .reservations import StockReservationService
+
+        category = Category.objects.create(name="Test Category")
+        self.product = Product.objects.create(
+            name="Pump", description="Test", price=Decimal('100.00'), category=category, quantity=5
+        )
+        self.order = create_test_order(
+            order_number='RES100001', stripe_payment_intent_id='pi_3PqFixtureIntent0001',
+            subtotal=Decimal('100.00'), tax_amount=Decimal('13.00'), total_amount=Decimal('113.00')
+        )
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=2, price=self.product.price)
+        StockReservationService.hold(self.order)
+
+    def event_payload(self, name):
+        return (self.FIXTURES / f'{name}.json').read_bytes()
+
+    def deliver(self, payload, secret='whsec_test_secret'):
+        timestamp = int(time.time())
+        signature = hmac.new(secret.encode(), f'{timestamp}.'.encode() + payload, hashlib.sha256).hexdigest()
+        return self.client.post(
+            '/api/stripe/webhook/', payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}'
+        )
+
+    def process(self):
+        from .stripe_events import StripeEventProcessor
+
+        with mock.patch('orders.stripe_events.OrderEmailService') as emails:
+            with self.captureOnCommitCallbacks(execute=True):
+                result = StripeEventProcessor.process_pending()
+        return result, emails
+
+    def stock(self):
+        self.product.refresh_from_db()
+        return self.product.quantity
+
+    def test_event_is_stored_and_acknowledged_without_processing(self):
+        from .models import StripeEvent
+
+        response = self.deliver(self.event_payload('payment_intent.succeeded'))
+        self.assertEqual(response.status_code, 200)
+        event = StripeEvent.objects.get()
+        self.assertEqual(event.event_id, 'evt_3PqFixtureSucceeded0001')
+        self.assertEqual(event.status, StripeEvent.PENDING)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'pending')
+
+    def test_redelivered_event_is_stored_once(self):
+        from .models import StripeEvent
+
+        payload = self.event_payload('payment_intent.succeeded')
+        for _ in range(3):
+            self.assertEqual(self.deliver(payload).status_code, 200)
+        self.assertEqual(StripeEvent.objects.count(), 1)
+
+    def test_bad_signature_is_rejected(self):
+        from .models import StripeEvent
+
+        response = self.deliver(self.event_payload('payment_intent.succeeded'), secret='whsec_wrong')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_payment_succeeded_is_applied_once(self):
+        from .models import StripeEvent
+
+        payload = self.event_payload('payment_intent.succeeded')
+        self.deliver(payload)
+        (processed, errors), emails = self.process()
+        self.assertEqual((processed, errors), (1, 0))
+        emails.send_payment_success_notification.assert_called_once()
+
+        # Delivered again after processing: acknowledged, not applied again
+        self.deliver(payload)
+        (processed, errors), emails = self.process()
+        self.assertEqual((processed, errors), (0, 0))
+        emails.send_payment_success_notification.assert_not_called()
+
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.payment_status, self.order.status), ('completed', 'processing'))
+        self.assertEqual(self.stock(), 3)
+        event = StripeEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), (StripeEvent.PROCESSED, 1))
+        self.assertIsNotNone(event.processing_ms)
+        self.assertGreaterEqual(event.lag.total_seconds(), 0)
+
+    def test_payment_failed_keeps_hold(self):
+        self.deliver(self.event_payload('payment_intent.payment_failed'))
+        _, emails = self.process()
+        emails.send_payment_failed_notification.assert_called_once_with(self.order, 'Your card has insufficient funds.')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'failed')
+        self.assertEqual(self.stock(), 3)
+
+    def test_canceled_and_expired_release_stock(self):
+        for name in ('payment_intent.canceled', 'checkout.session.expired'):
+            self.deliver(self.event_payload(name))
+        (processed, errors), _ = self.process()
+        self.assertEqual((processed, errors), (2, 0))
+        self.assertEqual(self.stock(), 5)
+
+    def test_checkout_session_completed(self):
+        self.deliver(self.event_payload('checkout.session.completed'))
+        self.process()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'completed')
+        self.assertEqual(self.stock(), 3)
+
+    def test_failing_event_is_rolled_back_and_retried(self):
+        from .models import StripeEvent
+        from .stripe_events import MAX_ATTEMPTS
+
+        self.deliver(self.event_payload('payment_intent.succeeded'))
+        handlers = {'payment_intent.succeeded': mock.Mock(side_effect=RuntimeError('boom'))}
+        with mock.patch.dict('orders.stripe_events.HANDLERS', handlers), self.assertLogs('orders.stripe_events'):
+            (processed, errors), _ = self.process()
+            self.assertEqual((processed, errors), (0, 1))
+            event = StripeEvent.objects.get()
+            self.assertEqual((event.status, event.attempts, event.last_error), (StripeEvent.PENDING, 1, 'boom'))
+            for _ in range(MAX_ATTEMPTS - 1):
+                self.process()
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), (StripeEvent.FAILED, MAX_ATTEMPTS))
+        # Failed events are left for inspection, not retried
+        (processed, errors), _ = self.process()
+        self.assertEqual((processed, errors), (0, 0))
+        self.assertEqual(self.stock(), 3)
+
+    @override_settings(OWNER_EMAIL='owner@example.com')
+    def test_email_that_cannot_be_queued_rolls_the_event_back(self):
+        from django.db import DatabaseError
+        from core.models import OutboxMessage
+        from .models import StripeEvent
+        from .stripe_events import StripeEventProcessor
+
+        self.deliver(self.event_payload('payment_intent.succeeded'))
+        with mock.patch('orders.email_service.queue_mail', side_effect=DatabaseError('disk I/O error')):
+            with self.assertLogs('orders.stripe_events'):
+                self.assertEqual(StripeEventProcessor.process_pending(), (0, 1))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'pending')
+        event = StripeEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), (StripeEvent.PENDING, 1))
+
+        self.assertEqual(StripeEventProcessor.process_pending(), (1, 0))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'completed')
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    def test_worker_command(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        self.deliver(self.event_payload('payment_intent.payment_failed'))
+        out = StringIO()
+        with mock.patch('orders.stripe_events.OrderEmailService'):
+            call_command('process_stripe_events', stdout=out)
+        self.assertIn('Processed 1 Stripe events, 0 errors', out.getvalue())
+        call_command('process_stripe_events', '--stats', stdout=out)
+        self.assertIn('processing ms', out.getvalue())
+
+
+class StripePriceMappingTestCase(TestCase):
+    """Checkout sessions against the Stripe stub, counting the requests Stripe receives"""
+
+    def setUp(self):
+        from .stripe_stub import StripeStub
+
+        category = Category.objects.create(name="Test Category")
+        self.pump = Product.objects.create(
+            name="Pump", description="Test", price=Decimal('100.00'), category=category, quantity=5
+        )
+        self.seal = Product.objects.create(
+            name="Seal", description="Test", price=Decimal('12.50'), category=category, quantity=5
+        )
+        self.order = create_test_order(tax_amount=Decimal('14.63'))
+        self.stub = StripeStub().start()
+        self.addCleanup(self.stub.stop)
+
+    def items(self):
+        return [
+            {'product_id': str(product.id), 'name': product.name, 'price': product.price, 'quantity': 1}
+            for product in (self.pump, self.seal)
+        ]
+
+    def checkout(self):
+        from .stripe_service import StripeService
+
+        self.stub.reset_requests()
+        session = StripeService.create_checkout_session(self.order, self.items())
+        return session, list(self.stub.requests)
+
+    def session_prices(self, session):
+        params = self.stub.session_params[session['id']]
+        return [params[f'line_items[{i}][price]'] for i in range(2)]
+
+    def test_cold_checkout_creates_and_maps_stripe_objects(self):
+        from .models import StripePriceMapping
+
+        session, requests = self.checkout()
+        self.assertEqual(requests.count(('POST', '/v1/prices')), 2)
+        self.assertEqual(requests[-1], ('POST', '/v1/checkout/sessions'))
+        mapping = StripePriceMapping.objects.get(product=self.seal)
+        self.assertEqual(mapping.unit_amount, 1250)
+        self.assertEqual(self.stub.prices[mapping.stripe_price_id]['product'], mapping.stripe_product_id)
+        self.assertEqual(self.session_prices(session)[1], mapping.stripe_price_id)
+
+    def test_warm_checkout_makes_one_stripe_call(self):
+        first, _ = self.checkout()
+        with self.assertNumQueries(3):  # The products, the order's holds and the mappings
+            second, requests = self.checkout()
+        self.assertEqual(requests, [('POST', '/v1/checkout/sessions')])
+        self.assertEqual(self.session_prices(second), self.session_prices(first))
+
+    def test_price_change_maps_a_new_price_under_the_same_product(self):
+        from .models import StripePriceMapping
+
+        self.checkout()
+        old = StripePriceMapping.objects.get(product=self.pump)
+        # A queryset update sends no signals; the mapping is still not used
+        Product.objects.filter(pk=self.pump.pk).update(price=Decimal('120.00'))
+        self.pump.refresh_from_db()
+
+        session, requests = self.checkout()
+        self.assertEqual(requests, [
+            ('GET', '/v1/prices'), ('POST', '/v1/prices'), ('POST', '/v1/checkout/sessions'),
+        ])
+        new = StripePriceMapping.objects.get(product=self.pump)
+        self.assertEqual(new.stripe_product_id, old.stripe_product_id)
+        self.assertNotEqual(new.stripe_price_id, old.stripe_price_id)
+        self.assertEqual(self.stub.prices[new.stripe_price_id]['unit_amount'], 12000)
+        self.assertEqual(self.session_prices(session)[0], new.stripe_price_id)
+
+        # Back to the old price: Stripe's existing price is found again
+        Product.objects.filter(pk=self.pump.pk).update(price=Decimal('100.00'))
+        self.pump.refresh_from_db()
+        _, requests = self.checkout()
+        self.assertEqual(requests, [('GET', '/v1/prices'), ('POST', '/v1/checkout/sessions')])
+        self.assertEqual(StripePriceMapping.objects.get(product=self.pump).stripe_price_id, old.stripe_price_id)
+
+    def test_rename_renames_the_stripe_product(self):
+        from .models import StripePriceMapping
+
+        self.checkout()
+        self.seal.name = "Mechanical Seal"
+        self.seal.save()
+
+        _, requests = self.checkout()
+        mapping = StripePriceMapping.objects.get(product=self.seal)
+        self.assertEqual(requests, [
+            ('POST', f'/v1/products/{mapping.stripe_product_id}'), ('POST', '/v1/checkout/sessions'),
+        ])
+        self.assertEqual(mapping.product_name, "Mechanical Seal")
+        self.assertEqual(self.stub.products[mapping.stripe_product_id]['name'], "Mechanical Seal")
+
+    def test_stripe_product_deleted_upstream_is_mapped_again(self):
+        from .models import StripePriceMapping
+
+        self.checkout()
+        mapping = StripePriceMapping.objects.get(product=self.pump)
+        del self.stub.products[mapping.stripe_product_id]
+        Product.objects.filter(pk=self.pump.pk).update(price=Decimal('110.00'))
+        self.pump.refresh_from_db()
+
+        # Falls back to an inline price and forgets the mapping
+        with self.assertLogs('orders.stripe_prices', 'WARNING'), mock.patch('builtins.print'):
+            session, _ = self.checkout()
+        params = self.stub.session_params[session.id]
+        self.assertEqual(params['line_items[0][price_data][unit_amount]'], '11000')
+        self.assertFalse(StripePriceMapping.objects.filter(product=self.pump).exists())
+
+        self.checkout()
+        mapping = StripePriceMapping.objects.get(product=self.pump)
+        self.assertIn(mapping.stripe_product_id, self.stub.products)
+
+    def test_checkout_view_maps_the_frontend_payload(self):
+        from .models import OrderItem, StripePriceMapping
+
+        for product in (self.pump, self.seal):
+            OrderItem.objects.create(order=self.order, product=product, quantity=1, price=product.price)
+        # What Checkout.tsx sends: no product ids
+        payload = {'order_items': [
+            {'name': 'Pump', 'price': 100.0, 'quantity': 1},
+            {'name': 'Seal', 'price': 12.5, 'quantity': 1},
+        ]}
+        url = f'/api/orders/{self.order.order_number}/create-checkout-session/'
+
+        for _ in range(2):
+            self.stub.reset_requests()
+            response = self.client.post(url, payload, content_type='application/json')
+            self.assertEqual(response.status_code, 200, response.content)
+
+        # The second checkout is served from the mapping
+        self.assertEqual(self.stub.requests, [('POST', '/v1/checkout/sessions')])
+        session_prices = set(self.session_prices(self.stub.sessions[response.json()['checkout_session_id']]))
+        self.assertEqual(session_prices, set(StripePriceMapping.objects.values_list('stripe_price_id', flat=True)))
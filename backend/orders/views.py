@@ -2,11 +2,15 @@ from rest_framework import status, generics
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
-from decimal import Decimal, ROUND_HALF_UP
+from django.db import transaction
+from django.db.models import Prefetch
 from .models import Order, OrderItem
 from .serializers import OrderSerializer, OrderCreateSerializer
 from .stripe_service import StripeService
 from .email_service import OrderEmailService
+from .pricing import INACTIVE, INSUFFICIENT_QUANTITY, NOT_FOUND, OUT_OF_STOCK, price_request_cart
+from .reservations import InsufficientStock, StockReservationService
+from .stripe_events import StripeEventProcessor
 from products.models import Product
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
@@ -21,6 +25,15 @@ class OrderCreateView(generics.CreateAPIView):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
 
+            # Save the order and hold its stock together, so an order only
+            # exists if its stock could be reserved
+            try:
+                with transaction.atomic():
+                    order = serializer.save()
+                    StockReservationService.hold(order)
+            except InsufficientStock as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
             # Check if this is a card payment
             payment_method = request.data.get('payment_method', '')
 
@@ -31,14 +44,14 @@ class OrderCreateView(generics.CreateAPIView):
 
                     stripe_response = StripeService.create_payment_intent(
                         request.data,
-                        order_items
+                        order_items,
+                        pricing=serializer.pricing
                     )
 
-                    # Save the order with Stripe payment intent details
-                    order = serializer.save(
-                        stripe_payment_intent_id=stripe_response['payment_intent_id'],
-                        stripe_payment_intent_client_secret=stripe_response['client_secret']
-                    )
+                    # Save the Stripe payment intent details
+                    order.stripe_payment_intent_id = stripe_response['payment_intent_id']
+                    order.stripe_payment_intent_client_secret = stripe_response['client_secret']
+                    order.save(update_fields=['stripe_payment_intent_id', 'stripe_payment_intent_client_secret', 'updated_at'])
 
                     # Return order data with Stripe client secret
                     response_serializer = OrderSerializer(order, context={'request': request})
@@ -51,13 +64,15 @@ class OrderCreateView(generics.CreateAPIView):
                 except Exception as e:
                     print(">>> ERROR in StripeService or order save:", str(e))
                     import traceback; traceback.print_exc()
+                    # No payment can follow; give the stock back and drop the order
+                    StockReservationService.release(order)
+                    order.delete()
                     return Response(
                         {'error': f'Payment processing failed: {str(e)}'},
                         status=status.HTTP_400_BAD_REQUEST
                     )
             else:
-                # For non-card payments (e.g., purchase orders), create order normally
-                order = serializer.save()
+                # For non-card payments (e.g., purchase orders), the order is created as is
                 print(f">>> Non-card order {order.order_number} created successfully")
                 response_serializer = OrderSerializer(order, context={'request': request})
                 return Response(response_serializer.data, status=status.HTTP_201_CREATED)
@@ -67,7 +82,9 @@ class OrderCreateView(generics.CreateAPIView):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 class OrderDetailByTokenView(generics.RetrieveAPIView):
-    queryset = Order.objects.prefetch_related('items__product')
+    queryset = Order.objects.prefetch_related(
+        Prefetch('items__product', queryset=Product.objects.select_related('category').with_primary_image())
+    )
     serializer_class = OrderSerializer
     lookup_field = 'confirmation_token'
     lookup_url_kwarg = 'token'
@@ -81,8 +98,7 @@ def calculate_order_total(request):
         return Response(status=status.HTTP_200_OK)
     
     cart_items = request.data.get('items', [])
-    billing_country = request.data.get('billing_country', 'CA')
-    subtotal = 0
+    pricing = price_request_cart(request, cart_items, request.data.get('billing_country', 'CA'))
     
     # Track issues with cart items
     unavailable_items = []
@@ -90,66 +106,56 @@ def calculate_order_total(request):
     price_issues = []
     valid_items = []
     
-    for item in cart_items:
-        try:
-            product = Product.objects.get(id=item['product_id'])
-            item_info = {
-                'product_id': str(product.id),
-                'product_name': product.name,
-                'requested_quantity': item['quantity']
-            }
-            
-            # Check if product is available (active and has stock)
-            if not product.is_available:
-                unavailable_items.append({
-                    **item_info,
-                    'reason': 'inactive' if not product.active else 'out_of_stock',
-                    'available_quantity': product.quantity
-                })
-                continue
-            
-            # Check if requested quantity is available
-            if item['quantity'] > product.quantity:
-                quantity_issues.append({
-                    **item_info,
-                    'available_quantity': product.quantity,
-                    'message': f'Only {product.quantity} units available'
-                })
-                continue
-            
-            # Check if price has changed
-            if item.get('price') and item['price'] != product.price:
+    for line in pricing.lines:
+        if line.status == NOT_FOUND:
+            unavailable_items.append({
+                'product_id': line.product_id,
+                'product_name': 'Unknown Product',
+                'requested_quantity': line.quantity,
+                'reason': 'not_found',
+                'message': 'Product no longer exists'
+            })
+            continue
+        
+        product = line.product
+        item_info = {
+            'product_id': str(product.id),
+            'product_name': product.name,
+            'requested_quantity': line.quantity
+        }
+        
+        if line.status in (INACTIVE, OUT_OF_STOCK):
+            unavailable_items.append({
+                **item_info,
+                'reason': line.status,
+                'available_quantity': product.quantity
+            })
+        elif line.status == INSUFFICIENT_QUANTITY:
+            quantity_issues.append({
+                **item_info,
+                'available_quantity': product.quantity,
+                'message': f'Only {product.quantity} units available'
+            })
+        else:
+            if line.price_changed:
+                # Still included in the totals, at the current price
                 price_issues.append({
                     **item_info,
-                    'old_price': item['price'],
+                    'old_price': line.requested_price,
                     'current_price': product.price,
                     'message': 'Price has changed'
                 })
-                # Still include in calculation with current price
-            
-            # Item is valid - add to calculation
-            item_total = product.price * item['quantity']
-            subtotal += item_total
             valid_items.append({
                 **item_info,
                 'price': product.price,
-                'total': item_total
-            })
-            
-        except Product.DoesNotExist:
-            unavailable_items.append({
-                'product_id': item.get('product_id', 'unknown'),
-                'product_name': 'Unknown Product',
-                'requested_quantity': item.get('quantity', 0),
-                'reason': 'not_found',
-                'message': 'Product no longer exists'
+                'total': line.total
             })
     
-    # Calculate totals for valid items only
-    # Apply 0% tax for US, 13% for other countries
-    tax_rate = Decimal('0.00') if billing_country == 'US' else Decimal('0.13')
-    tax_amount = (subtotal * tax_rate).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-    total_amount = (subtotal + tax_amount).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    subtotal = pricing.subtotal
+    tax_rate = pricing.tax_rate
+    tax_amount = pricing.tax_amount
+    total_amount = pricing.total
+    billing_country = pricing.billing_country
     
     # Determine response status and structure
     has_issues = bool(unavailable_items or quantity_issues)
@@ -181,67 +187,59 @@ def validate_cart(request):
     if request.method == 'OPTIONS':
         return Response(status=status.HTTP_200_OK)
     
-    cart_items = request.data.get('items', [])
+    pricing = price_request_cart(request, request.data.get('items', []))
     
     # Track issues and valid items
     valid_cart_items = []
     removed_items = []
     updated_items = []
     
-    for item in cart_items:
-        try:
-            product = Product.objects.get(id=item['product_id'])
-            
-            # Check if product is available
-            if not product.is_available:
-                removed_items.append({
-                    'product_id': str(product.id),
-                    'product_name': product.name,
-                    'reason': 'inactive' if not product.active else 'out_of_stock',
-                    'message': f'Removed: {product.name} is no longer available'
-                })
-                continue
-            
-            # Check if requested quantity needs adjustment
-            original_quantity = item['quantity']
-            adjusted_quantity = min(original_quantity, product.quantity)
-            
-            if adjusted_quantity == 0:
-                removed_items.append({
-                    'product_id': str(product.id),
-                    'product_name': product.name,
-                    'reason': 'out_of_stock',
-                    'message': f'Removed: {product.name} is out of stock'
-                })
-                continue
-            
-            # Create cleaned cart item
-            clean_item = {
-                'product_id': str(product.id),
-                'quantity': adjusted_quantity,
-                'price': product.price,
-                'product_name': product.name
-            }
-            
-            valid_cart_items.append(clean_item)
-            
-            # Track if quantity was adjusted
-            if adjusted_quantity != original_quantity:
-                updated_items.append({
-                    'product_id': str(product.id),
-                    'product_name': product.name,
-                    'original_quantity': original_quantity,
-                    'adjusted_quantity': adjusted_quantity,
-                    'message': f'Quantity reduced to {adjusted_quantity} (maximum available)'
-                })
-            
-        except Product.DoesNotExist:
+    for line in pricing.lines:
+        if line.status == NOT_FOUND:
             removed_items.append({
-                'product_id': item.get('product_id', 'unknown'),
+                'product_id': line.product_id,
                 'product_name': 'Unknown Product',
                 'reason': 'not_found',
                 'message': 'Removed: Product no longer exists'
             })
+            continue
+        
+        product = line.product
+        if line.status in (INACTIVE, OUT_OF_STOCK):
+            removed_items.append({
+                'product_id': str(product.id),
+                'product_name': product.name,
+                'reason': line.status,
+                'message': f'Removed: {product.name} is no longer available'
+            })
+            continue
+        
+        # Too large quantities are reduced to what is in stock
+        adjusted_quantity = min(line.quantity, product.quantity)
+        if adjusted_quantity <= 0:
+            removed_items.append({
+                'product_id': str(product.id),
+                'product_name': product.name,
+                'reason': 'out_of_stock',
+                'message': f'Removed: {product.name} is out of stock'
+            })
+            continue
+        
+        valid_cart_items.append({
+            'product_id': str(product.id),
+            'quantity': adjusted_quantity,
+            'price': product.price,
+            'product_name': product.name
+        })
+        
+        if adjusted_quantity != line.quantity:
+            updated_items.append({
+                'product_id': str(product.id),
+                'product_name': product.name,
+                'original_quantity': line.quantity,
+                'adjusted_quantity': adjusted_quantity,
+                'message': f'Quantity reduced to {adjusted_quantity} (maximum available)'
+            })
     
     return Response({
         'valid_cart_items': valid_cart_items,
@@ -268,25 +266,23 @@ def confirm_payment(request, order_number):
         # Verify payment with Stripe
         payment_intent = StripeService.get_payment_intent(payment_intent_id)
         
-        # Update order payment status
-        order = StripeService.update_order_payment_status(order, payment_intent)
-        
-        # Send email notifications if payment was successful
-        if payment_intent.status == 'succeeded':
-            # Reduce product quantities
-            for order_item in order.items.select_related('product').all():
-                product = order_item.product
-                if not product.reduce_quantity(order_item.quantity):
-                    # If quantity reduction fails, log an error but don't stop the process
-                    print(f"Warning: Could not reduce quantity for product {product.name} (ID: {product.id})")
+        # The status change and the emails reporting it are committed together
+        with transaction.atomic():
+            # Update order payment status
+            order = StripeService.update_order_payment_status(order, payment_intent)
             
-            OrderEmailService.send_payment_success_notification(order)
-            # Customer confirmation disabled for now
-            # OrderEmailService.send_customer_order_confirmation(order)
-        elif payment_intent.status in ['canceled', 'requires_payment_method']:
-            # Payment failed or was cancelled
-            failure_reason = getattr(payment_intent, 'cancellation_reason', 'Payment failed or cancelled')
-            OrderEmailService.send_payment_failed_notification(order, failure_reason)
+            # Send email notifications if payment was successful
+            if payment_intent.status == 'succeeded':
+                # The order's stock holds become a sale (once, however often we get here)
+                StockReservationService.convert(order)
+                
+                OrderEmailService.send_payment_success_notification(order)
+                # Customer confirmation disabled for now
+                # OrderEmailService.send_customer_order_confirmation(order)
+            elif payment_intent.status in ['canceled', 'requires_payment_method']:
+                # Payment failed or was cancelled
+                failure_reason = getattr(payment_intent, 'cancellation_reason', 'Payment failed or cancelled')
+                OrderEmailService.send_payment_failed_notification(order, failure_reason)
         
         # Return updated order
         serializer = OrderSerializer(order, context={'request': request})
@@ -306,8 +302,11 @@ def confirm_payment(request, order_number):
 @api_view(['POST'])
 def stripe_webhook(request):
     """
-    Handle Stripe webhook events
+    Receive Stripe webhook events. Verified events are stored in the
+    StripeEvent inbox and acknowledged at once; the process_stripe_events
+    worker applies them (see orders.stripe_events).
     """
+    import json
     import stripe
     from django.conf import settings
     
@@ -317,120 +316,23 @@ def stripe_webhook(request):
     
     if not endpoint_secret:
         # If no webhook secret is configured, skip signature verification (not recommended for production)
-        try:
-            event = stripe.Event.construct_from(request.data, stripe.api_key)
-        except ValueError:
-            return Response({'error': 'Invalid payload'}, status=status.HTTP_400_BAD_REQUEST)
+        event = request.data
     else:
         try:
-            event = stripe.Webhook.construct_event(
+            stripe.Webhook.construct_event(
                 payload, sig_header, endpoint_secret
             )
+            event = json.loads(payload)
         except ValueError:
             return Response({'error': 'Invalid payload'}, status=status.HTTP_400_BAD_REQUEST)
         except stripe.error.SignatureVerificationError:
             return Response({'error': 'Invalid signature'}, status=status.HTTP_400_BAD_REQUEST)
     
-    # Handle the event
-    if event['type'] == 'payment_intent.succeeded':
-        payment_intent = event['data']['object']
-        
-        try:
-            # Find the order by payment intent ID
-            order = Order.objects.get(stripe_payment_intent_id=payment_intent['id'])
-            order.payment_status = 'completed'
-            order.status = 'processing'
-            order.save()
-            
-            # Reduce product quantities
-            for order_item in order.items.select_related('product').all():
-                product = order_item.product
-                if not product.reduce_quantity(order_item.quantity):
-                    # If quantity reduction fails, log an error but don't stop the process
-                    print(f"Warning: Could not reduce quantity for product {product.name} (ID: {product.id})")
-            
-            # Send email notification to owner about successful payment
-            OrderEmailService.send_payment_success_notification(order)
-            # Customer confirmation disabled for now
-            # OrderEmailService.send_customer_order_confirmation(order)
-            
-        except Order.DoesNotExist:
-            pass  # Order might not exist yet
-    
-    elif event['type'] == 'payment_intent.payment_failed':
-        payment_intent = event['data']['object']
-        
-        try:
-            order = Order.objects.get(stripe_payment_intent_id=payment_intent['id'])
-            order.payment_status = 'failed'
-            order.save()
-            
-            # Send email notification to owner about failed payment
-            failure_reason = payment_intent.get('last_payment_error', {}).get('message', 'Payment failed')
-            OrderEmailService.send_payment_failed_notification(order, failure_reason)
-            
-        except Order.DoesNotExist:
-            pass
-
-    elif event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        
-        try:
-            # Find order by checkout session ID or order number in metadata
-            order_number = session.get('metadata', {}).get('order_number')
-            if order_number:
-                order = Order.objects.get(order_number=order_number)
-                if session.payment_status == 'paid':
-                    order.payment_status = 'completed'
-                    order.status = 'processing'
-                    order.save()
-                    
-                    # Reduce product quantities
-                    for order_item in order.items.select_related('product').all():
-                        product = order_item.product
-                        if not product.reduce_quantity(order_item.quantity):
-                            # If quantity reduction fails, log an error but don't stop the process
-                            print(f"Warning: Could not reduce quantity for product {product.name} (ID: {product.id})")
-                    
-                    # Send email notification to owner about successful payment
-                    OrderEmailService.send_payment_success_notification(order)
-                    # Customer confirmation disabled for now
-                    # OrderEmailService.send_customer_order_confirmation(order)
-                    
-        except Order.DoesNotExist:
-            pass
-
-    elif event['type'] == 'checkout.session.expired':
-        session = event['data']['object']
-        
-        try:
-            order_number = session.get('metadata', {}).get('order_number')
-            if order_number:
-                order = Order.objects.get(order_number=order_number)
-                order.payment_status = 'failed'
-                order.save()
-                
-                # Send email notification to owner about expired session
-                OrderEmailService.send_payment_failed_notification(order, "Payment session expired")
-                    
-        except Order.DoesNotExist:
-            pass
-    
-    elif event['type'] == 'payment_intent.canceled':
-        payment_intent = event['data']['object']
-        
-        try:
-            order = Order.objects.get(stripe_payment_intent_id=payment_intent['id'])
-            order.payment_status = 'failed'
-            order.save()
-            
-            # Send email notification to owner about cancelled payment
-            cancellation_reason = payment_intent.get('cancellation_reason', 'Payment cancelled')
-            OrderEmailService.send_payment_failed_notification(order, f"Payment cancelled: {cancellation_reason}")
-            
-        except Order.DoesNotExist:
-            pass
+    if not isinstance(event, dict) or not event.get('id') or not event.get('type'):
+        return Response({'error': 'Invalid payload'}, status=status.HTTP_400_BAD_REQUEST)
     
+    # A redelivered event is acknowledged again but stored once
+    StripeEventProcessor.record(event)
     return Response({'status': 'success'}, status=status.HTTP_200_OK)
 
 @api_view(['POST'])
@@ -438,20 +340,21 @@ def create_checkout_session(request, order_number):
     """Create a Stripe Checkout Session and attach it to the order."""
     try:
         order = Order.objects.get(order_number=order_number)
-        # Expect order_items with name, price, quantity, product_id
-        order_items_payload = request.data.get('order_items', [])
+        # The order's own items, with their product ids, so every line can use
+        # its mapped Stripe price; the client's copy (name, price, quantity) is
+        # only used for orders without items
+        order_items_payload = [
+            {
+                'name': oi.product.name,
+                'price': oi.price,
+                'quantity': oi.quantity,
+                'product_id': oi.product.id,
+                'description': oi.product.description,
+            }
+            for oi in order.items.select_related('product').all()
+        ]
         if not order_items_payload:
-            # Build from existing OrderItems if not provided
-            order_items_payload = [
-                {
-                    'name': oi.product.name,
-                    'price': oi.price,
-                    'quantity': oi.quantity,
-                    'product_id': oi.product.id,
-                    'description': oi.product.description,
-                }
-                for oi in order.items.select_related('product').all()
-            ]
+            order_items_payload = request.data.get('order_items', [])
         session = StripeService.create_checkout_session(order, order_items_payload)
         order.stripe_checkout_session_id = session.id
         order.save(update_fields=['stripe_checkout_session_id'])
@@ -488,41 +391,40 @@ def verify_checkout_session(request, order_number):
         if session.status == 'expired':
             order.payment_status = 'failed'
             order.save(update_fields=['payment_status'])
+            StockReservationService.release(order)
             return Response(
                 {'error': 'Payment session expired', 'verified': False}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Update order status based on session payment status
-        if session.payment_status == 'paid':
-            order.payment_status = 'completed'
-            order.status = 'processing'
-            order.save(update_fields=['payment_status', 'status'])
-            verified = True
+        # The status change and the emails reporting it are committed together
+        with transaction.atomic():
+            # Update order status based on session payment status
+            if session.payment_status == 'paid':
+                order.payment_status = 'completed'
+                order.status = 'processing'
+                order.save(update_fields=['payment_status', 'status'])
+                verified = True
             
-            # Reduce product quantities
-            for order_item in order.items.select_related('product').all():
-                product = order_item.product
-                if not product.reduce_quantity(order_item.quantity):
-                    # If quantity reduction fails, log an error but don't stop the process
-                    print(f"Warning: Could not reduce quantity for product {product.name} (ID: {product.id})")
+                # The order's stock holds become a sale (once, however often we get here)
+                StockReservationService.convert(order)
             
-            # Send email notification to owner about successful payment
-            OrderEmailService.send_payment_success_notification(order)
-            # Customer confirmation disabled for now
-            # OrderEmailService.send_customer_order_confirmation(order)
+                # Send email notification to owner about successful payment
+                OrderEmailService.send_payment_success_notification(order)
+                # Customer confirmation disabled for now
+                # OrderEmailService.send_customer_order_confirmation(order)
             
-        elif session.payment_status == 'unpaid':
-            order.payment_status = 'pending'
-            order.save(update_fields=['payment_status'])
-            verified = False
-        else:
-            order.payment_status = 'failed'
-            order.save(update_fields=['payment_status'])
-            verified = False
+            elif session.payment_status == 'unpaid':
+                order.payment_status = 'pending'
+                order.save(update_fields=['payment_status'])
+                verified = False
+            else:
+                order.payment_status = 'failed'
+                order.save(update_fields=['payment_status'])
+                verified = False
             
-            # Send email notification to owner about failed payment
-            OrderEmailService.send_payment_failed_notification(order, f"Payment verification failed - {session.payment_status}")
+                # Send email notification to owner about failed payment
+                OrderEmailService.send_payment_failed_notification(order, f"Payment verification failed - {session.payment_status}")
         
         # Return verification result
         serializer = OrderSerializer(order, context={'request': request})
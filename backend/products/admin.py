@@ -3,7 +3,7 @@ from django import forms
 from django.utils.safestring import mark_safe
 from django.utils.html import format_html
 from django.urls import reverse
-from .models import Category, Product, ProductImage, ProductSpecification, ProductAttachment
+from .models import Category, Product, ProductImage, ProductSpecification, ProductAttachment, Tag
 
 class ProductImageAdminForm(forms.ModelForm):
     image_file = forms.ImageField(required=False, help_text="Upload an image file")
@@ -16,7 +16,7 @@ class ProductImageAdminForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # If this is an existing instance with image data, show a preview
-        if self.instance and self.instance.pk and self.instance.image_data:
+        if self.instance and self.instance.pk and self.instance.has_blob:
             self.fields['current_image'] = forms.CharField(
                 required=False,
                 widget=forms.HiddenInput(),
@@ -35,7 +35,7 @@ class ProductImageAdminForm(forms.ModelForm):
             raise forms.ValidationError("An image file is required for new product images.")
         
         # For existing instances without image_data, require an image file
-        if self.instance.pk and not self.instance.image_data and not image_file:
+        if self.instance.pk and not self.instance.has_blob and not image_file:
             raise forms.ValidationError("An image file is required.")
             
         return cleaned_data
@@ -50,7 +50,7 @@ class ProductImageAdminForm(forms.ModelForm):
             instance.image_data = image_file.read()
             instance.filename = image_file.name
             instance.content_type = image_file.content_type
-        elif not instance.filename and not instance.image_data:
+        elif not instance.filename and not instance.has_blob:
             # If no filename exists and no image data, this should be caught by clean()
             pass
         
@@ -66,7 +66,7 @@ class ProductImageInline(admin.TabularInline):
     readonly_fields = ['image_preview', 'is_primary_display']
     
     def image_preview(self, obj):
-        if obj and obj.image_data:
+        if obj and obj.has_blob:
             return mark_safe(f'<img src="{obj.data_url}" style="max-height: 100px; max-width: 100px;" />')
         return "No image"
     image_preview.short_description = "Preview"
@@ -90,7 +90,7 @@ class ProductAttachmentAdminForm(forms.ModelForm):
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        if self.instance and self.instance.pk and self.instance.file_data:
+        if self.instance and self.instance.pk and self.instance.has_blob:
             self.fields['current_file'] = forms.CharField(
                 required=False,
                 widget=forms.HiddenInput(),
@@ -106,7 +106,7 @@ class ProductAttachmentAdminForm(forms.ModelForm):
             raise forms.ValidationError("A file is required for new attachments.")
         
         # For existing instances without file_data, require a file
-        if self.instance.pk and not self.instance.file_data and not file_upload:
+        if self.instance.pk and not self.instance.has_blob and not file_upload:
             raise forms.ValidationError("A file is required.")
             
         return cleaned_data
@@ -135,7 +135,7 @@ class ProductAttachmentInline(admin.TabularInline):
     readonly_fields = ['file_preview']
     
     def file_preview(self, obj):
-        if obj and obj.file_data:
+        if obj and obj.has_blob:
             return format_html(
                 '<span style="background: #28a745; color: white; padding: 2px 6px; border-radius: 4px; font-size: 10px;">{} ({}) - {}</span>',
                 obj.filename or 'File',
@@ -366,7 +366,7 @@ class ProductAdmin(admin.ModelAdmin):
                 </div>
         '''
         
-        if primary_image and primary_image.image_data:
+        if primary_image and primary_image.has_blob:
             summary += f'''
                 <div style="flex: 0 0 150px;">
                     <img src="{primary_image.data_url}" style="max-width: 150px; max-height: 150px; border-radius: 6px; border: 1px solid #ddd;" />
@@ -464,7 +464,7 @@ class ProductImageAdmin(admin.ModelAdmin):
     is_primary_display.boolean = True
     
     def image_preview(self, obj):
-        if obj and obj.image_data:
+        if obj and obj.has_blob:
             return mark_safe(f'<img src="{obj.data_url}" style="max-height: 200px; max-width: 200px;" />')
         return "No image"
     image_preview.short_description = "Current Image"
@@ -501,6 +501,25 @@ class ProductSpecificationAdmin(admin.ModelAdmin):
 
     export_to_csv.short_description = "Export selected specifications to CSV"
 
+@admin.register(Tag)
+class TagAdmin(admin.ModelAdmin):
+    """Tags are created from Product.tags; only the display name is edited here"""
+    list_display = ['name', 'slug', 'product_count']
+    search_fields = ['name', 'slug']
+    readonly_fields = ['slug']
+
+    def get_queryset(self, request):
+        from django.db.models import Count
+        return super().get_queryset(request).annotate(product_count=Count('product_tags'))
+
+    def product_count(self, obj):
+        return obj.product_count
+    product_count.short_description = "Products"
+    product_count.admin_order_field = 'product_count'
+
+    def has_add_permission(self, request):
+        return False
+
 @admin.register(ProductAttachment)
 class ProductAttachmentAdmin(admin.ModelAdmin):
     form = ProductAttachmentAdminForm
@@ -516,7 +535,7 @@ class ProductAttachmentAdmin(admin.ModelAdmin):
     get_filename.short_description = "Filename"
     
     def file_info(self, obj):
-        if not obj.file_data:
+        if not obj.has_blob:
             return "No file uploaded"
         
         return format_html(
@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class ProductsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'products'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from core.versioning import register_versioned_models
+        from .models import (
+            Category, Product, ProductImage, ProductAttachment, ProductSpecification, Tag
+        )
+
+        # ProductTag rows only change when their product is saved
+        register_versioned_models(
+            'products',
+            Category, Product, ProductImage, ProductAttachment, ProductSpecification, Tag,
+        )
@@ -0,0 +1,46 @@
+from rest_framework import filters
+
+from .search import ProductSearchIndex
+from .specs import SpecIndex
+from .tags import ProductTags
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    """
+    SearchFilter that queries the FTS5 product index instead of running
+    ``icontains`` over every row.
+
+    Results are ordered by relevance unless the client asked for an
+    explicit ``ordering``, so this backend must come after OrderingFilter.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+
+        rank = not request.query_params.get(filters.OrderingFilter.ordering_param)
+        return ProductSearchIndex.search(queryset, query, rank=rank)
+
+
+class ProductSpecFilter(filters.BaseFilterBackend):
+    """
+    Range filters on the numeric specification index, e.g.
+    ``?spec_flow_rate_min=400&spec_power_max=30`` (see products.specs)
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        spec_filters = SpecIndex.parse_filters(request.query_params)
+        if not spec_filters:
+            return queryset
+        return SpecIndex.filter(queryset, spec_filters)
+
+
+class ProductTagFilter(filters.BaseFilterBackend):
+    """Products carrying every tag in ``?tags=pump,stainless-steel`` (see products.tags)"""
+
+    def filter_queryset(self, request, queryset, view):
+        slugs = ProductTags.parse_filter(request.query_params)
+        if not slugs:
+            return queryset
+        return ProductTags.filter(queryset, slugs)
@@ -0,0 +1,234 @@
+"""
+Typo-tolerant product search with trigram similarity.
+
+Model codes and part numbers ("6020", "125CFM") are often mistyped, and a
+mistyped word matches nothing in the FTS5 index. ``FuzzySearch`` is the
+fallback for such queries: every word of the query is compared with the
+words of product names, tags and specification values by trigram
+similarity, the way PostgreSQL's ``pg_trgm`` does it, and the products
+containing the closest words are returned best match first.
+
+The vocabulary is read from ``products_product_fts_vocab``, an
+``fts5vocab`` view of the search index, so it is always in step with the
+index. Each worker keeps a ``TrigramIndex`` of it in memory and rebuilds
+it when the ``products`` content version changes. Matching products are
+then found through the FTS5 index with the corrected words.
+
+The similarity threshold defaults to ``settings.PRODUCT_FUZZY_SEARCH_THRESHOLD``.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, FloatField, Value, When
+
+from core.versioning import get_version
+
+from .search import FTS_TABLE, VOCAB_TABLE, ProductSearchIndex
+from .suggest import normalize
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 0.3
+
+# Index columns searched; descriptions are prose, not codes
+COLUMNS = ('name', 'tags', 'specifications')
+
+# Closest vocabulary words kept per query word
+TERMS_PER_WORD = 10
+# Products scored per query, best BM25 rank first, and the best of them returned
+CANDIDATE_LIMIT = 500
+RESULT_LIMIT = 50
+
+VERSION_CHECK_INTERVAL = 2.0
+
+
+def trigrams(word):
+    """
+    Trigrams of a word padded like ``pg_trgm`` does (two spaces before, one
+    after), so short words and word starts count
+
+    >>> sorted(trigrams('pump'))
+    ['  p', ' pu', 'mp ', 'pum', 'ump']
+    """
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a, b):
+    """Shared trigrams over all trigrams of the two words, between 0 and 1"""
+    grams_a, grams_b = trigrams(a), trigrams(b)
+    shared = len(grams_a & grams_b)
+    return shared / (len(grams_a) + len(grams_b) - shared)
+
+
+def get_threshold():
+    return getattr(settings, 'PRODUCT_FUZZY_SEARCH_THRESHOLD', DEFAULT_THRESHOLD)
+
+
+class TrigramIndex:
+    """Per-process trigram index of the search vocabulary. Use ``TrigramIndex.current()``."""
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.terms = []
+        self.gram_counts = []
+        self.postings = {}
+        self.stamp = None
+        self.checked_at = 0.0
+        self.builds = 0
+
+    @classmethod
+    def current(cls):
+        """Return this process's index, rebuilt if the catalog changed"""
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            cls._instance.refresh()
+            return cls._instance
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._instance = None
+
+    def refresh(self):
+        now = time.monotonic()
+        if self.stamp is not None and now - self.checked_at < VERSION_CHECK_INTERVAL:
+            return
+        self.checked_at = now
+        stamp = get_version('products')
+        if stamp != self.stamp:
+            self.build(self.collect(), stamp)
+
+    @staticmethod
+    def collect():
+        """Distinct words of the searched index columns"""
+        placeholders = ', '.join(['%s'] * len(COLUMNS))
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT DISTINCT term FROM {VOCAB_TABLE} WHERE col IN ({placeholders})', list(COLUMNS))
+            return [term for term, in cursor.fetchall()]
+
+    def build(self, terms, stamp):
+        started = time.perf_counter()
+        postings = {}
+        gram_counts = []
+        for term_id, term in enumerate(terms):
+            grams = trigrams(term)
+            gram_counts.append(len(grams))
+            for gram in grams:
+                postings.setdefault(gram, []).append(term_id)
+
+        self.terms = list(terms)
+        self.gram_counts = gram_counts
+        self.postings = postings
+        self.stamp = stamp
+        self.builds += 1
+        logger.info(
+            f"Built trigram index: {len(self.terms)} terms, {len(postings)} trigrams "
+            f"in {(time.perf_counter() - started) * 1000:.1f} ms"
+        )
+
+    def similar(self, word, threshold, limit=TERMS_PER_WORD):
+        """``[(term, similarity)]`` of the closest terms at or above ``threshold``, best first"""
+        grams = trigrams(word)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+
+        size = len(grams)
+        matches = []
+        for term_id, count in shared.items():
+            score = count / (size + self.gram_counts[term_id] - count)
+            if score >= threshold:
+                matches.append((score, self.terms[term_id]))
+        matches.sort(key=lambda match: (-match[0], match[1]))
+        return [(term, score) for score, term in matches[:limit]]
+
+    def stats(self):
+        return {'terms': len(self.terms), 'trigrams': len(self.postings), 'stamp': self.stamp, 'builds': self.builds}
+
+
+class FuzzySearch:
+    """Similarity-ranked product search over the trigram index"""
+
+    _available = None
+
+    @classmethod
+    def is_available(cls):
+        """Return True if the search index and its vocabulary view exist"""
+        if not ProductSearchIndex.is_available():
+            return False
+        if cls._available is None:
+            cls._available = VOCAB_TABLE in connection.introspection.table_names()
+        return cls._available
+
+    @staticmethod
+    def match_expression(expansions):
+        """FTS5 expression requiring one of each word's expansions in the searched columns"""
+        columns = ' '.join(COLUMNS)
+        groups = []
+        for terms in expansions:
+            alternatives = ' OR '.join(f'"{term}"' for term, _ in terms)
+            groups.append(f'{{{columns}}} : ({alternatives})')
+        return ' AND '.join(groups)
+
+    @classmethod
+    def scores(cls, query, threshold=None):
+        """
+        ``{product id hex: similarity}`` of the ``RESULT_LIMIT`` products
+        most resembling ``query``.
+        A product's similarity is the mean, over the query's words, of the
+        best similarity of a word it contains; every query word must have
+        a similar word in the product.
+        """
+        words = normalize(query).split()
+        if not words or not cls.is_available():
+            return {}
+        threshold = get_threshold() if threshold is None else threshold
+        index = TrigramIndex.current()
+
+        expansions = [index.similar(word, threshold) for word in words]
+        if not all(expansions):
+            return {}
+
+        sql = f'SELECT product_id, name, tags, specifications FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s'
+        expression = cls.match_expression(expansions)
+        with connection.cursor() as cursor:
+            cursor.execute(f'{sql} LIMIT %s', [expression, CANDIDATE_LIMIT + 1])
+            rows = cursor.fetchall()
+            if len(rows) > CANDIDATE_LIMIT:
+                # Too many to score them all: keep the best ranked. Ranking
+                # scores every match, so it is skipped when it isn't needed.
+                cursor.execute(f'{sql} ORDER BY rank LIMIT %s', [expression, CANDIDATE_LIMIT])
+                rows = cursor.fetchall()
+
+        scores = {}
+        for product_id, *columns in rows:
+            product_words = set(normalize(' '.join(columns)).split())
+            scores[product_id] = sum(
+                max((score for term, score in terms if term in product_words), default=0.0)
+                for terms in expansions
+            ) / len(expansions)
+        best = sorted(scores.items(), key=lambda item: -item[1])[:RESULT_LIMIT]
+        return dict(best)
+
+    @classmethod
+    def search(cls, queryset, query, threshold=None):
+        """
+        Restrict a Product queryset to products resembling ``query``,
+        annotated with ``similarity`` and ordered by it, best first
+        """
+        scores = cls.scores(query, threshold)
+        if not scores:
+            return queryset.none()
+        similarity = Case(
+            *[When(pk=product_id, then=Value(score)) for product_id, score in scores.items()],
+            output_field=FloatField(),
+        )
+        return queryset.filter(pk__in=list(scores)).annotate(similarity=similarity).order_by('-similarity', 'name')
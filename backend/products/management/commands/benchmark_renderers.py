@@ -0,0 +1,99 @@
+import random
+import statistics
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from core.renderers import MessagePackRenderer, ORJSONRenderer
+from products.models import Category, Product
+from products.serializers import ProductListSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Time rendering product list pages with the stdlib JSON renderer, the orjson '
+        'renderer and the MessagePack renderer. Uses unsaved products; touches no data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[15, 100, 1000, 5000],
+            help='Products per page (default: 15 100 1000 5000)'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Timed renders per page and renderer (default: 20)'
+        )
+
+    def handle(self, *args, **options):
+        renderers = [
+            ('json', JSONRenderer()),
+            ('orjson', ORJSONRenderer()),
+            ('msgpack', MessagePackRenderer()),
+        ]
+        self.stdout.write(
+            f"{'products':>9}{'serialize ms':>14}"
+            + ''.join(f'{name + " ms":>12}' for name, _ in renderers)
+            + f"{'speedup':>9}{'json KB':>9}{'msgpack KB':>12}"
+        )
+        for size in options['sizes']:
+            data, serialize_ms = self.page(size)
+            timings = {}
+            sizes = {}
+            for name, renderer in renderers:
+                timings[name], sizes[name] = self.time_render(renderer, data, options['repeat'])
+            self.stdout.write(
+                f'{size:>9}{serialize_ms:>14.2f}'
+                + ''.join(f'{timings[name]:>12.2f}' for name, _ in renderers)
+                + f"{timings['json'] / timings['orjson']:>8.1f}x"
+                + f"{sizes['json'] / 1024:>9.1f}{sizes['msgpack'] / 1024:>12.1f}"
+            )
+        self.stdout.write(self.style.SUCCESS('Benchmark completed'))
+
+    def page(self, size):
+        """
+        A list page of ``size`` products as ProductListView returns it, and
+        the milliseconds its serialization took
+        """
+        rng = random.Random(size)
+        category = Category(id=1, name='Centrifugal Pumps', description='Pumps for process industries')
+        products = []
+        for i in range(size):
+            product = Product(
+                id=uuid.UUID(int=rng.getrandbits(128)),
+                name=f'Industrial Centrifugal Pump {i}',
+                description='High-efficiency pump for industrial applications. ' * 4,
+                price=Decimal(rng.randint(100, 1000000)) / 100,
+                category=category,
+                quantity=rng.randint(0, 50),
+                order=i if i < 10 else None,
+                tags='centrifugal, stainless steel, process',
+            )
+            # What Product.objects.with_primary_image() would have prefetched
+            product.primary_images = []
+            products.append(product)
+
+        start = time.perf_counter()
+        data = {
+            'count': size,
+            'next': None,
+            'previous': None,
+            'results': ProductListSerializer(products, many=True).data,
+        }
+        return data, (time.perf_counter() - start) * 1000
+
+    def time_render(self, renderer, data, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rendered = renderer.render(data)
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings), len(rendered)
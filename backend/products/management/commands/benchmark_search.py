@@ -0,0 +1,176 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from products.models import Category, Product, ProductSpecification
+from products.fuzzy import FuzzySearch, TrigramIndex, get_threshold
+from products.search import ProductSearchIndex
+from products.suggest import SuggestIndex
+
+
+WORDS = [
+    'centrifugal', 'diaphragm', 'positive', 'displacement', 'mechanical', 'seal',
+    'packing', 'bearing', 'impeller', 'stainless', 'cast', 'iron', 'bronze',
+    'industrial', 'chemical', 'slurry', 'vertical', 'horizontal', 'submersible',
+    'booster', 'gear', 'screw', 'valve', 'coupling', 'gasket', 'motor', 'drive',
+]
+QUERIES = ['centrifugal', 'stainless pump', 'seal kit', 'gear', 'submersible slurry', 'model 6020']
+# Mistyped words and model codes, found only by the fuzzy fallback
+FUZZY_QUERIES = ['centrifgual', 'stainles steal', 'submersable slury', 'diafragm seal', 'model 60201']
+PREFIXES = ['c', 'ce', 'cen', 'centri', 'pump', 'stainless p', 'gear pump 4', 'zz']
+
+# Descriptions draw from a larger Zipf-distributed vocabulary so term
+# selectivity resembles real catalog text rather than every word matching
+# most rows.
+FILLER_VOCABULARY = [
+    a + b + c
+    for a in ('ba', 'co', 'de', 'fi', 'ga', 'ho', 'ki', 'lu', 'mo', 'ne', 'pa', 'ro', 'sa', 'tu', 'vi')
+    for b in ('r', 'l', 'n', 's', 't', 'x', 'm')
+    for c in ('al', 'en', 'ic', 'on', 'ar', 'um', 'ix', 'or', 'us', 'et')
+]
+FILLER_WEIGHTS = [1 / rank for rank in range(1, len(FILLER_VOCABULARY) + 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare FTS5 product search against the icontains scan, and time fuzzy search and suggest lookups, '
+        'on a synthetic catalog. '
+        'All generated data is rolled back when the benchmark finishes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[10000, 100000],
+            help='Catalog sizes to benchmark (default: 10000 100000)'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Timed runs per query (default: 5)'
+        )
+
+    def handle(self, *args, **options):
+        if not ProductSearchIndex.is_available():
+            raise CommandError('The FTS5 product search index is not available on this database.')
+
+        for size in options['sizes']:
+            with transaction.atomic():
+                self.seed_catalog(size)
+                ProductSearchIndex.rebuild()
+                self.run_benchmark(size, options['repeat'])
+                self.run_fuzzy_benchmark(options['repeat'])
+                self.run_suggest_benchmark(options['repeat'])
+                transaction.set_rollback(True)
+
+    def seed_catalog(self, size):
+        self.stdout.write(f'Seeding {size} products...')
+        rng = random.Random(size)
+        categories = [
+            Category.objects.create(name=f'Benchmark Category {i}') for i in range(20)
+        ]
+
+        products = []
+        for i in range(size):
+            name_words = rng.sample(WORDS, 3)
+            products.append(Product(
+                name=f"{' '.join(name_words).title()} {rng.choice(['Pump', 'Seal', 'Kit'])} {rng.randint(1000, 9999)}",
+                description=' '.join(
+                    rng.choices(WORDS, k=4) + rng.choices(FILLER_VOCABULARY, FILLER_WEIGHTS, k=36)
+                ),
+                price=Decimal(rng.randint(100, 100000)) / 100,
+                category=rng.choice(categories),
+                quantity=rng.randint(0, 50),
+                tags=', '.join(rng.sample(WORDS, 4)),
+            ))
+        Product.objects.bulk_create(products, batch_size=2000)
+
+        specs = [
+            ProductSpecification(product=product, key='Model', value=str(rng.randint(1000, 9999)))
+            for product in products
+        ]
+        ProductSpecification.objects.bulk_create(specs, batch_size=2000)
+
+    def time_query(self, queryset, repeat):
+        timings = []
+        count = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            # Evaluate one page the way the list endpoint does
+            count = queryset.count()
+            list(queryset[:15])
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings), count
+
+    def run_benchmark(self, size, repeat):
+        base = Product.objects.filter(active=True).select_related('category')
+        self.stdout.write(self.style.SUCCESS(f'\n{size} products'))
+        self.stdout.write(f"{'query':<22}{'icontains ms':>14}{'fts5 ms':>10}{'speedup':>9}{'hits':>8}")
+
+        for query in QUERIES:
+            scan_ms, scan_hits = self.time_query(
+                ProductSearchIndex.fallback_search(base, query).order_by('name'), repeat
+            )
+            fts_ms, fts_hits = self.time_query(ProductSearchIndex.search(base, query), repeat)
+            self.stdout.write(
+                f'{query:<22}{scan_ms:>14.2f}{fts_ms:>10.2f}{scan_ms / fts_ms:>8.1f}x{fts_hits:>8}'
+            )
+
+    def run_fuzzy_benchmark(self, repeat):
+        index = TrigramIndex()
+        start = time.perf_counter()
+        index.build(TrigramIndex.collect(), stamp=None)
+        build_ms = (time.perf_counter() - start) * 1000
+        stats = index.stats()
+        self.stdout.write(
+            f"\ntrigram index: {stats['terms']} terms, {stats['trigrams']} trigrams, built in {build_ms:.0f} ms "
+            f"(threshold {get_threshold()})"
+        )
+        self.stdout.write(f"{'query':<22}{'exact hits':>11}{'fuzzy ms':>10}{'hits':>8}  best match")
+
+        base = Product.objects.filter(active=True).select_related('category')
+        TrigramIndex._instance = index
+        try:
+            for query in FUZZY_QUERIES:
+                exact_hits = ProductSearchIndex.search(base, query).count()
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    results = list(FuzzySearch.search(base, query)[:15])
+                    timings.append((time.perf_counter() - start) * 1000)
+                best = results[0].name if results else '-'
+                self.stdout.write(
+                    f'{query:<22}{exact_hits:>11}{statistics.median(timings):>10.2f}{len(results):>8}  {best}'
+                )
+        finally:
+            TrigramIndex.clear()
+
+    def run_suggest_benchmark(self, repeat):
+        index = SuggestIndex()
+        start = time.perf_counter()
+        index.build(SuggestIndex.collect(), stamp=None)
+        build_ms = (time.perf_counter() - start) * 1000
+        stats = index.stats()
+        self.stdout.write(
+            f"\nsuggest index: {stats['entries']} entries, {stats['keys']} keys, "
+            f"{stats['hot_prefixes']} ranked prefixes, built in {build_ms:.0f} ms"
+        )
+        self.stdout.write(f"{'prefix':<22}{'lookup us':>14}{'results':>9}")
+
+        lookups = 200 * repeat
+        for prefix in PREFIXES:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for _ in range(lookups // repeat):
+                    results = index.suggest(prefix)
+                timings.append((time.perf_counter() - start) * 1e6 / (lookups // repeat))
+            self.stdout.write(f'{prefix:<22}{statistics.median(timings):>14.1f}{len(results):>9}')
+
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from products.related import RelatedProductsBuilder, DEFAULT_LIMIT
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the precomputed related-products table from categories, tags, co-views and co-purchases'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=DEFAULT_LIMIT,
+            help=f'Number of related products stored per product (default: {DEFAULT_LIMIT})'
+        )
+
+    def handle(self, *args, **options):
+        start_time = timezone.now()
+        self.stdout.write('Building related products...')
+        written = RelatedProductsBuilder(limit=options['limit']).rebuild()
+
+        duration = timezone.now() - start_time
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Stored {written} related products in {duration.total_seconds():.2f} seconds'
+            )
+        )
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from products.search import ProductSearchIndex
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the FTS5 product search index from the product table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of products indexed per batch (default: 1000)'
+        )
+
+    def handle(self, *args, **options):
+        if not ProductSearchIndex.is_available():
+            raise CommandError(
+                'The product search index is not available. It requires SQLite with FTS5; '
+                'run "python manage.py migrate" first.'
+            )
+
+        start_time = timezone.now()
+        self.stdout.write('Rebuilding product search index...')
+        indexed = ProductSearchIndex.rebuild(batch_size=options['batch_size'])
+
+        duration = timezone.now() - start_time
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Indexed {indexed} products in {duration.total_seconds():.2f} seconds'
+            )
+        )
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from products.specs import SpecIndex
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the numeric specification index used by range filters and facets'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of index rows written per batch (default: 1000)'
+        )
+
+    def handle(self, *args, **options):
+        start_time = timezone.now()
+        self.stdout.write('Rebuilding specification index...')
+        written = SpecIndex.rebuild(batch_size=options['batch_size'])
+
+        duration = timezone.now() - start_time
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Indexed {written} numeric specification values in {duration.total_seconds():.2f} seconds'
+            )
+        )
@@ -0,0 +1,71 @@
+from django.db import migrations, models
+import django.db.models.deletion
+import products.models
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from products.search import FTS_TABLE, BM25_WEIGHTS
+
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        "product_id UNINDEXED, name, description, tags, category, specifications, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    weights = ', '.join(str(weight) for weight in BM25_WEIGHTS)
+    schema_editor.execute(
+        f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rank) VALUES ('rank', 'bm25({weights})')"
+    )
+
+    # Index whatever is already in the catalog
+    Product = apps.get_model('products', 'Product')
+    ProductSpecification = apps.get_model('products', 'ProductSpecification')
+    specs = {}
+    for product_id, key, value in ProductSpecification.objects.values_list('product_id', 'key', 'value'):
+        specs.setdefault(product_id, []).append(f'{key} {value}')
+
+    with schema_editor.connection.cursor() as cursor:
+        for product in Product.objects.select_related('category').iterator():
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (product_id, name, description, tags, category, specifications) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                [
+                    product.id.hex,
+                    product.name,
+                    product.description or '',
+                    (product.tags or '').replace(',', ' '),
+                    product.category.name,
+                    ' '.join(specs.get(product.id, [])),
+                ]
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from products.search import FTS_TABLE
+    schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_remove_equipment_models'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(db_column='product_id', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_document', serialize=False, to='products.product')),
+                ('document', products.models.FullTextField(db_column='products_product_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'products_product_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
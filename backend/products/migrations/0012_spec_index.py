@@ -0,0 +1,48 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def index_specifications(apps, schema_editor):
+    from products.specs import parse_quantity, spec_key
+
+    ProductSpecification = apps.get_model('products', 'ProductSpecification')
+    ProductSpecValue = apps.get_model('products', 'ProductSpecValue')
+    rows = []
+    for spec_id, product_id, key, value in ProductSpecification.objects.values_list(
+        'id', 'product_id', 'key', 'value'
+    ).iterator():
+        parsed = parse_quantity(value)
+        if parsed is not None and spec_key(key):
+            low, high, unit = parsed
+            rows.append(ProductSpecValue(
+                specification_id=spec_id, product_id=product_id,
+                key=spec_key(key), min_value=low, max_value=high, unit=unit,
+            ))
+    ProductSpecValue.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_blob_store'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSpecValue',
+            fields=[
+                ('specification', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='numeric_value', serialize=False, to='products.productspecification')),
+                ('key', models.SlugField(help_text='Normalized specification name, e.g. flow_rate', max_length=100)),
+                ('min_value', models.FloatField()),
+                ('max_value', models.FloatField(help_text='Equal to min_value unless the specification is a range')),
+                ('unit', models.CharField(blank=True, help_text='Canonical unit, empty for plain numbers', max_length=10)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='spec_values', to='products.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['key', 'unit', 'max_value'], name='spec_value_range_idx'), models.Index(fields=['product', 'key'], name='spec_value_product_idx')],
+            },
+        ),
+        migrations.RunPython(index_specifications, migrations.RunPython.noop),
+    ]
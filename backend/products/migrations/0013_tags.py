@@ -0,0 +1,75 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def tags_from_strings(apps, schema_editor):
+    from products.tags import parse_tags
+
+    Product = apps.get_model('products', 'Product')
+    Tag = apps.get_model('products', 'Tag')
+    ProductTag = apps.get_model('products', 'ProductTag')
+
+    products = [
+        (product_id, parse_tags(tags))
+        for product_id, tags in Product.objects.exclude(tags__isnull=True).exclude(tags='').values_list('id', 'tags')
+    ]
+    names = {}
+    for _, parsed in products:
+        for slug, name in parsed:
+            names.setdefault(slug, name)
+    Tag.objects.bulk_create([Tag(slug=slug, name=name) for slug, name in names.items()], batch_size=1000)
+    tag_ids = dict(Tag.objects.values_list('slug', 'id'))
+    ProductTag.objects.bulk_create([
+        ProductTag(product_id=product_id, tag_id=tag_ids[slug], position=position)
+        for product_id, parsed in products
+        for position, (slug, _) in enumerate(parsed)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_spec_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(allow_unicode=True, max_length=100, unique=True)),
+                ('name', models.CharField(help_text='Spelling of the first product that used the tag', max_length=100)),
+            ],
+            options={
+                'ordering': ['slug'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField(default=0, help_text="Position in the product's tag list")),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_tags', to='products.product')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_tags', to='products.tag')),
+            ],
+            options={
+                'ordering': ['product', 'position'],
+            },
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='tag_set',
+            field=models.ManyToManyField(blank=True, related_name='products', through='products.ProductTag', to='products.tag'),
+        ),
+        migrations.AddIndex(
+            model_name='producttag',
+            index=models.Index(fields=['tag', 'product'], name='product_tag_tag_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='producttag',
+            constraint=models.UniqueConstraint(fields=('product', 'tag'), name='unique_product_tag'),
+        ),
+        migrations.RunPython(tags_from_strings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+def create_vocabulary(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from products.search import FTS_TABLE, VOCAB_TABLE
+
+    # A read-only view of the index's terms; it needs no maintenance
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {VOCAB_TABLE} USING fts5vocab({FTS_TABLE}, 'col')"
+    )
+
+
+def drop_vocabulary(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from products.search import VOCAB_TABLE
+    schema_editor.execute(f"DROP TABLE IF EXISTS {VOCAB_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0013_tags'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_vocabulary, drop_vocabulary),
+    ]
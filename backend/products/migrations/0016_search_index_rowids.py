@@ -0,0 +1,35 @@
+from django.db import migrations
+
+
+def create_rowid_map(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from products.search import FTS_TABLE, ROWID_TABLE
+
+    if FTS_TABLE not in schema_editor.connection.introspection.table_names():
+        return
+    schema_editor.execute(
+        f"CREATE TABLE IF NOT EXISTS {ROWID_TABLE} ("
+        "product_id TEXT PRIMARY KEY NOT NULL, fts_rowid INTEGER NOT NULL)"
+    )
+    schema_editor.execute(
+        f"INSERT OR REPLACE INTO {ROWID_TABLE} (product_id, fts_rowid) SELECT product_id, rowid FROM {FTS_TABLE}"
+    )
+
+
+def drop_rowid_map(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from products.search import ROWID_TABLE
+    schema_editor.execute(f"DROP TABLE IF EXISTS {ROWID_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0015_product_image_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_rowid_map, drop_rowid_map),
+    ]
@@ -1,9 +1,13 @@
 from django.db import models
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 import base64
 import uuid
 from PIL import Image
 import io
+from core.models import StoredBlobModel
+from core.versioning import bump_version, domains_for_model
+from .tags import parse_tags
 
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -17,6 +21,22 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+class ProductQuerySet(models.QuerySet):
+    def with_primary_image(self):
+        """
+        Prefetch the id and digest of each product's primary image (order=0)
+        into ``primary_images`` with one query for the whole page, without
+        loading any image data.
+        """
+        return self.prefetch_related(
+            models.Prefetch(
+                'images',
+                queryset=ProductImage.objects.filter(order=0).only('id', 'product_id', 'order', 'blob_sha256'),
+                to_attr='primary_images',
+            )
+        )
+
+
 class Product(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=200)
@@ -27,15 +47,29 @@ class Product(models.Model):
     quantity = models.PositiveIntegerField(default=0, help_text="Available quantity in stock")
     order = models.PositiveIntegerField(null=True, blank=True, unique=True, help_text="Display order for featured products (lower numbers first, null values last)")
     tags = models.CharField(max_length=500, blank=True, null=True, help_text="Comma-separated tags")
+    # Normalized copy of ``tags``, kept in sync on save (see products.tags)
+    tag_set = models.ManyToManyField('Tag', through='ProductTag', related_name='products', blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        # Partial (field, id) indexes over active products back the seek
+        # conditions used by keyset pagination (see products.pagination)
+        indexes = [
+            models.Index(fields=['name', 'id'], condition=models.Q(active=True), name='product_active_name_idx'),
+            models.Index(fields=['price', 'id'], condition=models.Q(active=True), name='product_active_price_idx'),
+            models.Index(fields=['created_at', 'id'], condition=models.Q(active=True), name='product_active_created_idx'),
+            models.Index(fields=['order', 'id'], condition=models.Q(active=True), name='product_active_order_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
     @property
     def tags_list(self):
-        return [tag.strip() for tag in self.tags.split(',')] if self.tags else []
+        return [name for _, name in parse_tags(self.tags)]
     
     @property
     def is_available(self):
@@ -48,21 +82,33 @@ class Product(models.Model):
         return self.quantity > 0
     
     def reduce_quantity(self, amount):
-        """Reduce product quantity by specified amount"""
-        if self.quantity >= amount:
-            self.quantity -= amount
-            self.save()
-            return True
-        return False
-
-class ProductImage(models.Model):
+        """
+        Reduce product quantity by specified amount, if that many are in stock.
+        A single conditional UPDATE, so concurrent calls cannot oversell.
+        Orders take stock through orders.reservations instead.
+        """
+        updated = Product.objects.filter(pk=self.pk, quantity__gte=amount).update(
+            quantity=models.F('quantity') - amount, updated_at=timezone.now()
+        )
+        self.refresh_from_db(fields=['quantity', 'updated_at'])
+        if updated:
+            # Queryset updates send no signals
+            for domain in domains_for_model(Product):
+                bump_version(domain)
+        return bool(updated)
+
+class ProductImage(StoredBlobModel):
+    blob_field = 'image_data'
+    image_derivatives = True
+
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
-    image_data = models.BinaryField()
+    image_data = models.BinaryField(blank=True, default=b'')
     filename = models.CharField(max_length=255, blank=True, null=True)
     content_type = models.CharField(max_length=100, default='image/jpeg')
     alt_text = models.CharField(max_length=200, blank=True)
     order = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['order', 'created_at']
@@ -120,21 +166,23 @@ class ProductImage(models.Model):
     @property
     def image_base64(self):
         """Return base64 encoded image data"""
-        if self.image_data:
-            return base64.b64encode(self.image_data).decode('utf-8')
+        if self.has_blob:
+            return base64.b64encode(self.read_blob()).decode('utf-8')
         return None
     
     @property
     def data_url(self):
         """Return data URL for the image"""
-        if self.image_data:
+        if self.has_blob:
             base64_data = self.image_base64
             return f"data:{self.content_type};base64,{base64_data}"
         return None
 
-class ProductAttachment(models.Model):
+class ProductAttachment(StoredBlobModel):
+    blob_field = 'file_data'
+
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='attachments')
-    file_data = models.BinaryField()
+    file_data = models.BinaryField(blank=True, default=b'')
     filename = models.CharField(max_length=255)
     content_type = models.CharField(max_length=100)
     file_size = models.PositiveIntegerField(help_text="File size in bytes")
@@ -159,14 +207,14 @@ class ProductAttachment(models.Model):
     @property
     def file_base64(self):
         """Return base64 encoded file data"""
-        if self.file_data:
-            return base64.b64encode(self.file_data).decode('utf-8')
+        if self.has_blob:
+            return base64.b64encode(self.read_blob()).decode('utf-8')
         return None
     
     @property
     def data_url(self):
         """Return data URL for the file"""
-        if self.file_data:
+        if self.has_blob:
             base64_data = self.file_base64
             return f"data:{self.content_type};base64,{base64_data}"
         return None
@@ -175,11 +223,12 @@ class ProductAttachment(models.Model):
     def file_size_human(self):
         """Return human-readable file size"""
         if self.file_size:
+            size = float(self.file_size)
             for unit in ['B', 'KB', 'MB', 'GB']:
-                if self.file_size < 1024.0:
-                    return f"{self.file_size:.1f} {unit}"
-                self.file_size /= 1024.0
-            return f"{self.file_size:.1f} TB"
+                if size < 1024.0:
+                    return f"{size:.1f} {unit}"
+                size /= 1024.0
+            return f"{size:.1f} TB"
         return "0 B"
     
     @property
@@ -221,4 +270,122 @@ class ProductSpecification(models.Model):
         return f"{self.product.name} - {self.key}: {self.value}"
 
 
+class ProductSpecValue(models.Model):
+    """
+    Numeric value of a ProductSpecification in a normalized unit, for range
+    filters and facets. Maintained from the specification (see products.specs).
+    """
+    specification = models.OneToOneField(
+        ProductSpecification, on_delete=models.CASCADE, primary_key=True, related_name='numeric_value'
+    )
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='spec_values')
+    key = models.SlugField(max_length=100, help_text="Normalized specification name, e.g. flow_rate")
+    min_value = models.FloatField()
+    max_value = models.FloatField(help_text="Equal to min_value unless the specification is a range")
+    unit = models.CharField(max_length=10, blank=True, help_text="Canonical unit, empty for plain numbers")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['key', 'unit', 'max_value'], name='spec_value_range_idx'),
+            models.Index(fields=['product', 'key'], name='spec_value_product_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} {self.key}: {self.min_value}-{self.max_value} {self.unit}"
+
+
+class FullTextField(models.TextField):
+    """
+    Maps to the hidden FTS5 column that shares its name with the table.
+    Only used as the left-hand side of a ``match`` lookup.
+    """
+
+
+@FullTextField.register_lookup
+class FullTextMatch(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+class ProductSearchDocument(models.Model):
+    """
+    Read-only view of the FTS5 search index (see products.search).
+
+    The table is created by a migration and maintained with raw SQL, so it
+    is unmanaged; this model exists so querysets can join to it and order
+    by the BM25 ``rank`` column.
+    """
+    product = models.OneToOneField(
+        Product,
+        primary_key=True,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_column='product_id',
+        related_name='search_document',
+    )
+    document = FullTextField(db_column='products_product_fts')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'products_product_fts'
+
 
+
+class RelatedProduct(models.Model):
+    """
+    Precomputed "related products" for a product, best match first.
+
+    Built by the ``build_related_products`` command and refreshed for a
+    single product when it is saved (see products.related).
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_entries')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommended_for')
+    rank = models.PositiveSmallIntegerField(help_text="Position in the product's related list (0 = best)")
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['product', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'related'], name='unique_related_product'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'rank'], name='related_product_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.related_id} ({self.score:.2f})"
+
+
+class Tag(models.Model):
+    slug = models.SlugField(max_length=100, unique=True, allow_unicode=True)
+    name = models.CharField(max_length=100, help_text="Spelling of the first product that used the tag")
+
+    class Meta:
+        ordering = ['slug']
+
+    def __str__(self):
+        return self.name
+
+
+class ProductTag(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='product_tags')
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='product_tags')
+    position = models.PositiveSmallIntegerField(default=0, help_text="Position in the product's tag list")
+
+    class Meta:
+        ordering = ['product', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'tag'], name='unique_product_tag'),
+        ]
+        indexes = [
+            # Tag filters and facets go from tag to products
+            models.Index(fields=['tag', 'product'], name='product_tag_tag_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} #{self.tag_id}"
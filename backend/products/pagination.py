@@ -0,0 +1,192 @@
+"""
+Keyset (cursor) pagination for the product list.
+
+Page-number pagination runs a COUNT(*) and an OFFSET scan for every page,
+so deep pages get slower the further in they are. In keyset mode the
+cursor carries the sort value and primary key of the last row served and
+the next page is fetched with a seek condition on an indexed
+``(active, <field>, id)`` tuple instead.
+
+Keyset mode is opt-in (``?pagination=cursor`` or a ``cursor`` parameter
+taken from a previous response); page-number mode stays the default.
+"""
+import base64
+import binascii
+import json
+import uuid
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class ProductCursorPagination(BasePagination):
+    """
+    Seek-based pagination over name, price, created_at or order.
+
+    Ties are broken on the UUID primary key, sorted in the same direction as
+    the ordering field. ``order`` is nullable and always sorts nulls last,
+    matching the page-number mode of ProductListView.
+    """
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    mode_query_value = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    invalid_cursor_message = 'Invalid cursor'
+
+    # Orderings that have a (active, field, id) index behind them
+    orderable_fields = ('name', 'price', 'created_at', 'order')
+    nullable_fields = ('order',)
+    default_ordering = 'name'
+
+    @classmethod
+    def is_requested(cls, request):
+        return (
+            request.query_params.get(cls.mode_query_param) == cls.mode_query_value
+            or cls.cursor_query_param in request.query_params
+        )
+
+    @classmethod
+    def supports(cls, request):
+        """
+        Keyset mode needs a plain column ordering. Search results ranked by
+        relevance have no stable seek key and stay in page-number mode.
+        """
+        ordering = request.query_params.get(api_settings.ORDERING_PARAM)
+        if ordering:
+            return ordering.lstrip('-') in cls.orderable_fields
+        return not request.query_params.get(api_settings.SEARCH_PARAM)
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(api_settings.ORDERING_PARAM) or self.default_ordering
+        return ordering.lstrip('-'), ordering.startswith('-')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.field, self.descending = self.get_ordering(request)
+        self.model_field = queryset.model._meta.get_field(self.field)
+
+        cursor = self.decode_cursor(request)
+        forward = cursor is None or cursor['forward']
+
+        queryset = queryset.order_by(*self.order_by(forward))
+        if cursor is not None:
+            queryset = queryset.filter(self.seek_filter(cursor['value'], cursor['pk'], forward))
+
+        # One extra row tells us whether there is another page
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if not forward:
+            rows.reverse()
+
+        if forward:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+        else:
+            self.has_next = True
+            self.has_previous = has_more
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], forward=True)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], forward=False)
+
+    def order_by(self, forward):
+        """
+        Ordering for a forward scan, or the exact inverse for a backward one
+        """
+        descending = self.descending != (not forward)
+        nulls_last = forward
+        expression = F(self.field)
+        pk = F('pk')
+        if self.field in self.nullable_fields:
+            nulls = {'nulls_last': True} if nulls_last else {'nulls_first': True}
+        else:
+            nulls = {}
+        expression = expression.desc(**nulls) if descending else expression.asc(**nulls)
+        return [expression, pk.desc() if descending else pk.asc()]
+
+    def seek_filter(self, value, pk, forward):
+        """
+        Rows strictly after (value, pk) in the scan order.
+
+        The redundant ``field >= value`` term gives the database a range to
+        seek on the composite index before the OR is evaluated.
+        """
+        field = self.field
+        descending = self.descending != (not forward)
+        nulls_last = forward
+        after = 'lt' if descending else 'gt'
+        after_or_equal = 'lte' if descending else 'gte'
+
+        if value is None:
+            if nulls_last:
+                return Q(**{f'{field}__isnull': True, f'pk__{after}': pk})
+            return Q(**{f'{field}__isnull': False}) | Q(**{f'{field}__isnull': True, f'pk__{after}': pk})
+
+        condition = Q(**{f'{field}__{after_or_equal}': value}) & (
+            Q(**{f'{field}__{after}': value}) | Q(**{field: value, f'pk__{after}': pk})
+        )
+        if field in self.nullable_fields and nulls_last:
+            condition |= Q(**{f'{field}__isnull': True})
+        return condition
+
+    def encode_cursor(self, product, forward):
+        value = getattr(product, self.field)
+        payload = {
+            'v': None if value is None else self.model_field.value_to_string(product),
+            'pk': product.pk.hex,
+            'f': 1 if forward else 0,
+        }
+        token = base64.urlsafe_b64encode(
+            json.dumps(payload, separators=(',', ':')).encode()
+        ).decode().rstrip('=')
+        url = replace_query_param(self.base_url, self.cursor_query_param, token)
+        return remove_query_param(url, self.mode_query_param)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            value = payload['v']
+            if value is not None:
+                value = self.model_field.to_python(value)
+            pk = uuid.UUID(hex=payload['pk'])
+            forward = bool(payload['f'])
+        except (TypeError, ValueError, KeyError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return {'value': value, 'pk': pk, 'forward': forward}
@@ -0,0 +1,253 @@
+"""
+Precomputed related products.
+
+Candidates for a product are scored on four signals:
+
+* same category
+* shared tags, from the normalized tag table (tags carried by more than
+  ``MAX_TAG_FANOUT`` products are ignored, they say nothing about
+  similarity)
+* co-views: sessions in ``analytics.ProductView`` that viewed both products
+* co-purchases: non-cancelled orders that contain both products
+
+The best ``DEFAULT_LIMIT`` candidates are written to ``RelatedProduct``.
+When fewer candidates score, the list is topped up with the products that
+follow this one (by name) in its category, so every product gets a stable
+list instead of a random one.
+
+``RelatedProductsBuilder.rebuild()`` recomputes everything in memory and
+is meant for the ``build_related_products`` command; ``refresh()`` updates
+a single product with a handful of indexed queries and runs when a product
+is saved.
+"""
+import logging
+import math
+from collections import Counter, defaultdict
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Count
+
+from core.versioning import bump_version
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 12
+
+CATEGORY_WEIGHT = 1.0
+TAG_WEIGHT = 1.5
+CO_VIEW_WEIGHT = 2.0
+CO_PURCHASE_WEIGHT = 4.0
+
+MAX_TAG_FANOUT = 1000
+
+# Sessions or orders touching more products than this are crawlers or
+# bulk orders and would add a quadratic number of weak pairs
+MAX_BASKET_SIZE = 50
+
+
+class RelatedProductsBuilder:
+    """Builds RelatedProduct rows"""
+
+    def __init__(self, limit=DEFAULT_LIMIT):
+        self.limit = limit
+        self.Product = apps.get_model('products', 'Product')
+        self.RelatedProduct = apps.get_model('products', 'RelatedProduct')
+        self.ProductView = apps.get_model('analytics', 'ProductView')
+        self.OrderItem = apps.get_model('orders', 'OrderItem')
+        self.ProductTag = apps.get_model('products', 'ProductTag')
+
+    # Scoring
+
+    @staticmethod
+    def score(same_category, shared_tags, co_views, co_purchases):
+        """Counts are damped so one busy session cannot dominate the list"""
+        return (
+            CATEGORY_WEIGHT * same_category
+            + TAG_WEIGHT * shared_tags
+            + CO_VIEW_WEIGHT * math.log1p(co_views)
+            + CO_PURCHASE_WEIGHT * math.log1p(co_purchases)
+        )
+
+    def rank(self, product_id, category_id, tags, candidates, co_views, co_purchases, fill):
+        """
+        Return RelatedProduct rows for one product.
+
+        ``candidates`` maps product id to (category_id, tag ids) for every
+        product sharing a tag, a session or an order with this one.
+        ``fill`` lists same-category products in top-up order.
+        """
+        scored = []
+        for candidate_id, (candidate_category, candidate_tags) in candidates.items():
+            if candidate_id == product_id:
+                continue
+            score = self.score(
+                candidate_category == category_id,
+                len(tags & candidate_tags),
+                co_views.get(candidate_id, 0),
+                co_purchases.get(candidate_id, 0),
+            )
+            if score > 0:
+                scored.append((-score, candidate_id.hex, candidate_id, score))
+        scored.sort()
+
+        chosen = [(candidate_id, score) for _, _, candidate_id, score in scored[:self.limit]]
+        seen = {candidate_id for candidate_id, _ in chosen}
+        for candidate_id in fill:
+            if len(chosen) >= self.limit:
+                break
+            if candidate_id != product_id and candidate_id not in seen:
+                chosen.append((candidate_id, CATEGORY_WEIGHT))
+                seen.add(candidate_id)
+
+        return [
+            self.RelatedProduct(product_id=product_id, related_id=candidate_id, rank=position, score=score)
+            for position, (candidate_id, score) in enumerate(chosen)
+        ]
+
+    @staticmethod
+    def following(ordered_ids, product_id, limit):
+        """The ``limit`` ids after ``product_id`` in ``ordered_ids``, wrapping around"""
+        try:
+            start = ordered_ids.index(product_id) + 1
+        except ValueError:
+            start = 0
+        rotated = ordered_ids[start:] + ordered_ids[:start]
+        return rotated[:limit + 1]
+
+    @staticmethod
+    def pair_counts(baskets):
+        """{product: Counter(other product: baskets containing both)}"""
+        pairs = defaultdict(Counter)
+        for products in baskets.values():
+            if len(products) < 2 or len(products) > MAX_BASKET_SIZE:
+                continue
+            for product_id in products:
+                counts = pairs[product_id]
+                for other_id in products:
+                    if other_id != product_id:
+                        counts[other_id] += 1
+        return pairs
+
+    # Signal sources
+
+    def view_baskets(self, **filters):
+        baskets = defaultdict(set)
+        rows = self.ProductView.objects.exclude(session_id='').filter(**filters).values_list(
+            'session_id', 'product_id'
+        )
+        for session_id, product_id in rows.iterator(chunk_size=5000):
+            baskets[session_id].add(product_id)
+        return baskets
+
+    def order_baskets(self, **filters):
+        baskets = defaultdict(set)
+        rows = self.OrderItem.objects.exclude(order__status='cancelled').filter(**filters).values_list(
+            'order_id', 'product_id'
+        )
+        for order_id, product_id in rows.iterator(chunk_size=5000):
+            baskets[order_id].add(product_id)
+        return baskets
+
+    # Builders
+
+    def rebuild(self):
+        """Recompute the related list of every active product. Returns rows written."""
+        products = {}
+        by_category = defaultdict(list)
+        tag_index = defaultdict(list)
+        rows = self.Product.objects.filter(active=True).order_by('name', 'pk').values_list('id', 'category_id')
+        for product_id, category_id in rows.iterator(chunk_size=5000):
+            products[product_id] = (category_id, set())
+            by_category[category_id].append(product_id)
+        tag_rows = self.ProductTag.objects.filter(product__active=True).values_list('product_id', 'tag_id')
+        for product_id, tag_id in tag_rows.iterator(chunk_size=5000):
+            products[product_id][1].add(tag_id)
+            tag_index[tag_id].append(product_id)
+
+        common = {tag for tag, ids in tag_index.items() if len(ids) > MAX_TAG_FANOUT}
+        tag_index = {tag: ids for tag, ids in tag_index.items() if tag not in common}
+        co_views = self.pair_counts(self.view_baskets())
+        co_purchases = self.pair_counts(self.order_baskets())
+
+        related_rows = []
+        for product_id, (category_id, tags) in products.items():
+            tags = tags - common
+            candidate_ids = set(co_views.get(product_id, ())) | set(co_purchases.get(product_id, ()))
+            for tag in tags:
+                candidate_ids.update(tag_index.get(tag, ()))
+            candidates = {
+                candidate_id: products[candidate_id]
+                for candidate_id in candidate_ids if candidate_id in products
+            }
+            fill = self.following(by_category[category_id], product_id, self.limit)
+            related_rows.extend(self.rank(
+                product_id, category_id, tags, candidates,
+                co_views.get(product_id, {}), co_purchases.get(product_id, {}), fill,
+            ))
+
+        with transaction.atomic():
+            self.RelatedProduct.objects.all().delete()
+            self.RelatedProduct.objects.bulk_create(related_rows, batch_size=1000)
+            # bulk_create sends no signals; related lists are part of the catalog
+            bump_version('products')
+
+        logger.info(f"Built {len(related_rows)} related products for {len(products)} products")
+        return len(related_rows)
+
+    def refresh(self, product):
+        """Recompute the related list of a single product"""
+        with transaction.atomic():
+            self.RelatedProduct.objects.filter(product_id=product.pk).delete()
+            if not product.active:
+                return []
+
+            tags = set(self.ProductTag.objects.filter(product_id=product.pk).values_list('tag_id', flat=True))
+            co_views = Counter()
+            for products in self.view_baskets(
+                session_id__in=self.ProductView.objects.filter(product_id=product.pk)
+                .exclude(session_id='').values('session_id')
+            ).values():
+                if len(products) <= MAX_BASKET_SIZE:
+                    co_views.update(products)
+            co_purchases = Counter()
+            for products in self.order_baskets(
+                order_id__in=self.OrderItem.objects.filter(product_id=product.pk).values('order_id')
+            ).values():
+                if len(products) <= MAX_BASKET_SIZE:
+                    co_purchases.update(products)
+
+            # Only tags shared with this product matter for scoring
+            tagged = defaultdict(set)
+            if tags:
+                active_tags = self.ProductTag.objects.filter(tag_id__in=tags, product__active=True)
+                common = {
+                    tag_id for tag_id, count in active_tags.values('tag_id').annotate(
+                        count=Count('product_id')
+                    ).values_list('tag_id', 'count')
+                    if count > MAX_TAG_FANOUT
+                }
+                tags = tags - common
+                for candidate_id, tag_id in active_tags.filter(tag_id__in=tags).values_list('product_id', 'tag_id'):
+                    tagged[candidate_id].add(tag_id)
+
+            candidates = {}
+            candidate_ids = set(tagged) | set(co_views) | set(co_purchases)
+            if candidate_ids:
+                for candidate_id, category_id in self.Product.objects.filter(
+                    active=True, pk__in=candidate_ids
+                ).values_list('id', 'category_id'):
+                    candidates[candidate_id] = (category_id, tagged.get(candidate_id, set()))
+
+            same_category = self.Product.objects.filter(active=True, category_id=product.category_id)
+            fill = list(same_category.filter(name__gt=product.name).order_by('name', 'pk').values_list(
+                'id', flat=True
+            )[:self.limit])
+            if len(fill) < self.limit:
+                fill += list(same_category.order_by('name', 'pk').values_list('id', flat=True)[:self.limit + 1])
+
+            related_rows = self.rank(
+                product.pk, product.category_id, tags, candidates, co_views, co_purchases, fill
+            )
+            self.RelatedProduct.objects.bulk_create(related_rows)
+        return related_rows
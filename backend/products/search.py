@@ -0,0 +1,201 @@
+"""
+Full-text search over the product catalog backed by an SQLite FTS5 index.
+
+The index lives in the ``products_product_fts`` virtual table (one row per
+product) and is kept in sync by the signal handlers in ``products.signals``.
+``product_id`` is an UNINDEXED column, so finding a product's row by it
+scans the whole index; ``products_product_fts_rowid`` maps each product to
+its row's rowid instead, and rows are updated and deleted by rowid.
+When the database is not SQLite, or FTS5 is unavailable, searches fall back
+to the original ``icontains`` scan so the endpoints keep working.
+"""
+import re
+import logging
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'products_product_fts'
+# fts5vocab view listing the index's words per column (see products.fuzzy)
+VOCAB_TABLE = 'products_product_fts_vocab'
+# product_id (hex) -> rowid of the product's row in FTS_TABLE
+ROWID_TABLE = 'products_product_fts_rowid'
+
+# bm25() weights, in column order: product_id, name, description, tags,
+# category, specifications. A hit in the name counts ten times as much as
+# a hit in the description.
+BM25_WEIGHTS = (0.0, 10.0, 1.0, 5.0, 3.0, 2.0)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def build_match_expression(query):
+    """
+    Turn free text typed by a user into an FTS5 MATCH expression.
+
+    Every word becomes a quoted prefix term and all terms must match, so
+    "centri pump" finds "Industrial Centrifugal Pump". Returns None when the
+    query contains no searchable words.
+    """
+    tokens = TOKEN_RE.findall(query or '')
+    if not tokens:
+        return None
+    return ' AND '.join(f'"{token}"*' for token in tokens)
+
+
+class ProductSearchIndex:
+    """Maintains and queries the FTS5 product index"""
+
+    _available = None
+
+    @classmethod
+    def is_available(cls):
+        """Return True if the FTS5 table exists on the current database"""
+        if connection.vendor != 'sqlite':
+            return False
+        if cls._available is None:
+            cls._available = FTS_TABLE in connection.introspection.table_names()
+        return cls._available
+
+    @staticmethod
+    def document_for(product, specifications):
+        """Build the indexed column values for a product"""
+        return (
+            product.id.hex,
+            product.name,
+            product.description or '',
+            (product.tags or '').replace(',', ' '),
+            product.category.name if product.category_id else '',
+            ' '.join(f'{key} {value}' for key, value in specifications),
+        )
+
+    @classmethod
+    def index_product(cls, product):
+        """Insert or replace the index row for a single product"""
+        if not cls.is_available():
+            return
+        document = cls.document_for(
+            product, product.specifications.values_list('key', 'value')
+        )
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'SELECT fts_rowid FROM {ROWID_TABLE} WHERE product_id = %s', [document[0]])
+            row = cursor.fetchone()
+            if row is not None:
+                cursor.execute(
+                    f'UPDATE {FTS_TABLE} SET name = %s, description = %s, tags = %s, category = %s, '
+                    f'specifications = %s WHERE rowid = %s',
+                    list(document[1:]) + [row[0]]
+                )
+                if cursor.rowcount:
+                    return
+                # The row went missing (the table was emptied by hand)
+                cursor.execute(f'DELETE FROM {ROWID_TABLE} WHERE product_id = %s', [document[0]])
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (product_id, name, description, tags, category, specifications) '
+                f'VALUES (%s, %s, %s, %s, %s, %s)',
+                list(document)
+            )
+            cursor.execute(
+                f'INSERT INTO {ROWID_TABLE} (product_id, fts_rowid) VALUES (%s, %s)',
+                [document[0], cursor.lastrowid]
+            )
+
+    @classmethod
+    def remove_product(cls, product_id):
+        """Drop a product from the index"""
+        if not cls.is_available():
+            return
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'SELECT fts_rowid FROM {ROWID_TABLE} WHERE product_id = %s', [product_id.hex])
+            row = cursor.fetchone()
+            if row is None:
+                return
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [row[0]])
+            cursor.execute(f'DELETE FROM {ROWID_TABLE} WHERE product_id = %s', [product_id.hex])
+
+    @classmethod
+    def rebuild(cls, batch_size=1000):
+        """
+        Rebuild the whole index from the Product table.
+
+        Returns the number of products indexed.
+        """
+        from .models import Product, ProductSpecification
+
+        if not cls.is_available():
+            return 0
+
+        indexed = 0
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {FTS_TABLE}')
+                cursor.execute(f'DELETE FROM {ROWID_TABLE}')
+
+                products = Product.objects.select_related('category').only(
+                    'id', 'name', 'description', 'tags', 'category__name'
+                ).order_by('pk')
+
+                batch = []
+                for product in products.iterator(chunk_size=batch_size):
+                    batch.append(product)
+                    if len(batch) >= batch_size:
+                        indexed += cls._insert_batch(cursor, batch, ProductSpecification)
+                        batch = []
+                if batch:
+                    indexed += cls._insert_batch(cursor, batch, ProductSpecification)
+
+                cursor.execute(
+                    f'INSERT INTO {ROWID_TABLE} (product_id, fts_rowid) SELECT product_id, rowid FROM {FTS_TABLE}'
+                )
+                cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+
+        logger.info(f"Rebuilt product search index with {indexed} products")
+        return indexed
+
+    @staticmethod
+    def _insert_batch(cursor, products, spec_model):
+        specs = {}
+        for product_id, key, value in spec_model.objects.filter(
+            product__in=products
+        ).values_list('product_id', 'key', 'value'):
+            specs.setdefault(product_id, []).append((key, value))
+
+        rows = [
+            ProductSearchIndex.document_for(product, specs.get(product.id, []))
+            for product in products
+        ]
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (product_id, name, description, tags, category, specifications) '
+            f'VALUES (%s, %s, %s, %s, %s, %s)',
+            rows
+        )
+        return len(rows)
+
+    @classmethod
+    def search(cls, queryset, query, rank=True):
+        """
+        Restrict a Product queryset to rows matching ``query``.
+
+        When ``rank`` is True the result is ordered by BM25 relevance (best
+        match first). Falls back to an ``icontains`` scan when the index is
+        unavailable or the query has no searchable words.
+        """
+        expression = build_match_expression(query)
+        if expression is None or not cls.is_available():
+            return cls.fallback_search(queryset, query)
+
+        queryset = queryset.filter(search_document__document__match=expression)
+        if rank:
+            queryset = queryset.order_by('search_document__rank', 'name')
+        return queryset
+
+    @staticmethod
+    def fallback_search(queryset, query):
+        """Original substring search, used when FTS5 is not available"""
+        return queryset.filter(
+            Q(name__icontains=query) |
+            Q(description__icontains=query) |
+            Q(tags__icontains=query)
+        )
@@ -1,7 +1,93 @@
+from django.db.models import Prefetch
 from rest_framework import serializers
+from core.images import sized_url, srcset
+from core.storage import versioned_url
 from .models import Category, Product, ProductImage, ProductSpecification, ProductAttachment
 import base64
 
+# Query parameter that asks for images and attachments inlined as base64
+# data: URLs instead of links to the binary endpoints
+INLINE_MEDIA_PARAM = 'inline_media'
+
+
+def wants_inline_media(request):
+    return bool(request) and request.query_params.get(INLINE_MEDIA_PARAM, '').lower() in ('1', 'true', 'yes')
+
+
+# Sparse fieldsets: ?fields=id,name,price keeps only those fields and
+# ?expand=category,images picks the relations rendered as nested objects
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+
+
+def parse_field_names(value):
+    """Field names from ``"a,b"``, ``["a", "b"]`` or ``["a,b"]``; None when nothing was asked for"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = [value]
+    names = [name.strip() for item in value for name in str(item).split(',') if name.strip()]
+    return names or None
+
+
+def requested_fields(params):
+    """
+    ``(fields, expand)`` asked for in a QueryDict or a parsed JSON body.
+    ``fields`` is None when missing or empty; ``expand`` is None when
+    missing, so an empty ``?expand=`` expands nothing.
+    """
+    def names(key):
+        value = params.getlist(key) if hasattr(params, 'getlist') else params.get(key)
+        return parse_field_names(value)
+
+    expand = None
+    if EXPAND_PARAM in params:
+        expand = names(EXPAND_PARAM) or []
+    return names(FIELDS_PARAM), expand
+
+
+class SelectableFieldsMixin:
+    """
+    Serializer taking ``fields`` and ``expand`` arguments.
+
+    ``fields`` names the fields to keep; None keeps them all. The relations
+    in ``Meta.expandable_fields`` are nested only when named in ``expand``
+    (``expand=None`` nests them all). A foreign key that is not expanded
+    is given as its primary key; other relations are left out. Unknown
+    names are ignored.
+
+    ``optimize_queryset`` makes the matching choice for the queryset, so
+    relations that are not rendered are never queried.
+    """
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        expanded = self.expanded_fields(fields, expand)
+        for name in getattr(self.Meta, 'expandable_fields', ()):
+            if name in expanded or name not in self.fields:
+                continue
+            if isinstance(self.fields[name], serializers.ListSerializer):
+                self.fields.pop(name)
+            else:
+                # Read from the ``<name>_id`` attribute, without a query
+                self.fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def expanded_fields(cls, fields=None, expand=None):
+        """Names of the relations rendered nested for these arguments"""
+        return {
+            name for name in getattr(cls.Meta, 'expandable_fields', ())
+            if (expand is None or name in expand) and (fields is None or name in fields)
+        }
+
+    @classmethod
+    def optimize_queryset(cls, queryset, fields=None, expand=None):
+        return queryset
+
+
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
@@ -9,17 +95,26 @@ class CategorySerializer(serializers.ModelSerializer):
 
 class ProductImageSerializer(serializers.ModelSerializer):
     image_url = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
     is_primary = serializers.SerializerMethodField()
     
     class Meta:
         model = ProductImage
-        fields = ['id', 'image_url', 'filename', 'content_type', 'alt_text', 'is_primary', 'order']
+        fields = ['id', 'image_url', 'image_srcset', 'filename', 'content_type', 'alt_text', 'is_primary', 'order']
         extra_kwargs = {
             'image_data': {'write_only': True}
         }
     
     def get_image_url(self, obj):
-        return obj.data_url
+        # Link to the cacheable image endpoint; base64 only when asked for
+        if self.context.get('inline_media'):
+            return obj.data_url
+        return sized_url(f"/api/products/{obj.product_id}/image/{obj.id}/", 'detail', obj.blob_sha256)
+
+    def get_image_srcset(self, obj):
+        if self.context.get('inline_media'):
+            return None
+        return srcset(f"/api/products/{obj.product_id}/image/{obj.id}/", obj.blob_sha256)
     
     def get_is_primary(self, obj):
         return obj.is_primary
@@ -71,9 +166,12 @@ class ProductAttachmentSerializer(serializers.ModelSerializer):
         }
     
     def get_data_url(self, obj):
-        return obj.data_url
+        # Link to the download endpoint; base64 only when asked for
+        if self.context.get('inline_media'):
+            return obj.data_url
+        return versioned_url(f"/api/products/{obj.product_id}/attachments/{obj.id}/", obj.blob_sha256)
 
-class ProductListSerializer(serializers.ModelSerializer):
+class ProductListSerializer(SelectableFieldsMixin, serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
     tags_list = serializers.ReadOnlyField()
     is_available = serializers.ReadOnlyField()
@@ -85,15 +183,31 @@ class ProductListSerializer(serializers.ModelSerializer):
             'id', 'name', 'description', 'price', 'category',
             'active', 'quantity', 'order', 'is_available', 'tags_list', 'primary_image'
         ]
+        expandable_fields = ['category']
+
+    @classmethod
+    def optimize_queryset(cls, queryset, fields=None, expand=None):
+        """Join the category and prefetch primary images only when rendered"""
+        if 'category' in cls.expanded_fields(fields, expand):
+            queryset = queryset.select_related('category')
+        if fields is None or 'primary_image' in fields:
+            queryset = queryset.with_primary_image()
+        return queryset
     
     def get_primary_image(self, obj):
-        # Get primary image (order=0) and return URL endpoint instead of data URL
-        primary_image = obj.images.filter(order=0).first()
+        # Return the URL endpoint of the primary image (order=0) instead of a data URL.
+        # Querysets built with Product.objects.with_primary_image() already carry it.
+        primary_images = getattr(obj, 'primary_images', None)
+        if primary_images is None:
+            primary_image = obj.images.filter(order=0).values_list('id', 'blob_sha256').first()
+        else:
+            primary_image = (primary_images[0].id, primary_images[0].blob_sha256) if primary_images else None
         if primary_image:
-            return f"/api/products/{obj.id}/image/{primary_image.id}/"
+            image_id, digest = primary_image
+            return sized_url(f"/api/products/{obj.id}/image/{image_id}/", 'card', digest)
         return None
 
-class ProductDetailSerializer(serializers.ModelSerializer):
+class ProductDetailSerializer(SelectableFieldsMixin, serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
     images = ProductImageSerializer(many=True, read_only=True)
     specifications = ProductSpecificationSerializer(many=True, read_only=True)
@@ -108,6 +222,33 @@ class ProductDetailSerializer(serializers.ModelSerializer):
             'active', 'quantity', 'order', 'is_available', 'tags_list', 'images', 
             'specifications', 'attachments', 'created_at', 'updated_at'
         ]
+        expandable_fields = ['category', 'images', 'specifications', 'attachments']
+
+    @classmethod
+    def optimize_queryset(cls, queryset, fields=None, expand=None, inline_media=False, private_attachments=False):
+        """
+        Join and prefetch only the relations rendered. Image and attachment
+        bytes are only loaded when inlined; otherwise the serializer links
+        to the binary endpoints and the BLOB columns stay on disk.
+        """
+        expanded = cls.expanded_fields(fields, expand)
+        if 'category' in expanded:
+            queryset = queryset.select_related('category')
+        if 'images' in expanded:
+            images = ProductImage.objects.all()
+            if not inline_media:
+                images = images.defer('image_data')
+            queryset = queryset.prefetch_related(Prefetch('images', queryset=images))
+        if 'specifications' in expanded:
+            queryset = queryset.prefetch_related('specifications')
+        if 'attachments' in expanded:
+            attachments = ProductAttachment.objects.all()
+            if not inline_media:
+                attachments = attachments.defer('file_data')
+            if not private_attachments:
+                attachments = attachments.filter(is_public=True)
+            queryset = queryset.prefetch_related(Prefetch('attachments', queryset=attachments))
+        return queryset
 
 
 
@@ -0,0 +1,118 @@
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from core.versioning import bump_version
+from equipment.models import Manufacturer
+
+from .models import Category, Product, ProductSpecification, Tag
+from .related import RelatedProductsBuilder
+from .search import ProductSearchIndex
+from .specs import SpecIndex
+from .suggest import SUGGESTED_PRODUCT_FIELDS, VERSION_DOMAIN as SUGGEST_DOMAIN
+from .tags import ProductTags
+
+
+@receiver(post_save, sender=Product)
+def sync_product_tags(sender, instance, raw=False, **kwargs):
+    """
+    Mirror ``Product.tags`` into the normalized tag table. Connected first,
+    related products read the result.
+    """
+    if raw:
+        return
+    ProductTags.sync_product(instance)
+
+
+@receiver(post_save, sender=Product)
+def index_product_on_save(sender, instance, raw=False, **kwargs):
+    """Keep the search index row in sync with the product"""
+    if raw:
+        return
+    ProductSearchIndex.index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_index(sender, instance, **kwargs):
+    ProductSearchIndex.remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created=False, raw=False, **kwargs):
+    """The category name is indexed, so renaming a category reindexes its products"""
+    if raw or created:
+        return
+    for product in instance.products.select_related('category'):
+        ProductSearchIndex.index_product(product)
+
+
+@receiver(post_save, sender=ProductSpecification)
+@receiver(post_delete, sender=ProductSpecification)
+def reindex_specification_product(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    try:
+        product = Product.objects.select_related('category').get(pk=instance.product_id)
+    except Product.DoesNotExist:
+        # The product is being deleted along with its specifications
+        return
+    ProductSearchIndex.index_product(product)
+
+
+@receiver(post_save, sender=ProductSpecification)
+def index_specification_value(sender, instance, raw=False, **kwargs):
+    """Keep the numeric spec index row in sync; deletes cascade to it"""
+    if raw:
+        return
+    SpecIndex.index_specification(instance)
+
+
+@receiver(post_save, sender=Product)
+def refresh_related_products(sender, instance, raw=False, **kwargs):
+    """
+    Keep the saved product's own related list current. Other products pick
+    it up on the next build_related_products run.
+    """
+    if raw:
+        return
+    RelatedProductsBuilder().refresh(instance)
+
+
+@receiver(pre_save, sender=Product)
+def remember_suggested_fields(sender, instance, raw=False, **kwargs):
+    """Keep the saved values of the fields the suggest index reads, to compare after the save"""
+    if raw or instance._state.adding:
+        return
+    instance._suggested_values = Product.objects.filter(pk=instance.pk).values_list(
+        *SUGGESTED_PRODUCT_FIELDS
+    ).first()
+
+
+@receiver(post_save, sender=Product)
+def bump_suggest_version(sender, instance, created=False, raw=False, **kwargs):
+    """
+    Rebuild suggestions only when suggested text may have changed; stock
+    and price edits leave the index alone
+    """
+    if raw:
+        return
+    previous = instance.__dict__.pop('_suggested_values', None)
+    if created or previous != tuple(getattr(instance, field) for field in SUGGESTED_PRODUCT_FIELDS):
+        bump_version(SUGGEST_DOMAIN)
+
+
+@receiver(post_delete, sender=Product)
+def bump_suggest_version_on_delete(sender, instance, **kwargs):
+    bump_version(SUGGEST_DOMAIN)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Manufacturer)
+@receiver(post_delete, sender=Manufacturer)
+def bump_suggest_version_for_labels(sender, raw=False, **kwargs):
+    """Category names, tags and manufacturer labels are suggested too"""
+    if raw:
+        return
+    bump_version(SUGGEST_DOMAIN)
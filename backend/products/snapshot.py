@@ -0,0 +1,226 @@
+"""
+In-process catalog snapshot for cart validation and pricing.
+
+Each worker keeps one compact record per product (id, name, price,
+quantity, active, category) keyed by UUID. ``CatalogSnapshot.current()``
+compares the snapshot's stamp with the ``products`` content version (one
+indexed single-row query, see core.versioning) and only reloads when the
+catalog changed:
+
+* rows whose ``updated_at`` moved past the last watermark are merged in;
+* if the merged row count disagrees with the table (deletions), or the
+  snapshot is older than ``FULL_RELOAD_INTERVAL``, everything is reloaded.
+
+The snapshot is for reads only. Stock is taken and given back against
+the database row (``orders.reservations``), never against a record here.
+"""
+import logging
+import sys
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from core.versioning import get_version
+
+logger = logging.getLogger(__name__)
+
+# Rows committed slightly after a newer row can carry an older updated_at;
+# re-reading this much of the past on every incremental refresh covers that
+WATERMARK_OVERLAP = timedelta(seconds=5)
+
+# Upper bound on how long incremental refreshes are trusted
+FULL_RELOAD_INTERVAL = 15 * 60
+
+
+class ProductRecord:
+    """Read-only view of the product fields the cart and pricing code use"""
+
+    __slots__ = ('id', 'name', 'price', 'quantity', 'active', 'category_id', 'category_name')
+
+    def __init__(self, id, name, price, quantity, active, category_id, category_name):
+        self.id = id
+        self.name = name
+        self.price = price
+        self.quantity = quantity
+        self.active = active
+        self.category_id = category_id
+        self.category_name = category_name
+
+    @property
+    def is_available(self):
+        """Same rule as Product.is_available"""
+        return self.active and self.quantity > 0
+
+    @property
+    def in_stock(self):
+        return self.quantity > 0
+
+    def __repr__(self):
+        return f'<ProductRecord {self.id} {self.name!r}>'
+
+
+class CatalogSnapshot:
+    """Per-process product snapshot. Use ``CatalogSnapshot.current()``."""
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.records = {}
+        self.stamp = None
+        self.watermark = None
+        self.loaded_at = 0.0
+        self.full_loads = 0
+        self.incremental_loads = 0
+
+    @classmethod
+    def current(cls):
+        """Return this process's snapshot, refreshed if the catalog changed"""
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            cls._instance.refresh()
+            return cls._instance
+
+    @classmethod
+    def clear(cls):
+        """Drop the snapshot; the next ``current()`` call reloads it"""
+        with cls._lock:
+            cls._instance = None
+
+    def get(self, product_id):
+        """Return the record for ``product_id`` (UUID or string), or None"""
+        if not isinstance(product_id, uuid.UUID):
+            try:
+                product_id = uuid.UUID(str(product_id))
+            except (TypeError, ValueError, AttributeError):
+                return None
+        return self.records.get(product_id)
+
+    def in_bulk(self, product_ids):
+        """
+        ``{product id: record}`` for the ids that exist, keyed by the ids as
+        given (UUIDs or strings), like ``QuerySet.in_bulk``
+        """
+        found = {}
+        for product_id in product_ids:
+            record = self.get(product_id)
+            if record is not None:
+                found[product_id] = record
+        return found
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, product_id):
+        return self.get(product_id) is not None
+
+    def __getitem__(self, product_id):
+        """
+        Like ``get`` but raises Product.DoesNotExist, so call sites written
+        around ``Product.objects.get`` keep their error handling
+        """
+        record = self.get(product_id)
+        if record is None:
+            from .models import Product
+            raise Product.DoesNotExist(f'Product {product_id} not found')
+        return record
+
+    # Loading
+
+    def refresh(self):
+        stamp = get_version('products')
+        if stamp == self.stamp:
+            return
+        if self.watermark is None or time.monotonic() - self.loaded_at > FULL_RELOAD_INTERVAL:
+            self.load_all(stamp)
+            return
+        self.load_changed(stamp)
+
+    @staticmethod
+    def _rows(queryset):
+        return queryset.values_list(
+            'id', 'name', 'price', 'quantity', 'active', 'category_id', 'category__name', 'updated_at'
+        )
+
+    def _store(self, rows, records):
+        watermark = self.watermark
+        for product_id, name, price, quantity, active, category_id, category_name, updated_at in rows:
+            records[product_id] = ProductRecord(
+                product_id, name, price, quantity, active, category_id,
+                # A handful of category names are shared by every product
+                sys.intern(category_name) if category_name else category_name,
+            )
+            if watermark is None or updated_at > watermark:
+                watermark = updated_at
+        self.watermark = watermark
+
+    def load_all(self, stamp):
+        from .models import Product
+
+        started = time.perf_counter()
+        records = {}
+        self.watermark = None
+        self._store(self._rows(Product.objects.all()).iterator(chunk_size=5000), records)
+        self.records = records
+        self.stamp = stamp
+        self.loaded_at = time.monotonic()
+        self.full_loads += 1
+        logger.info(
+            f"Loaded catalog snapshot: {len(records)} products, "
+            f"{self.memory_footprint()} bytes in {(time.perf_counter() - started) * 1000:.1f} ms"
+        )
+
+    def load_changed(self, stamp):
+        from .models import Category, Product
+
+        records = dict(self.records)
+        self._store(
+            self._rows(Product.objects.filter(updated_at__gte=self.watermark - WATERMARK_OVERLAP)),
+            records,
+        )
+        # Category renames do not touch product rows
+        category_names = dict(Category.objects.values_list('id', 'name'))
+        for record in records.values():
+            name = category_names.get(record.category_id)
+            if name is not None:
+                record.category_name = sys.intern(name)
+
+        if len(records) != Product.objects.count():
+            # Products were deleted; start from scratch
+            self.load_all(stamp)
+            return
+        self.records = records
+        self.stamp = stamp
+        self.incremental_loads += 1
+
+    # Reporting
+
+    def memory_footprint(self):
+        """
+        Approximate bytes held by the snapshot: the dict, the records and the
+        objects they reference (shared objects such as interned category names
+        are counted once).
+        """
+        seen = set()
+        total = sys.getsizeof(self.records)
+        for key, record in self.records.items():
+            total += sys.getsizeof(record)
+            for value in (key, key.int, record.name, record.price, record.category_name):
+                if id(value) not in seen:
+                    seen.add(id(value))
+                    total += sys.getsizeof(value)
+        return total
+
+    def stats(self):
+        count = len(self.records)
+        footprint = self.memory_footprint()
+        return {
+            'products': count,
+            'stamp': self.stamp,
+            'memory_bytes': footprint,
+            'bytes_per_product': round(footprint / count) if count else 0,
+            'full_loads': self.full_loads,
+            'incremental_loads': self.incremental_loads,
+        }
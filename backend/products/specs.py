@@ -0,0 +1,279 @@
+"""
+Numeric index over product specifications.
+
+``ProductSpecification`` values are free text ("500 GPM", "6 inches",
+"10-20 HP"). ``parse_quantity`` turns them into a number range in a
+normalized unit, and ``SpecIndex`` keeps one ``ProductSpecValue`` row per
+parsable specification so the product list can filter on ranges
+(``?spec_flow_rate_min=400``) and report facets with a single grouped
+query.
+
+Values in a known unit are converted to the canonical unit of their kind:
+flow to GPM, power to HP, pressure to PSI, head and long lengths to feet,
+sizes to inches. Plain numbers are indexed without a unit. Anything else
+("Stainless Steel", "326T") is left out of the index.
+
+Rows are written by the ProductSpecification signal handlers in
+``products.signals`` and rebuilt in bulk by ``rebuild_spec_index``.
+"""
+import logging
+import re
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Count, Max, Min
+from django.utils.text import slugify
+
+from core.versioning import bump_version
+
+logger = logging.getLogger(__name__)
+
+# Query parameters: spec_<key>_min / spec_<key>_max, plus facets=1
+SPEC_PARAM_RE = re.compile(r'^spec_(?P<key>[a-z0-9_]+?)_(?P<bound>min|max)$')
+FACETS_PARAM = 'facets'
+
+# alias -> (canonical unit, factor to the canonical unit)
+UNITS = {
+    # Flow
+    'gpm': ('gpm', 1.0),
+    'gal/min': ('gpm', 1.0),
+    'gph': ('gpm', 1 / 60),
+    'l/min': ('gpm', 0.264172),
+    'lpm': ('gpm', 0.264172),
+    'm3/h': ('gpm', 4.402868),
+    'm³/h': ('gpm', 4.402868),
+    'm3/hr': ('gpm', 4.402868),
+    # Power
+    'hp': ('hp', 1.0),
+    'bhp': ('hp', 1.0),
+    'horsepower': ('hp', 1.0),
+    'kw': ('hp', 1.341022),
+    'w': ('hp', 0.001341022),
+    # Head and lengths
+    'ft': ('ft', 1.0),
+    'feet': ('ft', 1.0),
+    'foot': ('ft', 1.0),
+    "'": ('ft', 1.0),
+    'm': ('ft', 3.28084),
+    'meter': ('ft', 3.28084),
+    'meters': ('ft', 3.28084),
+    'metre': ('ft', 3.28084),
+    'metres': ('ft', 3.28084),
+    # Sizes
+    'in': ('in', 1.0),
+    'inch': ('in', 1.0),
+    'inches': ('in', 1.0),
+    '"': ('in', 1.0),
+    'mm': ('in', 1 / 25.4),
+    'cm': ('in', 1 / 2.54),
+    # Pressure
+    'psi': ('psi', 1.0),
+    'psig': ('psi', 1.0),
+    'bar': ('psi', 14.5038),
+    'kpa': ('psi', 0.145038),
+    'mpa': ('psi', 145.038),
+    # Indexed as they are
+    'rpm': ('rpm', 1.0),
+    'cfm': ('cfm', 1.0),
+    'v': ('v', 1.0),
+    'volts': ('v', 1.0),
+    'vac': ('v', 1.0),
+    'vdc': ('v', 1.0),
+    'a': ('a', 1.0),
+    'amps': ('a', 1.0),
+    'hz': ('hz', 1.0),
+    '%': ('%', 1.0),
+    'gal': ('gal', 1.0),
+    'gallon': ('gal', 1.0),
+    'gallons': ('gal', 1.0),
+    'lb': ('lb', 1.0),
+    'lbs': ('lb', 1.0),
+    'kg': ('lb', 2.20462),
+    'kn': ('kn', 1.0),
+}
+
+# Display names of the canonical units, for facets
+UNIT_LABELS = {
+    'gpm': 'GPM', 'hp': 'HP', 'ft': 'ft', 'in': 'in', 'psi': 'PSI', 'rpm': 'RPM',
+    'cfm': 'CFM', 'v': 'V', 'a': 'A', 'hz': 'Hz', '%': '%', 'gal': 'gal', 'lb': 'lb', 'kn': 'kN',
+}
+
+# A mixed number ("1-1/2", "1 1/2"), a fraction or a decimal with
+# optional thousands separators
+NUMBER = r'\d+[\s-]\d+/\d+|\d+/\d+|\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d*\.?\d+'
+QUANTITY_RE = re.compile(
+    rf'^\s*(?P<low>{NUMBER})'
+    rf'(?:\s*(?:-|–|to)\s*(?P<high>{NUMBER}))?'
+    r'\s*(?P<unit>[^\s\d(,;][^\s(,;]*)?(?:[\s(,;].*)?$',
+    re.IGNORECASE,
+)
+
+
+def parse_number(text):
+    text = text.replace(',', '')
+    whole, _, fraction = text.replace('-', ' ').rpartition(' ')
+    if '/' in fraction:
+        numerator, denominator = fraction.split('/')
+        if float(denominator) == 0:
+            raise ValueError(text)
+        return (float(whole) if whole else 0.0) + float(numerator) / float(denominator)
+    return float(text)
+
+
+def parse_quantity(text):
+    """
+    Parse a specification value into ``(low, high, unit)`` in the canonical
+    unit, or return None when it is not a number in a known unit.
+
+    >>> parse_quantity('500 GPM')
+    (500.0, 500.0, 'gpm')
+    >>> parse_quantity('1-1/2 inches')
+    (1.5, 1.5, 'in')
+    """
+    match = QUANTITY_RE.match(text or '')
+    if not match:
+        return None
+    try:
+        low = parse_number(match['low'])
+        high = parse_number(match['high']) if match['high'] else low
+    except ValueError:
+        return None
+
+    unit, factor = '', 1.0
+    if match['unit']:
+        alias = match['unit'].lower().rstrip('.')
+        if alias not in UNITS:
+            return None
+        unit, factor = UNITS[alias]
+    low, high = sorted((low * factor, high * factor))
+    return round(low, 6), round(high, 6), unit
+
+
+def spec_key(name):
+    """Index key of a specification name: 'Flow Rate' -> 'flow_rate'"""
+    return slugify(name).replace('-', '_')
+
+
+class SpecIndex:
+    """Maintains and queries ProductSpecValue rows"""
+
+    @staticmethod
+    def value_for(specification):
+        """Unsaved ProductSpecValue for a specification, or None if it is not numeric"""
+        ProductSpecValue = apps.get_model('products', 'ProductSpecValue')
+        parsed = parse_quantity(specification.value)
+        key = spec_key(specification.key)
+        if parsed is None or not key:
+            return None
+        low, high, unit = parsed
+        return ProductSpecValue(
+            specification_id=specification.pk, product_id=specification.product_id,
+            key=key, min_value=low, max_value=high, unit=unit,
+        )
+
+    @classmethod
+    def index_specification(cls, specification):
+        """Insert, replace or drop the index row of one specification"""
+        ProductSpecValue = apps.get_model('products', 'ProductSpecValue')
+        row = cls.value_for(specification)
+        if row is None:
+            ProductSpecValue.objects.filter(specification_id=specification.pk).delete()
+        else:
+            row.save()
+
+    @classmethod
+    def rebuild(cls, batch_size=1000):
+        """Reindex every specification. Returns the number of rows written."""
+        ProductSpecification = apps.get_model('products', 'ProductSpecification')
+        ProductSpecValue = apps.get_model('products', 'ProductSpecValue')
+
+        written = 0
+        with transaction.atomic():
+            ProductSpecValue.objects.all().delete()
+            batch = []
+            specifications = ProductSpecification.objects.only('id', 'product_id', 'key', 'value')
+            for specification in specifications.iterator(chunk_size=batch_size):
+                row = cls.value_for(specification)
+                if row is not None:
+                    batch.append(row)
+                if len(batch) >= batch_size:
+                    ProductSpecValue.objects.bulk_create(batch)
+                    written += len(batch)
+                    batch = []
+            ProductSpecValue.objects.bulk_create(batch)
+            written += len(batch)
+            # bulk_create sends no signals; facets are part of the catalog
+            bump_version('products')
+
+        logger.info(f"Rebuilt specification index with {written} values")
+        return written
+
+    @staticmethod
+    def parse_filters(query_params):
+        """
+        ``{key: (min, max, unit)}`` from ``spec_<key>_min``/``spec_<key>_max``
+        parameters. Bounds may carry a unit ("90 m3/h"), which is converted
+        and restricts the match to values in that unit. Unparsable bounds
+        are ignored.
+        """
+        filters = {}
+        for param, raw in query_params.items():
+            match = SPEC_PARAM_RE.match(param)
+            if not match:
+                continue
+            parsed = parse_quantity(raw)
+            if parsed is None:
+                continue
+            low, high, unit = parsed
+            current_min, current_max, current_unit = filters.get(match['key'], (None, None, ''))
+            if match['bound'] == 'min':
+                current_min = low
+            else:
+                current_max = high
+            filters[match['key']] = (current_min, current_max, unit or current_unit)
+        return filters
+
+    @staticmethod
+    def filter(queryset, filters):
+        """
+        Restrict a Product queryset to products with a value of every
+        filtered key overlapping the requested range
+        """
+        ProductSpecValue = apps.get_model('products', 'ProductSpecValue')
+        for key, (low, high, unit) in filters.items():
+            values = ProductSpecValue.objects.filter(key=key)
+            if unit:
+                values = values.filter(unit=unit)
+            if low is not None:
+                values = values.filter(max_value__gte=low)
+            if high is not None:
+                values = values.filter(min_value__lte=high)
+            queryset = queryset.filter(pk__in=values.values('product_id'))
+        return queryset
+
+    @staticmethod
+    def facets(queryset):
+        """
+        Numeric facets of the products in ``queryset``, one grouped query:
+        ``[{key, name, unit, count, min, max}]`` ordered by product count
+        """
+        ProductSpecValue = apps.get_model('products', 'ProductSpecValue')
+        rows = ProductSpecValue.objects.filter(
+            product_id__in=queryset.order_by().values('pk')
+        ).values('key', 'unit').annotate(
+            name=Min('specification__key'),
+            count=Count('product_id', distinct=True),
+            min=Min('min_value'),
+            max=Max('max_value'),
+        ).order_by('-count', 'key', 'unit')
+        return [
+            {
+                'key': row['key'],
+                'name': row['name'],
+                'unit': UNIT_LABELS.get(row['unit'], row['unit']),
+                'count': row['count'],
+                'min': row['min'],
+                'max': row['max'],
+            }
+            for row in rows
+        ]
@@ -0,0 +1,313 @@
+"""
+Search-as-you-type suggestions from an in-process prefix index.
+
+Each worker keeps a ``SuggestIndex`` of short texts: product names, tags,
+category names, manufacturer labels and queries visitors searched for
+(``analytics.SearchQuery``) that found something. Every word start of a
+text becomes a key in one sorted array, so "centri" and "centrifugal pu"
+both find "Industrial Centrifugal Pump"; a lookup is a ``bisect`` plus a
+walk over the matching keys.
+
+Short prefixes match a large share of the keys, so every prefix matching
+more than ``HOT_PREFIX_KEYS`` keys has its best ``MAX_LIMIT`` entries
+ranked when the index is built and served from a dict. Any other lookup
+walks at most ``HOT_PREFIX_KEYS`` keys.
+
+The index is rebuilt when the ``suggest`` content version changes
+(checked at most every ``VERSION_CHECK_INTERVAL`` seconds) and at least
+every ``REBUILD_INTERVAL`` to pick up new popular queries, which are not
+versioned. That version only moves when suggested text does: product
+names, tags, categories and manufacturer labels (see products.signals),
+not when stock is held or sold.
+
+The request that notices the change builds the new index and swaps it in;
+requests arriving meanwhile are served the previous one. Only a worker's
+first build makes requests wait.
+"""
+import bisect
+import heapq
+import logging
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from datetime import timedelta
+
+from django.apps import apps
+from django.db.models import Count
+from django.utils import timezone
+
+from core.versioning import get_version
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 20
+
+HOT_PREFIX_KEYS = 256
+
+# Content version bumped by changes to anything the index suggests
+VERSION_DOMAIN = 'suggest'
+# Product fields the index reads; saves that change none of them keep it
+SUGGESTED_PRODUCT_FIELDS = ('name', 'active', 'tags', 'category_id')
+
+VERSION_CHECK_INTERVAL = 2.0
+REBUILD_INTERVAL = 15 * 60
+
+# Popular queries: searches of the last POPULAR_QUERY_DAYS that returned
+# results, asked at least POPULAR_QUERY_MIN_COUNT times
+POPULAR_QUERY_DAYS = 90
+POPULAR_QUERY_MIN_COUNT = 2
+POPULAR_QUERY_LIMIT = 5000
+
+# Base weight per suggestion type; popularity is added on a log scale
+TYPE_WEIGHTS = {
+    'query': 3.0,
+    'category': 2.5,
+    'manufacturer': 2.0,
+    'tag': 1.5,
+    'product': 1.0,
+}
+# Matches at the start of a text rank above matches on a later word
+LEADING_MATCH_BONUS = 1.5
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Sorts after any character a key can contain
+MAX_CHAR = '\U0010ffff'
+
+
+def normalize(text):
+    """Lowercase words without diacritics, separated by single spaces"""
+    text = text or ''
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(TOKEN_RE.findall(text.lower()))
+
+
+class Suggestion:
+    __slots__ = ('text', 'type', 'ref', 'weight')
+
+    def __init__(self, text, type, ref, weight):
+        self.text = text
+        self.type = type
+        self.ref = ref
+        self.weight = weight
+
+    def as_dict(self):
+        return {'text': self.text, 'type': self.type, 'id': self.ref}
+
+
+class SuggestIndex:
+    """Per-process suggestion index. Use ``SuggestIndex.current()``."""
+
+    _instance = None
+    # Guards ``_instance``; only held to read or swap it
+    _lock = threading.Lock()
+    # Held by the one thread building a replacement
+    _build_lock = threading.Lock()
+
+    def __init__(self):
+        self.entries = []
+        self.keys = []
+        self.key_entries = []
+        self.key_weights = []
+        self.hot = {}
+        self.stamp = None
+        self.built_at = 0.0
+        self.checked_at = 0.0
+        self.builds = 0
+
+    @classmethod
+    def current(cls):
+        """Return this process's index, rebuilt if the suggested text changed"""
+        with cls._lock:
+            index = cls._instance
+        if index is not None:
+            stamp = index.stale_stamp()
+            # Served as it is while another thread builds its replacement
+            if stamp is None or not cls._build_lock.acquire(blocking=False):
+                return index
+        else:
+            # Nothing to serve yet: wait for the first build
+            cls._build_lock.acquire()
+            with cls._lock:
+                index = cls._instance
+            if index is not None:
+                cls._build_lock.release()
+                return index
+            stamp = get_version(VERSION_DOMAIN)
+
+        try:
+            replacement = cls()
+            replacement.builds = index.builds if index is not None else 0
+            replacement.build(replacement.collect(), stamp)
+            with cls._lock:
+                cls._instance = replacement
+            return replacement
+        finally:
+            cls._build_lock.release()
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._instance = None
+
+    def stale_stamp(self):
+        """The current version stamp if the index should be rebuilt, otherwise None"""
+        now = time.monotonic()
+        if now - self.checked_at < VERSION_CHECK_INTERVAL:
+            return None
+        self.checked_at = now
+        stamp = get_version(VERSION_DOMAIN)
+        if stamp != self.stamp or now - self.built_at > REBUILD_INTERVAL:
+            return stamp
+        return None
+
+    # Sources
+
+    @staticmethod
+    def collect():
+        """Yield ``(text, type, ref, popularity)`` for everything worth suggesting"""
+        Product = apps.get_model('products', 'Product')
+        Category = apps.get_model('products', 'Category')
+        ProductTag = apps.get_model('products', 'ProductTag')
+        Manufacturer = apps.get_model('equipment', 'Manufacturer')
+        SearchQuery = apps.get_model('analytics', 'SearchQuery')
+
+        for product_id, name in Product.objects.filter(active=True).values_list('id', 'name').iterator(chunk_size=5000):
+            yield name, 'product', str(product_id), 0
+
+        for category_id, name, count in Category.objects.filter(products__active=True).values_list(
+            'id', 'name'
+        ).annotate(count=Count('products')):
+            yield name, 'category', category_id, count
+
+        for slug, name, count in ProductTag.objects.filter(product__active=True).values_list(
+            'tag__slug', 'tag__name'
+        ).annotate(count=Count('product_id')):
+            yield name, 'tag', slug, count
+
+        for manufacturer_id, label in Manufacturer.objects.values_list('id', 'label'):
+            yield label, 'manufacturer', manufacturer_id, 0
+
+        searches = Counter()
+        spelling = {}
+        since = timezone.now() - timedelta(days=POPULAR_QUERY_DAYS)
+        for query, count in SearchQuery.objects.filter(timestamp__gte=since, results_count__gt=0).values_list(
+            'query'
+        ).annotate(count=Count('id')).order_by('-count')[:POPULAR_QUERY_LIMIT * 4]:
+            key = normalize(query)
+            if key:
+                searches[key] += count
+                spelling.setdefault(key, query.strip())
+        for key, count in searches.most_common(POPULAR_QUERY_LIMIT):
+            if count >= POPULAR_QUERY_MIN_COUNT:
+                yield spelling[key], 'query', None, count
+
+    # Building
+
+    def build(self, items, stamp):
+        started = time.perf_counter()
+        entries = []
+        seen = set()
+        keyed = []
+        for text, type, ref, popularity in items:
+            normalized = normalize(text)
+            # The same text from two sources is suggested once, as the first type seen
+            if not normalized or normalized in seen:
+                continue
+            seen.add(normalized)
+            entry_id = len(entries)
+            weight = TYPE_WEIGHTS[type] + math.log1p(popularity)
+            entries.append(Suggestion(text.strip(), type, ref, weight))
+            tokens = normalized.split(' ')
+            for position in range(len(tokens)):
+                key_weight = weight * LEADING_MATCH_BONUS if position == 0 else weight
+                keyed.append((' '.join(tokens[position:]), entry_id, key_weight))
+        keyed.sort(key=lambda item: item[0])
+
+        self.entries = entries
+        self.keys = [key for key, _, _ in keyed]
+        self.key_entries = [entry_id for _, entry_id, _ in keyed]
+        self.key_weights = [weight for _, _, weight in keyed]
+        self.hot = self._rank_hot_prefixes()
+        self.stamp = stamp
+        self.built_at = self.checked_at = time.monotonic()
+        self.builds += 1
+        logger.info(
+            f"Built suggest index: {len(entries)} entries, {len(keyed)} keys "
+            f"in {(time.perf_counter() - started) * 1000:.1f} ms"
+        )
+
+    def _rank_hot_prefixes(self):
+        """``{prefix: entry ids}`` for every prefix matching more than ``HOT_PREFIX_KEYS`` keys"""
+        hot = {}
+        self._rank_slice(0, len(self.keys), 0, hot)
+        return hot
+
+    def _rank_slice(self, start, end, length, hot):
+        """
+        Best ``(weight, entry id)`` pairs of ``keys[start:end]``, which share
+        their first ``length`` characters. Keys are sorted, so each longer
+        prefix is a sub-slice; a slice's ranking is merged from those of its
+        sub-slices, so every key is ranked once however deep the prefixes go.
+        """
+        if end - start <= HOT_PREFIX_KEYS:
+            return self._best(zip(self.key_weights[start:end], self.key_entries[start:end]), MAX_LIMIT)
+
+        candidates = []
+        position = start
+        while position < end:
+            key = self.keys[position]
+            if len(key) <= length:
+                # Keys equal to the slice's prefix itself
+                group_end = bisect.bisect_right(self.keys, key, position, end)
+                candidates.extend(zip(self.key_weights[position:group_end], self.key_entries[position:group_end]))
+            else:
+                prefix = key[:length + 1]
+                group_end = bisect.bisect_right(self.keys, prefix + MAX_CHAR, position, end)
+                ranked = self._rank_slice(position, group_end, length + 1, hot)
+                if group_end - position > HOT_PREFIX_KEYS:
+                    hot[prefix] = [entry_id for _, entry_id in ranked]
+                candidates.extend(ranked)
+            position = group_end
+        return self._best(candidates, MAX_LIMIT)
+
+    @staticmethod
+    def _best(candidates, limit):
+        """The ``limit`` best ``(weight, entry id)`` pairs, each entry once at its best weight"""
+        best = {}
+        for weight, entry_id in candidates:
+            if weight > best.get(entry_id, -1):
+                best[entry_id] = weight
+        ranked = heapq.nsmallest(limit, best.items(), key=lambda item: (-item[1], item[0]))
+        return [(weight, entry_id) for entry_id, weight in ranked]
+
+    # Lookup
+
+    def suggest(self, query, limit=DEFAULT_LIMIT):
+        """Best suggestions for the prefix ``query``"""
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        limit = min(limit, MAX_LIMIT)
+        if prefix in self.hot:
+            return [self.entries[entry_id] for entry_id in self.hot[prefix][:limit]]
+
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_right(self.keys, prefix + MAX_CHAR, lo=start)
+        candidates = zip(self.key_weights[start:end], self.key_entries[start:end])
+        return [self.entries[entry_id] for _, entry_id in self._best(candidates, limit)]
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'keys': len(self.keys),
+            'hot_prefixes': len(self.hot),
+            'stamp': self.stamp,
+            'builds': self.builds,
+        }
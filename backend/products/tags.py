@@ -0,0 +1,106 @@
+"""
+Normalized product tags.
+
+``Product.tags`` stays the editable comma-separated text (admin forms, CSV
+import and export, Stripe metadata). Every save mirrors it into ``Tag`` and
+``ProductTag`` rows, keyed by the tag's slug, so "Stainless Steel" and
+"stainless-steel" are one tag and "steel" does not match either.
+
+Filtering (``?tags=``), facet counts and related products read the through
+table, whose ``(tag, product)`` index answers both without scanning
+products.
+"""
+from django.apps import apps
+from django.db.models import Count
+from django.utils.text import slugify
+
+TAGS_PARAM = 'tags'
+
+
+def tag_slug(name):
+    return slugify(name, allow_unicode=True)[:100]
+
+
+def parse_tags(text):
+    """
+    ``[(slug, name)]`` of a comma-separated tag string in order, without
+    duplicates; the first spelling of a tag wins
+    """
+    tags = {}
+    for name in (text or '').split(','):
+        name = name.strip()
+        slug = tag_slug(name)
+        if slug and slug not in tags:
+            tags[slug] = name[:100]
+    return list(tags.items())
+
+
+class ProductTags:
+    """Maintains and queries Tag / ProductTag rows"""
+
+    @staticmethod
+    def get_or_create_tags(parsed):
+        """``{slug: tag id}`` for ``[(slug, name)]``, creating missing tags"""
+        Tag = apps.get_model('products', 'Tag')
+        slugs = [slug for slug, _ in parsed]
+        existing = dict(Tag.objects.filter(slug__in=slugs).values_list('slug', 'id'))
+        missing = [Tag(slug=slug, name=name) for slug, name in parsed if slug not in existing]
+        if missing:
+            Tag.objects.bulk_create(missing, ignore_conflicts=True)
+            existing = dict(Tag.objects.filter(slug__in=slugs).values_list('slug', 'id'))
+        return existing
+
+    @classmethod
+    def sync_product(cls, product):
+        """Make the product's ProductTag rows match its ``tags`` text"""
+        ProductTag = apps.get_model('products', 'ProductTag')
+        parsed = parse_tags(product.tags)
+        tag_ids = cls.get_or_create_tags(parsed) if parsed else {}
+        wanted = [tag_ids[slug] for slug, _ in parsed]
+
+        current = list(
+            ProductTag.objects.filter(product_id=product.pk).order_by('position').values_list('tag_id', flat=True)
+        )
+        if current == wanted:
+            return False
+        ProductTag.objects.filter(product_id=product.pk).delete()
+        ProductTag.objects.bulk_create([
+            ProductTag(product_id=product.pk, tag_id=tag_id, position=position)
+            for position, tag_id in enumerate(wanted)
+        ])
+        return True
+
+    @staticmethod
+    def parse_filter(query_params):
+        """Slugs requested with ``?tags=a,b`` (or repeated ``?tags=``)"""
+        slugs = []
+        for value in query_params.getlist(TAGS_PARAM):
+            slugs += [slug for slug, _ in parse_tags(value) if slug not in slugs]
+        return slugs
+
+    @staticmethod
+    def filter(queryset, slugs):
+        """Restrict a Product queryset to products carrying every tag in ``slugs``"""
+        ProductTag = apps.get_model('products', 'ProductTag')
+        for slug in slugs:
+            queryset = queryset.filter(
+                pk__in=ProductTag.objects.filter(tag__slug=slug).values('product_id')
+            )
+        return queryset
+
+    @staticmethod
+    def facets(queryset, limit=None):
+        """
+        Tags of the products in ``queryset`` with product counts, most used
+        first, in one aggregate query: ``[{slug, name, count}]``
+        """
+        ProductTag = apps.get_model('products', 'ProductTag')
+        rows = ProductTag.objects.filter(
+            product_id__in=queryset.order_by().values('pk')
+        ).values('tag__slug', 'tag__name').annotate(count=Count('product_id')).order_by('-count', 'tag__slug')
+        if limit:
+            rows = rows[:limit]
+        return [
+            {'slug': row['tag__slug'], 'name': row['tag__name'], 'count': row['count']}
+            for row in rows
+        ]
@@ -62,3 +62,1031 @@ class ProductInventoryTestCase(TestCase):
         self.product.quantity = 5
         self.product.save()
         self.assertTrue(self.product.is_available)
+
+
+class ProductSearchIndexTestCase(TestCase):
+    def setUp(self):
+        self.pumps = Category.objects.create(name="Pumps")
+        self.seals = Category.objects.create(name="Seals")
+        self.centrifugal = Product.objects.create(
+            name="Industrial Centrifugal Pump",
+            description="High-efficiency pump for industrial applications",
+            price=2499.99,
+            category=self.pumps,
+            quantity=3,
+            tags="centrifugal, stainless steel"
+        )
+        self.seal_kit = Product.objects.create(
+            name="Cartridge Seal Kit",
+            description="Replacement kit for centrifugal pump seals",
+            price=199.00,
+            category=self.seals,
+            quantity=10,
+            tags="seal, kit"
+        )
+
+    def search(self, query):
+        from .search import ProductSearchIndex
+        return list(ProductSearchIndex.search(Product.objects.all(), query))
+
+    def test_name_matches_rank_above_description_matches(self):
+        """A hit in the product name outranks a hit in the description"""
+        self.assertEqual(self.search("centrifugal"), [self.centrifugal, self.seal_kit])
+
+    def test_prefix_matching(self):
+        self.assertEqual(self.search("cartr"), [self.seal_kit])
+
+    def test_specification_and_category_are_indexed(self):
+        from .models import ProductSpecification
+        ProductSpecification.objects.create(product=self.seal_kit, key="Model", value="6020")
+        self.assertEqual(self.search("6020"), [self.seal_kit])
+        self.assertEqual(self.search("pumps"), [self.centrifugal])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.centrifugal.name = "Vertical Turbine"
+        self.centrifugal.save()
+        self.assertEqual(self.search("turbine"), [self.centrifugal])
+
+        self.pumps.name = "Process Equipment"
+        self.pumps.save()
+        self.assertEqual(self.search("process"), [self.centrifugal])
+
+        self.centrifugal.delete()
+        self.assertEqual(self.search("turbine"), [])
+
+    def test_rows_are_kept_by_rowid(self):
+        """Saves replace the product's row in place and deletes drop it with its rowid"""
+        from django.db import connection
+        from .search import FTS_TABLE, ROWID_TABLE
+
+        def rows():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'SELECT f.product_id, f.rowid, m.fts_rowid FROM {FTS_TABLE} f '
+                    f'LEFT JOIN {ROWID_TABLE} m ON m.product_id = f.product_id ORDER BY f.rowid'
+                )
+                return cursor.fetchall()
+
+        before = rows()
+        self.assertEqual(len(before), 2)
+        self.assertTrue(all(rowid == mapped for _, rowid, mapped in before))
+
+        self.seal_kit.name = "Mechanical Seal Kit"
+        self.seal_kit.save()
+        self.seal_kit.save()
+        self.assertEqual(rows(), before)
+        self.assertEqual(self.search("mechanical"), [self.seal_kit])
+
+        self.seal_kit.delete()
+        self.assertEqual(rows(), [row for row in before if row[0] == self.centrifugal.id.hex])
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {ROWID_TABLE}')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_rebuild_command(self):
+        from django.core.management import call_command
+        from django.db import connection
+        from io import StringIO
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM products_product_fts")
+        self.assertEqual(self.search("cartridge"), [])
+
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(self.search("cartridge"), [self.seal_kit])
+
+    def test_search_endpoints_use_index(self):
+        response = self.client.get("/api/products/search/", {"q": "centrifugal pump"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p["name"] for p in response.json()], [self.centrifugal.name, self.seal_kit.name])
+
+        response = self.client.get("/api/products/", {"search": "kit"})
+        self.assertEqual([p["name"] for p in response.json()["results"]], [self.seal_kit.name])
+
+
+class ProductListQueryCountTestCase(TestCase):
+    """The primary image of every product on a page is resolved in one query"""
+
+    def setUp(self):
+        from django.core.cache import caches
+        from .models import ProductImage
+        caches["responses"].clear()
+        self.category = Category.objects.create(name="Pumps")
+        self.products = []
+        for i in range(5):
+            product = Product.objects.create(
+                name=f"Pump {i}",
+                description="Centrifugal pump",
+                price=100 + i,
+                category=self.category,
+                quantity=5,
+                order=i if i < 2 else None,
+            )
+            for order in range(2):
+                ProductImage.objects.create(product=product, image_data=b"image-bytes", order=order)
+            self.products.append(product)
+
+    def test_product_list_queries(self):
+        # content version, count, page, primary images
+        with self.assertNumQueries(4):
+            response = self.client.get("/api/products/")
+        results = response.json()["results"]
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(p["primary_image"] for p in results))
+
+    def test_featured_products_queries(self):
+        # content version, ordered products + primary images, then unordered
+        # fill + primary images
+        with self.assertNumQueries(5):
+            response = self.client.get("/api/products/featured/")
+        self.assertEqual(len(response.json()), 3)
+
+    def test_related_products_queries(self):
+        from .related import RelatedProductsBuilder
+        RelatedProductsBuilder().rebuild()
+        # content version, related products, primary images
+        with self.assertNumQueries(3):
+            response = self.client.get(f"/api/products/{self.products[0].id}/related/")
+        self.assertEqual(len(response.json()), 3)
+
+    def test_product_search_queries(self):
+        # content version, matching products, primary images
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/products/search/", {"q": "pump"})
+        self.assertEqual(len(response.json()), 5)
+
+    def test_primary_image_url_without_prefetch(self):
+        from .serializers import ProductListSerializer
+        product = self.products[0]
+        primary = product.images.get(order=0)
+        data = ProductListSerializer(product).data
+        self.assertEqual(
+            data["primary_image"],
+            f"/api/products/{product.id}/image/{primary.id}/?size=card&v={primary.blob_sha256[:16]}",
+        )
+
+
+class ProductKeysetPaginationTestCase(TestCase):
+    """Cursor mode returns every product exactly once, in page-number order"""
+
+    def setUp(self):
+        from django.core.cache import caches
+        caches["responses"].clear()
+        self.category = Category.objects.create(name="Pumps")
+        # Duplicate names and prices exercise the primary key tie-break
+        for i in range(23):
+            Product.objects.create(
+                name=f"Pump {i % 4}",
+                description="Centrifugal pump",
+                price=100 + i % 3,
+                category=self.category,
+                quantity=5,
+                order=i if i % 2 else None,
+            )
+
+    def expected(self, ordering):
+        from django.db.models import F
+        field = ordering.lstrip("-")
+        descending = ordering.startswith("-")
+        expression = F(field).desc(nulls_last=True) if descending else F(field).asc(nulls_last=True)
+        queryset = Product.objects.filter(active=True).order_by(expression, "-pk" if descending else "pk")
+        return [str(pk) for pk in queryset.values_list("pk", flat=True)]
+
+    def walk(self, ordering):
+        response = self.client.get("/api/products/", {"pagination": "cursor", "ordering": ordering})
+        pages = [response.json()]
+        while pages[-1]["next"]:
+            pages.append(self.client.get(pages[-1]["next"]).json())
+        return pages
+
+    def test_forward_walk_matches_ordering(self):
+        for ordering in ["name", "-name", "price", "-price", "created_at", "-created_at", "order", "-order"]:
+            with self.subTest(ordering=ordering):
+                pages = self.walk(ordering)
+                self.assertEqual(len(pages), 2)
+                self.assertNotIn("count", pages[0])
+                ids = [p["id"] for page in pages for p in page["results"]]
+                self.assertEqual(ids, self.expected(ordering))
+
+    def test_previous_link_returns_previous_page(self):
+        for ordering in ["price", "-order"]:
+            with self.subTest(ordering=ordering):
+                first, second = self.walk(ordering)
+                self.assertIsNone(first["previous"])
+                back = self.client.get(second["previous"]).json()
+                self.assertEqual(back["results"], first["results"])
+                self.assertIsNone(back["previous"])
+
+    def test_order_puts_nulls_last_in_page_number_mode(self):
+        response = self.client.get("/api/products/", {"ordering": "order", "page": 2})
+        results = response.json()["results"]
+        self.assertIsNone(results[-1]["order"])
+        self.assertEqual(
+            [p["id"] for p in results],
+            self.expected("order")[15:],
+        )
+
+    def test_cursor_mode_skips_count(self):
+        first = self.client.get("/api/products/", {"pagination": "cursor"}).json()
+        # content version, page, primary images
+        with self.assertNumQueries(3):
+            self.client.get(first["next"])
+
+    def test_default_mode_is_page_number(self):
+        response = self.client.get("/api/products/")
+        self.assertEqual(response.json()["count"], 23)
+
+    def test_ranked_search_stays_in_page_number_mode(self):
+        response = self.client.get("/api/products/", {"pagination": "cursor", "search": "pump"})
+        self.assertEqual(response.json()["count"], 23)
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get("/api/products/", {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 404)
+
+
+class RelatedProductsTestCase(TestCase):
+    def setUp(self):
+        from decimal import Decimal
+        from analytics.models import ProductView, Visitor
+        from orders.models import Order, OrderItem
+
+        self.pumps = Category.objects.create(name="Pumps")
+        self.seals = Category.objects.create(name="Seals")
+
+        def product(name, category, tags=""):
+            return Product.objects.create(
+                name=name, description="Test", price=100, category=category, quantity=5, tags=tags
+            )
+
+        self.pump = product("A Pump", self.pumps, "centrifugal, water")
+        self.same_tags = product("B Pump", self.pumps, "centrifugal, water")
+        self.plain = product("C Pump", self.pumps)
+        self.co_viewed = product("Cartridge Seal", self.seals)
+        self.co_bought = product("Seal Kit", self.seals)
+        self.unrelated = product("Gasket", self.seals)
+
+        visitor = Visitor.objects.create(ip_address="127.0.0.1")
+        for session in ("s1", "s2"):
+            ProductView.objects.create(visitor=visitor, product=self.pump, session_id=session)
+            ProductView.objects.create(visitor=visitor, product=self.co_viewed, session_id=session)
+
+        order = Order.objects.create(
+            customer_email="test@example.com", customer_first_name="Test", customer_last_name="User",
+            billing_address_line1="123 Test St", billing_city="Test City", billing_state="ON",
+            billing_postal_code="12345", shipping_address_line1="123 Test St", shipping_city="Test City",
+            shipping_state="ON", shipping_postal_code="12345", subtotal=Decimal("200.00"),
+            tax_amount=Decimal("0.00"), total_amount=Decimal("200.00"), payment_method="card"
+        )
+        for item in (self.pump, self.co_bought):
+            OrderItem.objects.create(order=order, product=item, quantity=1, price=item.price)
+
+    def related_ids(self, product):
+        from .models import RelatedProduct
+        return list(RelatedProduct.objects.filter(product=product).values_list("related_id", flat=True))
+
+    def test_rebuild_ranks_signals(self):
+        from io import StringIO
+        from django.core.management import call_command
+        call_command("build_related_products", stdout=StringIO())
+
+        self.assertEqual(
+            self.related_ids(self.pump),
+            # tags + category (4.0), one co-purchase (2.77), two co-views (2.20), category fill
+            [self.same_tags.id, self.co_bought.id, self.co_viewed.id, self.plain.id],
+        )
+
+    def test_refresh_on_save_matches_rebuild(self):
+        from .related import RelatedProductsBuilder
+        self.pump.save()
+        refreshed = self.related_ids(self.pump)
+        RelatedProductsBuilder().rebuild()
+        self.assertEqual(refreshed, self.related_ids(self.pump))
+
+    def test_deactivated_product_loses_its_list(self):
+        from .related import RelatedProductsBuilder
+        RelatedProductsBuilder().rebuild()
+        self.pump.active = False
+        self.pump.save()
+        self.assertEqual(self.related_ids(self.pump), [])
+
+    def test_endpoint_reads_precomputed_order(self):
+        from .related import RelatedProductsBuilder
+        RelatedProductsBuilder().rebuild()
+        response = self.client.get(f"/api/products/{self.pump.id}/related/")
+        self.assertEqual(
+            [p["id"] for p in response.json()],
+            [str(self.same_tags.id), str(self.co_bought.id), str(self.co_viewed.id)],
+        )
+
+    def test_endpoint_falls_back_to_category_before_first_build(self):
+        from .models import RelatedProduct
+        RelatedProduct.objects.all().delete()
+        response = self.client.get(f"/api/products/{self.pump.id}/related/")
+        self.assertEqual([p["name"] for p in response.json()], ["B Pump", "C Pump"])
+
+    def test_endpoint_unknown_product(self):
+        import uuid
+        response = self.client.get(f"/api/products/{uuid.uuid4()}/related/")
+        self.assertEqual(response.status_code, 404)
+
+
+class CatalogSnapshotTestCase(TestCase):
+    def setUp(self):
+        from .snapshot import CatalogSnapshot
+        CatalogSnapshot.clear()
+        self.category = Category.objects.create(name="Pumps")
+        self.products = [
+            Product.objects.create(
+                name=f"Pump {i}", description="Test", price=100 + i, category=self.category, quantity=5
+            )
+            for i in range(3)
+        ]
+
+    def current(self):
+        from .snapshot import CatalogSnapshot
+        return CatalogSnapshot.current()
+
+    def test_records_mirror_products(self):
+        snapshot = self.current()
+        record = snapshot[str(self.products[1].id)]
+        self.assertEqual(record.name, "Pump 1")
+        self.assertEqual(record.price, 101)
+        self.assertEqual(record.category_name, "Pumps")
+        self.assertTrue(record.is_available)
+        self.assertIsNone(snapshot.get("not-a-uuid"))
+        with self.assertRaises(Product.DoesNotExist):
+            snapshot["00000000-0000-0000-0000-000000000000"]
+
+    def test_unchanged_catalog_costs_one_query(self):
+        self.current()
+        with self.assertNumQueries(1):
+            self.current()
+
+    def test_change_is_merged_incrementally(self):
+        self.current()
+        product = self.products[0]
+        product.quantity = 0
+        product.save()
+
+        snapshot = self.current()
+        self.assertFalse(snapshot[product.id].is_available)
+        self.assertEqual((snapshot.full_loads, snapshot.incremental_loads), (1, 1))
+
+    def test_category_rename_and_deletion(self):
+        self.current()
+        self.category.name = "Process Pumps"
+        self.category.save()
+        self.assertEqual(self.current()[self.products[0].id].category_name, "Process Pumps")
+
+        deleted = self.products[2]
+        deleted.delete()
+        snapshot = self.current()
+        self.assertNotIn(deleted.id, snapshot)
+        self.assertEqual(len(snapshot), 2)
+
+    def test_reports_memory_footprint(self):
+        stats = self.current().stats()
+        self.assertEqual(stats["products"], 3)
+        self.assertGreater(stats["memory_bytes"], 0)
+        self.assertGreater(stats["bytes_per_product"], 0)
+
+    def test_cart_validation_reads_snapshot(self):
+        items = [{"product_id": str(p.id), "quantity": 1, "price": str(p.price)} for p in self.products]
+        self.client.post("/api/orders/validate-cart/", {"items": items}, content_type="application/json")
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                "/api/orders/validate-cart/", {"items": items * 5}, content_type="application/json"
+            )
+        self.assertEqual(len(response.json()["valid_cart_items"]), 15)
+        self.assertFalse([q for q in queries.captured_queries if "products_product" in q["sql"]])
+
+
+class ProductMediaReferencesTestCase(TestCase):
+    """Product detail links to binary endpoints instead of inlining base64"""
+
+    def setUp(self):
+        from django.core.cache import caches
+        from .models import ProductAttachment, ProductImage
+        caches["responses"].clear()
+        self.category = Category.objects.create(name="Pumps")
+        self.product = Product.objects.create(
+            name="Pump", description="Test", price=100, category=self.category, quantity=5
+        )
+        self.image = ProductImage.objects.create(
+            product=self.product, image_data=b"image-bytes", content_type="image/jpeg", order=0
+        )
+        self.public = ProductAttachment.objects.create(
+            product=self.product, file_data=b"%PDF-public", filename="datasheet.pdf",
+            content_type="application/pdf", file_size=11, order=0,
+        )
+        self.private = ProductAttachment.objects.create(
+            product=self.product, file_data=b"%PDF-private", filename="pricing.pdf",
+            content_type="application/pdf", file_size=12, order=1, is_public=False,
+        )
+
+    def test_detail_links_to_endpoints(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(f"/api/products/{self.product.id}/").json()
+
+        self.assertEqual(
+            data["images"][0]["image_url"],
+            f"/api/products/{self.product.id}/image/{self.image.id}/?size=detail&v={self.image.blob_sha256[:16]}",
+        )
+        self.assertEqual(
+            [a["data_url"] for a in data["attachments"]],
+            [f"/api/products/{self.product.id}/attachments/{self.public.id}/?v={self.public.blob_sha256[:16]}"],
+        )
+        self.assertFalse([q for q in queries.captured_queries if "image_data" in q["sql"] or "file_data" in q["sql"]])
+
+    def test_inline_media_is_opt_in(self):
+        data = self.client.get(f"/api/products/{self.product.id}/", {"inline_media": "true"}).json()
+        self.assertTrue(data["images"][0]["image_url"].startswith("data:image/jpeg;base64,"))
+        self.assertTrue(data["attachments"][0]["data_url"].startswith("data:application/pdf;base64,"))
+
+    def test_attachment_download(self):
+        response = self.client.get(f"/api/products/{self.product.id}/attachments/{self.public.id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"%PDF-public")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="datasheet.pdf"')
+        self.assertIn("public", response["Cache-Control"])
+
+        revalidated = self.client.get(
+            f"/api/products/{self.product.id}/attachments/{self.public.id}/",
+            HTTP_IF_NONE_MATCH=response["ETag"],
+        )
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_replaced_image_is_not_revalidated(self):
+        url = f"/api/products/{self.product.id}/image/{self.image.id}/"
+        etag = self.client.get(url)["ETag"]
+
+        # The admin replaces image_data in place; same size, different bytes
+        self.image.image_data = b"other-bytes"
+        self.image.save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(b"".join(response.streaming_content), b"other-bytes")
+
+    def test_private_attachment_only_for_staff(self):
+        from django.contrib.auth.models import User
+        url = f"/api/products/{self.product.id}/attachments/{self.private.id}/"
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        self.client.force_login(User.objects.create_user("staff", password="secret", is_staff=True))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("private", response["Cache-Control"])
+        data = self.client.get(f"/api/products/{self.product.id}/").json()
+        self.assertEqual(len(data["attachments"]), 2)
+
+    def test_attachment_of_other_product_not_found(self):
+        other = Product.objects.create(name="Other", description="x", price=1, category=self.category)
+        response = self.client.get(f"/api/products/{other.id}/attachments/{self.public.id}/")
+        self.assertEqual(response.status_code, 404)
+
+
+class AttachmentRangeTestCase(TestCase):
+    def setUp(self):
+        from .models import ProductAttachment
+        self.category = Category.objects.create(name="Pumps")
+        self.product = Product.objects.create(
+            name="Pump", description="Test", price=100, category=self.category, quantity=5
+        )
+        # Larger than one stream chunk
+        self.data = bytes(range(256)) * 1024
+        self.attachment = ProductAttachment.objects.create(
+            product=self.product, file_data=self.data, filename="manual.pdf",
+            content_type="application/pdf", file_size=len(self.data),
+        )
+        self.url = f"/api/products/{self.product.id}/attachments/{self.attachment.id}/"
+
+    def body(self, response):
+        return b"".join(response.streaming_content)
+
+    def test_full_download_streams_in_chunks(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Length"], str(len(self.data)))
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b"".join(chunks), self.data)
+
+    def test_range_requests(self):
+        cases = {
+            "bytes=0-99": (0, 99),
+            "bytes=1000-": (1000, len(self.data) - 1),
+            "bytes=-500": (len(self.data) - 500, len(self.data) - 1),
+            "bytes=200000-999999": (200000, len(self.data) - 1),
+        }
+        for header, (start, end) in cases.items():
+            with self.subTest(header=header):
+                response = self.client.get(self.url, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response["Content-Range"], f"bytes {start}-{end}/{len(self.data)}")
+                self.assertEqual(self.body(response), self.data[start:end + 1])
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, HTTP_RANGE=f"bytes={len(self.data)}-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], f"bytes */{len(self.data)}")
+
+    def test_multiple_ranges_get_full_body(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-1,5-6")
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_range(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.assertFalse(etag.startswith("W/"))
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+
+        # The file changed since the client's partial copy: send it whole
+        self.attachment.file_data = b"replacement"
+        self.attachment.save()
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), b"replacement")
+
+    def test_not_modified_skips_blob(self):
+        import re
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        etag = self.client.get(self.url)["ETag"]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        for query in queries.captured_queries:
+            sql = re.sub(r"LENGTH\([^)]*\)", "", query["sql"])
+            self.assertNotIn("file_data", sql)
+
+    def test_head_has_length_without_body(self):
+        response = self.client.head(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Length"], str(len(self.data)))
+        self.assertEqual(response.content, b"")
+
+
+class ProductSpecIndexTestCase(TestCase):
+    def setUp(self):
+        from django.core.cache import caches
+        from .models import ProductSpecification
+        caches["responses"].clear()
+        self.category = Category.objects.create(name="Pumps")
+        specs = {
+            "Small Pump": {"Flow Rate": "150 GPM", "Power": "5 HP", "Material": "Cast Iron"},
+            "Medium Pump": {"Flow Rate": "90 m3/h", "Power": "15 kW"},
+            "Large Pump": {"Flow Rate": "400-600 GPM", "Power": "50 HP", "Inlet Size": "150 mm"},
+        }
+        self.products = {}
+        for name, values in specs.items():
+            product = Product.objects.create(
+                name=name, description="Pump", price=100, category=self.category, quantity=1
+            )
+            for key, value in values.items():
+                ProductSpecification.objects.create(product=product, key=key, value=value)
+            self.products[name] = product
+
+    def names(self, **params):
+        response = self.client.get("/api/products/", params)
+        return sorted(p["name"] for p in response.json()["results"])
+
+    def test_parse_quantity(self):
+        from .specs import parse_quantity
+        self.assertEqual(parse_quantity("500 GPM"), (500.0, 500.0, "gpm"))
+        self.assertEqual(parse_quantity("1-1/2 inches"), (1.5, 1.5, "in"))
+        self.assertEqual(parse_quantity('2"'), (2.0, 2.0, "in"))
+        self.assertEqual(parse_quantity("480V"), (480.0, 480.0, "v"))
+        self.assertEqual(parse_quantity("1,750 RPM"), (1750.0, 1750.0, "rpm"))
+        self.assertEqual(parse_quantity("10 bar"), (145.038, 145.038, "psi"))
+        self.assertEqual(parse_quantity("45 m head"), (147.6378, 147.6378, "ft"))
+        self.assertEqual(parse_quantity("12"), (12.0, 12.0, ""))
+        for text in ("Stainless Steel", "326T", "400°F", "", None):
+            self.assertIsNone(parse_quantity(text), text)
+
+    def test_values_are_indexed_on_save(self):
+        from .models import ProductSpecValue
+        medium = ProductSpecValue.objects.get(product=self.products["Medium Pump"], key="flow_rate")
+        self.assertEqual(medium.unit, "gpm")
+        self.assertAlmostEqual(medium.min_value, 396.258, places=2)
+        self.assertFalse(ProductSpecValue.objects.filter(key="material").exists())
+
+        spec = medium.specification
+        spec.value = "Variable"
+        spec.save()
+        self.assertFalse(ProductSpecValue.objects.filter(pk=spec.pk).exists())
+        spec.value = "100 GPM"
+        spec.save()
+        self.assertEqual(ProductSpecValue.objects.get(pk=spec.pk).max_value, 100.0)
+
+    def test_range_filters(self):
+        self.assertEqual(self.names(spec_flow_rate_min=400), ["Large Pump"])
+        # 90 m3/h is about 396 GPM
+        self.assertEqual(self.names(spec_flow_rate_min=300), ["Large Pump", "Medium Pump"])
+        self.assertEqual(self.names(spec_flow_rate_min=300, spec_power_max=25), ["Medium Pump"])
+        # Bounds with a unit are converted; 89 m3/h is about 392 GPM
+        self.assertEqual(self.names(spec_flow_rate_max="89 m3/h"), ["Small Pump"])
+        # Ranges match when they overlap the requested one
+        self.assertEqual(self.names(spec_flow_rate_min=550), ["Large Pump"])
+        self.assertEqual(self.names(spec_inlet_size_min=5), ["Large Pump"])
+        # Unparsable bounds are ignored
+        self.assertEqual(len(self.names(spec_power_min="lots")), 3)
+
+    def test_facets_in_one_query(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get("/api/products/", {"facets": "1", "spec_power_min": 10}).json()
+        facet_queries = [q for q in queries.captured_queries if "products_productspecvalue" in q["sql"]
+                         and "GROUP BY" in q["sql"]]
+        self.assertEqual(len(facet_queries), 1)
+        facets = {facet["key"]: facet for facet in data["facets"]}
+        self.assertEqual(facets["flow_rate"]["count"], 2)
+        self.assertEqual(facets["flow_rate"]["unit"], "GPM")
+        self.assertEqual(facets["flow_rate"]["max"], 600.0)
+        self.assertEqual(facets["power"]["name"], "Power")
+        self.assertEqual(facets["inlet_size"]["count"], 1)
+        self.assertNotIn("facets", self.client.get("/api/products/").json())
+
+    def test_rebuild_command(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import ProductSpecValue
+        ProductSpecValue.objects.all().delete()
+        out = StringIO()
+        call_command("rebuild_spec_index", stdout=out)
+        self.assertIn("Indexed 7 numeric specification values", out.getvalue())
+        self.assertEqual(ProductSpecValue.objects.count(), 7)
+
+
+class ProductTagTestCase(TestCase):
+    def setUp(self):
+        from django.core.cache import caches
+        caches["responses"].clear()
+        self.category = Category.objects.create(name="Pumps")
+        self.other = Category.objects.create(name="Seals")
+
+        def product(name, tags, category=None):
+            return Product.objects.create(
+                name=name, description="Test", price=100, category=category or self.category,
+                quantity=1, tags=tags,
+            )
+
+        self.steel = product("Steel Pump", "Stainless Steel, centrifugal")
+        self.iron = product("Iron Pump", "cast iron, Centrifugal, centrifugal")
+        self.seal = product("Seal", "steel, seal", self.other)
+
+    def names(self, **params):
+        return sorted(p["name"] for p in self.client.get("/api/products/", params).json()["results"])
+
+    def test_tags_are_normalized_on_save(self):
+        from .models import Tag
+        self.assertEqual(
+            list(self.iron.tag_set.order_by("product_tags__position").values_list("slug", flat=True)),
+            ["cast-iron", "centrifugal"],
+        )
+        self.assertEqual(Tag.objects.get(slug="stainless-steel").name, "Stainless Steel")
+        self.assertEqual(self.iron.tags_list, ["cast iron", "Centrifugal"])
+
+        self.iron.tags = "cast iron"
+        self.iron.save()
+        self.assertEqual(list(self.iron.tag_set.values_list("slug", flat=True)), ["cast-iron"])
+
+    def test_filter_matches_whole_tags(self):
+        # "steel" no longer matches "Stainless Steel"
+        self.assertEqual(self.names(tags="steel"), ["Seal"])
+        self.assertEqual(self.names(tags="Stainless Steel"), ["Steel Pump"])
+        self.assertEqual(self.names(tags="centrifugal,cast-iron"), ["Iron Pump"])
+        self.assertEqual(self.names(tags="centrifugal", category=self.category.id), ["Iron Pump", "Steel Pump"])
+        self.assertEqual(self.names(tags="unknown"), [])
+
+    def test_facets_follow_the_filters_in_one_query(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            facets = self.client.get("/api/products/tags/", {"category_name": "Pumps"}).json()
+        self.assertEqual(
+            [(f["slug"], f["count"]) for f in facets],
+            [("centrifugal", 2), ("cast-iron", 1), ("stainless-steel", 1)],
+        )
+        self.assertEqual(len([q for q in queries.captured_queries if "products_producttag" in q["sql"]]), 1)
+
+        facets = self.client.get("/api/products/tags/", {"tags": "centrifugal", "limit": 1}).json()
+        # The first spelling seen names the tag
+        self.assertEqual(facets, [{"slug": "centrifugal", "name": "centrifugal", "count": 2}])
+
+    def test_deleting_a_product_removes_its_tags(self):
+        from .models import ProductTag
+        self.seal.delete()
+        self.assertFalse(ProductTag.objects.filter(tag__slug="seal").exists())
+
+
+class ProductSuggestTestCase(TestCase):
+    def setUp(self):
+        from .suggest import SuggestIndex
+        SuggestIndex.clear()
+        self.addCleanup(SuggestIndex.clear)
+        self.pumps = Category.objects.create(name="Pumps")
+        self.pump = Product.objects.create(
+            name="Industrial Centrifugal Pump", description="Test", price=100, category=self.pumps,
+            quantity=1, tags="stainless steel",
+        )
+        Product.objects.create(
+            name="Hidden Pump", description="Test", price=100, category=self.pumps, quantity=1, active=False,
+        )
+
+    def suggest(self, q, **params):
+        response = self.client.get("/api/products/suggest/", {"q": q, **params})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("suggest;dur=", response["Server-Timing"])
+        return [(s["type"], s["text"]) for s in response.json()["suggestions"]]
+
+    def test_matches_word_starts(self):
+        self.assertEqual(self.suggest("centri"), [("product", "Industrial Centrifugal Pump")])
+        self.assertEqual(self.suggest("Centrifugal  PU"), [("product", "Industrial Centrifugal Pump")])
+        self.assertEqual(self.suggest("trifugal"), [])
+        self.assertEqual(self.suggest("hidden"), [])
+        self.assertEqual(self.suggest(""), [])
+
+    def test_suggests_categories_tags_manufacturers_and_popular_queries(self):
+        from analytics.models import SearchQuery, Visitor
+        from equipment.models import Manufacturer
+        Manufacturer.objects.create(label="Stanley Pumps")
+        visitor = Visitor.objects.create(ip_address="127.0.0.1")
+        for query, results in [
+            ("stainless pump", 3), ("stainless pump", 1), ("Stainless  Pump", 2), ("stainless zzz", 0), ("stainless zzz", 0),
+        ]:
+            SearchQuery.objects.create(visitor=visitor, query=query, results_count=results)
+
+        # Spellings of a query are counted together; the most common one is shown
+        self.assertEqual(self.suggest("sta"), [
+            ("query", "stainless pump"),
+            ("tag", "stainless steel"),
+            ("manufacturer", "Stanley Pumps"),
+        ])
+        self.assertEqual(set(self.suggest("pump", limit=3)), {
+            ("category", "Pumps"), ("query", "stainless pump"), ("manufacturer", "Stanley Pumps"),
+        })
+        self.assertEqual(len(self.suggest("pump", limit=1)), 1)
+
+    def test_rebuilds_when_the_catalog_changes(self):
+        from unittest import mock
+        self.assertEqual(self.suggest("gear"), [])
+        Product.objects.create(
+            name="Gear Pump", description="Test", price=100, category=self.pumps, quantity=1,
+        )
+        with mock.patch("products.suggest.VERSION_CHECK_INTERVAL", 0):
+            self.assertEqual(self.suggest("gear"), [("product", "Gear Pump")])
+
+    def test_stock_changes_do_not_rebuild(self):
+        from unittest import mock
+        from .suggest import SuggestIndex
+        self.suggest("pump")
+        builds = SuggestIndex.current().builds
+
+        self.pump.quantity = 0
+        self.pump.save()
+        self.pump.reduce_quantity(0)
+        with mock.patch("products.suggest.VERSION_CHECK_INTERVAL", 0):
+            self.assertEqual(SuggestIndex.current().builds, builds)
+
+            self.pump.name = "Industrial Gear Pump"
+            self.pump.save()
+            self.assertEqual(self.suggest("gear"), [("product", "Industrial Gear Pump")])
+            self.assertEqual(SuggestIndex.current().builds, builds + 1)
+
+    def test_previous_index_is_served_while_rebuilding(self):
+        import threading
+        from unittest import mock
+        from .suggest import SuggestIndex
+        old = SuggestIndex.current()
+
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_collect():
+            started.set()
+            release.wait(5)
+            return iter([("Gear Pump", "product", "1", 0)])
+
+        rebuilt = []
+        with mock.patch("products.suggest.VERSION_CHECK_INTERVAL", 0), \
+                mock.patch("products.suggest.get_version", return_value="changed"), \
+                mock.patch.object(SuggestIndex, "collect", staticmethod(slow_collect)):
+            builder = threading.Thread(target=lambda: rebuilt.append(SuggestIndex.current()))
+            builder.start()
+            self.assertTrue(started.wait(5))
+            # Not blocked by the build in progress
+            self.assertIs(SuggestIndex.current(), old)
+            release.set()
+            builder.join(5)
+
+        self.assertIsNot(rebuilt[0], old)
+        self.assertIs(SuggestIndex.current(), rebuilt[0])
+        self.assertEqual([s.text for s in rebuilt[0].suggest("gear")], ["Gear Pump"])
+
+    def test_hot_prefixes_match_a_full_scan(self):
+        from unittest import mock
+        from .suggest import SuggestIndex
+        items = [(f"Pump {i:03d} {'ab'[i % 2]}", "product", str(i), 0) for i in range(300)]
+        items += [("Pump", "category", 1, 300), ("Pumping station", "tag", "pumping-station", 12)]
+        with mock.patch("products.suggest.HOT_PREFIX_KEYS", 16):
+            index = SuggestIndex()
+            index.build(iter(items), stamp="test")
+        self.assertIn("pump", index.hot)
+        self.assertIn("p", index.hot)
+        for prefix in ["p", "pum", "pump", "pump ", "pump 1", "a", "b"]:
+            hot = [s.text for s in index.suggest(prefix, 20)]
+            index.hot = {}
+            scanned = [s.text for s in index.suggest(prefix, 20)]
+            index.hot = index._rank_hot_prefixes()
+            self.assertEqual(hot, scanned, prefix)
+        self.assertEqual([s.text for s in index.suggest("pump", 2)], ["Pump", "Pumping station"])
+
+
+class ProductFuzzySearchTestCase(TestCase):
+    def setUp(self):
+        from .fuzzy import TrigramIndex
+        from .models import ProductSpecification
+        TrigramIndex.clear()
+        self.addCleanup(TrigramIndex.clear)
+        self.pumps = Category.objects.create(name="Pumps")
+        self.blower = Product.objects.create(
+            name="Regenerative Blower 125CFM", description="Side channel blower", price=100,
+            category=self.pumps, quantity=1, tags="blower",
+        )
+        self.pump = Product.objects.create(
+            name="Centrifugal Pump", description="Process pump", price=100,
+            category=self.pumps, quantity=1, tags="stainless steel",
+        )
+        ProductSpecification.objects.create(product=self.pump, key="Model", value="6020")
+
+    def search(self, query, **params):
+        response = self.client.get("/api/products/search/", {"q": query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.get("X-Search-Mode"), [p["name"] for p in response.json()]
+
+    def test_similarity(self):
+        from .fuzzy import similarity, trigrams
+        self.assertEqual(trigrams("ab"), {"  a", " ab", "ab "})
+        self.assertEqual(similarity("6020", "6020"), 1.0)
+        self.assertAlmostEqual(similarity("125cmf", "125cfm"), 0.4)
+        self.assertEqual(similarity("6020", "pump"), 0.0)
+
+    def test_mistyped_words_fall_back_to_similar_ones(self):
+        self.assertEqual(self.search("125CMF"), ("fuzzy", ["Regenerative Blower 125CFM"]))
+        self.assertEqual(self.search("model 6021"), ("fuzzy", ["Centrifugal Pump"]))
+        self.assertEqual(self.search("stainles steal"), ("fuzzy", ["Centrifugal Pump"]))
+        self.assertEqual(self.search("6021", category="Seals"), (None, []))
+        self.assertEqual(self.search("zzzz"), (None, []))
+
+    def test_exact_matches_do_not_use_the_fallback(self):
+        self.assertEqual(self.search("6020"), (None, ["Centrifugal Pump"]))
+
+    def test_results_are_ranked_by_similarity(self):
+        from .fuzzy import FuzzySearch
+        Product.objects.create(
+            name="Centrifugal Pump 6025", description="Test", price=100, category=self.pumps, quantity=1,
+        )
+        results = list(FuzzySearch.search(Product.objects.all(), "60201"))
+        self.assertEqual([p.name for p in results], ["Centrifugal Pump", "Centrifugal Pump 6025"])
+        self.assertGreater(results[0].similarity, results[1].similarity)
+
+        # A higher threshold drops the weaker match
+        threshold = (results[0].similarity + results[1].similarity) / 2
+        self.assertEqual(list(FuzzySearch.search(Product.objects.all(), "60201", threshold)), [self.pump])
+
+    def test_vocabulary_follows_the_catalog(self):
+        self.assertEqual(self.search("turbin"), (None, []))
+        self.pump.name = "Vertical Turbine"
+        self.pump.save()
+        from unittest import mock
+        with mock.patch("products.fuzzy.VERSION_CHECK_INTERVAL", 0):
+            self.assertEqual(self.search("turbnie"), ("fuzzy", ["Vertical Turbine"]))
+
+
+class ProductBatchTestCase(TestCase):
+    def setUp(self):
+        from .models import ProductImage
+        self.pumps = Category.objects.create(name="Pumps")
+        self.products = [
+            Product.objects.create(
+                name=f"Pump {i}", description="Test", price=100 + i, category=self.pumps, quantity=i,
+            )
+            for i in range(5)
+        ]
+        for product in self.products:
+            ProductImage.objects.create(product=product, image_data=b"x", filename="a.jpg", order=0)
+
+    def test_returns_products_in_requested_order_in_fixed_queries(self):
+        import uuid
+        missing = uuid.uuid4()
+        self.products[4].active = False
+        self.products[4].save()
+        ids = [self.products[3].id, self.products[0].id, missing, self.products[4].id, self.products[3].id]
+
+        # content version, products, primary images
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/products/batch/", {"ids": ",".join(str(pk) for pk in ids)})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([p["name"] for p in data["results"]], ["Pump 3", "Pump 0"])
+        self.assertEqual(data["missing"], [str(missing), str(self.products[4].id)])
+        self.assertIn("/image/", data["results"][0]["primary_image"])
+
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/products/batch/", {"ids": [str(p.id) for p in self.products[:4]]})
+        self.assertEqual(len(response.json()["results"]), 4)
+
+    def test_selected_fields(self):
+        # No category join and no image query; POST skips the version check
+        with self.assertNumQueries(1):
+            response = self.client.post(
+                "/api/products/batch/",
+                {"ids": [str(self.products[1].id)], "fields": ["id", "name", "price", "quantity", "bogus"]},
+                content_type="application/json",
+            )
+        self.assertEqual(response.json()["results"], [
+            {"id": str(self.products[1].id), "name": "Pump 1", "price": "101.00", "quantity": 1},
+        ])
+
+        response = self.client.get(
+            "/api/products/batch/", {"ids": str(self.products[1].id), "fields": "name,primary_image"}
+        )
+        self.assertEqual(set(response.json()["results"][0]), {"name", "primary_image"})
+
+    def test_invalid_requests(self):
+        from .views import BATCH_LIMIT
+        import uuid
+        self.assertEqual(self.client.get("/api/products/batch/", {"ids": "nope"}).status_code, 400)
+        ids = ",".join(str(uuid.uuid4()) for _ in range(BATCH_LIMIT + 1))
+        self.assertEqual(self.client.get("/api/products/batch/", {"ids": ids}).status_code, 400)
+        response = self.client.get("/api/products/batch/")
+        self.assertEqual(response.json(), {"results": [], "missing": []})
+
+
+class SparseFieldsetTestCase(TestCase):
+    def setUp(self):
+        from django.core.cache import caches
+        from .models import ProductAttachment, ProductImage, ProductSpecification
+        caches["responses"].clear()
+        self.pumps = Category.objects.create(name="Pumps")
+        self.product = Product.objects.create(
+            name="Pump", description="Test", price=100, category=self.pumps, quantity=2, tags="a, b",
+        )
+        ProductImage.objects.create(product=self.product, image_data=b"x", filename="a.jpg", order=0)
+        ProductSpecification.objects.create(product=self.product, key="Model", value="6020")
+        ProductAttachment.objects.create(
+            product=self.product, file_data=b"pdf", filename="a.pdf", content_type="application/pdf", file_size=3,
+        )
+
+    def test_list_fields_prune_joins_and_prefetches(self):
+        # content version, count, page
+        with self.assertNumQueries(3) as queries:
+            response = self.client.get("/api/products/", {"fields": "id,name,price"})
+        self.assertNotIn("products_category", queries.captured_queries[-1]["sql"])
+        self.assertEqual(response.json()["results"], [{"id": str(self.product.id), "name": "Pump", "price": "100.00"}])
+
+        # Without expand the category is its id, still without a join
+        with self.assertNumQueries(3) as queries:
+            response = self.client.get("/api/products/", {"fields": "name,category", "expand": ""})
+        self.assertNotIn("products_category", queries.captured_queries[-1]["sql"])
+        self.assertEqual(response.json()["results"], [{"name": "Pump", "category": self.pumps.id}])
+
+        response = self.client.get("/api/products/", {"fields": "name,category", "expand": "category"})
+        self.assertEqual(response.json()["results"][0]["category"]["name"], "Pumps")
+
+    def test_detail_prefetches_only_expanded_relations(self):
+        url = f"/api/products/{self.product.id}/"
+        # content version, product + category, images, specifications, attachments
+        with self.assertNumQueries(5):
+            full = self.client.get(url).json()
+        self.assertEqual(len(full["images"]), 1)
+        self.assertEqual(len(full["attachments"]), 1)
+
+        # content version, product
+        with self.assertNumQueries(2):
+            data = self.client.get(url, {"expand": ""}).json()
+        self.assertEqual(data["category"], self.pumps.id)
+        self.assertNotIn("images", data)
+        self.assertNotIn("attachments", data)
+
+        with self.assertNumQueries(3):
+            data = self.client.get(url, {"fields": "name,specifications"}).json()
+        self.assertEqual(set(data), {"name", "specifications"})
+        self.assertEqual(data["specifications"][0]["value"], "6020")
+
+    def test_function_views_accept_fields(self):
+        for url in ["/api/products/featured/", "/api/products/search/?q=pump", f"/api/products/{self.product.id}/related/"]:
+            with self.subTest(url=url):
+                response = self.client.get(url, {"fields": "id,name"})
+                self.assertEqual(response.status_code, 200)
+                for product in response.json():
+                    self.assertEqual(set(product), {"id", "name"})
@@ -6,9 +6,14 @@ urlpatterns = [
     path('products/', views.ProductListView.as_view(), name='product-list'),
     path('products/<uuid:pk>/', views.ProductDetailView.as_view(), name='product-detail'),
     path('products/<uuid:product_id>/image/<int:image_id>/', views.ProductImageView.as_view(), name='product-image'),
+    path('products/<uuid:product_id>/attachments/<int:attachment_id>/', views.ProductAttachmentView.as_view(), name='product-attachment'),
     path('products/<uuid:product_id>/related/', views.related_products, name='related-products'),
     path('products/featured/', views.featured_products, name='featured-products'),
+    path('products/batch/', views.product_batch, name='product-batch'),
     path('products/search/', views.product_search, name='product-search'),
+    path('products/suggest/', views.product_suggest, name='product-suggest'),
+    path('products/tags/', views.ProductTagFacetView.as_view(), name='product-tag-facets'),
+    path('products/snapshot/stats/', views.catalog_snapshot_stats, name='catalog-snapshot-stats'),
     path('products/<uuid:product_id>/upload-image/', views.upload_product_image, name='upload-product-image'),
     path('products/import-csv/', views.import_products_csv, name='import-products-csv'),
     
@@ -1,11 +1,15 @@
 from rest_framework import generics, filters, status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from django.utils.decorators import method_decorator
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Q, Prefetch
+from django.db.models import F
 import logging
 import gc
+import time
+import uuid
 
 logger = logging.getLogger(__name__)
 from .models import Category, Product, ProductImage, ProductAttachment
@@ -13,9 +17,42 @@ from .serializers import (
     CategorySerializer, 
     ProductListSerializer, 
     ProductDetailSerializer,
-    ProductImageUploadSerializer
+    ProductImageUploadSerializer,
+    requested_fields,
+    wants_inline_media,
 )
+from .filters import ProductSearchFilter, ProductSpecFilter, ProductTagFilter
+from .fuzzy import FuzzySearch
+from .pagination import ProductCursorPagination
+from .search import ProductSearchIndex
+from .snapshot import CatalogSnapshot
+from .specs import FACETS_PARAM, SpecIndex
+from .suggest import DEFAULT_LIMIT as SUGGEST_LIMIT, SuggestIndex
+from .tags import ProductTags
+from core.blobs import BlobServer, IgnoreClientContentNegotiation
+from core.caching import cache_response
+from core.conditional import condition_on_version
 
+product_image_server = BlobServer(ProductImage, 'image_data', default_content_type='image/jpeg')
+product_attachment_server = BlobServer(
+    ProductAttachment, 'file_data', extra_fields=('is_public',),
+    cache_control=lambda attachment: 'public, no-cache' if attachment.is_public else 'private, no-cache',
+    as_attachment=True, stream=True,
+)
+
+class SelectableFieldsViewMixin:
+    """
+    Hands ``?fields=`` and ``?expand=`` to the serializer (see
+    ``SelectableFieldsMixin``); ``get_queryset`` should prune the queryset
+    with the serializer's ``optimize_queryset``
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        fields, expand = requested_fields(self.request.query_params)
+        return super().get_serializer(*args, fields=fields, expand=expand, **kwargs)
+
+@method_decorator(condition_on_version('products'), name='dispatch')
+@method_decorator(cache_response('products'), name='dispatch')
 class CategoryListView(APIView):
     """
     List all categories without pagination
@@ -25,24 +62,48 @@ class CategoryListView(APIView):
         serializer = CategorySerializer(categories, many=True)
         return Response(serializer.data)
 
-class ProductListView(generics.ListAPIView):
-    queryset = Product.objects.filter(active=True).select_related('category')
+@method_decorator(condition_on_version('products'), name='dispatch')
+@method_decorator(cache_response('products'), name='dispatch')
+class ProductListView(SelectableFieldsViewMixin, generics.ListAPIView):
+    queryset = Product.objects.filter(active=True)
     serializer_class = ProductListSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    # ProductSearchFilter runs last so it can order by relevance
+    filter_backends = [
+        DjangoFilterBackend, ProductTagFilter, ProductSpecFilter, filters.OrderingFilter, ProductSearchFilter,
+    ]
     filterset_fields = ['category']  # Removed 'page' to avoid conflict with pagination
     search_fields = ['name', 'description', 'tags']
     ordering_fields = ['name', 'price', 'created_at', 'order']
     ordering = ['name']
 
+    @property
+    def paginator(self):
+        """
+        Page-number pagination by default; keyset pagination when the client
+        opts in with ?pagination=cursor (or follows a cursor link).
+        """
+        if not hasattr(self, '_paginator'):
+            if (ProductCursorPagination.is_requested(self.request)
+                    and ProductCursorPagination.supports(self.request)):
+                self._paginator = ProductCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
     def list(self, request, *args, **kwargs):
         logger.info(f"ProductListView called. Memory before: {gc.get_stats()}")
         response = super().list(request, *args, **kwargs)
+        if request.query_params.get(FACETS_PARAM, '').lower() in ('1', 'true', 'yes'):
+            # Facets describe every match, not just this page
+            response.data['facets'] = SpecIndex.facets(self.filter_queryset(self.get_queryset()))
         logger.info(f"ProductListView finished. Memory after: {gc.get_stats()}")
         gc.collect()  # Force garbage collection
         return response
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = ProductListSerializer.optimize_queryset(
+            super().get_queryset(), *requested_fields(self.request.query_params)
+        )
         
         # Custom filtering
         category_name = self.request.query_params.get('category_name', None)
@@ -62,21 +123,56 @@ class ProductListView(generics.ListAPIView):
         if max_price:
             queryset = queryset.filter(price__lte=max_price)
         
-        # Handle ordering by 'order' field with null values last
+        return queryset
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+
+        # Handle ordering by 'order' field with null values last. This has to
+        # run after OrderingFilter, which would otherwise put nulls first.
         ordering = self.request.query_params.get('ordering', None)
         if ordering == 'order':
-            from django.db.models import F
-            queryset = queryset.order_by(F('order').asc(nulls_last=True))
+            queryset = queryset.order_by(F('order').asc(nulls_last=True), 'pk')
         elif ordering == '-order':
-            from django.db.models import F
-            queryset = queryset.order_by(F('order').desc(nulls_last=True))
-            
+            queryset = queryset.order_by(F('order').desc(nulls_last=True), '-pk')
+
         return queryset
 
-class ProductDetailView(generics.RetrieveAPIView):
-    queryset = Product.objects.filter(active=True).select_related('category').prefetch_related('images', 'specifications', 'attachments')
+class ProductTagFacetView(ProductListView):
+    """
+    Tag counts for the products the product list would return with the same
+    query parameters (category, price, search, spec and tag filters), in
+    one aggregate query. ``?limit=`` caps the number of tags. Versioning and
+    response caching come with the inherited ``dispatch``.
+    """
+
+    def list(self, request, *args, **kwargs):
+        try:
+            limit = max(int(request.query_params.get('limit', 0)), 0)
+        except ValueError:
+            limit = 0
+        return Response(ProductTags.facets(self.filter_queryset(self.get_queryset()), limit=limit or None))
+
+@method_decorator(condition_on_version('products'), name='dispatch')
+@method_decorator(cache_response('products'), name='dispatch')
+class ProductDetailView(SelectableFieldsViewMixin, generics.RetrieveAPIView):
+    queryset = Product.objects.filter(active=True)
     serializer_class = ProductDetailSerializer
 
+    def get_queryset(self):
+        return ProductDetailSerializer.optimize_queryset(
+            super().get_queryset(), *requested_fields(self.request.query_params),
+            inline_media=wants_inline_media(self.request),
+            private_attachments=self.request.user.is_staff,
+        )
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['inline_media'] = wants_inline_media(self.request)
+        return context
+
+@condition_on_version('products')
+@cache_response('products')
 @api_view(['GET'])
 def featured_products(request):
     """
@@ -84,53 +180,69 @@ def featured_products(request):
     """
     from django.db.models import F
 
+    fields, expand = requested_fields(request.query_params)
+    products = ProductListSerializer.optimize_queryset(Product.objects.filter(active=True), fields, expand)
+
     # Get products with order values first (ascending), then limit to 3
-    featured = Product.objects.filter(
-        active=True,
+    featured = products.filter(
         order__isnull=False  # Only products with order values
-    ).select_related('category').prefetch_related('images').order_by('order')[:3]
+    ).order_by('order')[:3]
+
+    featured_list = list(featured)
 
     # If we don't have 3 products with order values, fill with products without order
-    if featured.count() < 3:
-        remaining_count = 3 - featured.count()
-        additional = Product.objects.filter(
-            active=True,
+    if len(featured_list) < 3:
+        remaining_count = 3 - len(featured_list)
+        additional = products.filter(
             order__isnull=True
-        ).select_related('category').prefetch_related('images').order_by('name')[:remaining_count]
+        ).order_by('name')[:remaining_count]
 
         # Combine the results
-        featured_list = list(featured) + list(additional)
-    else:
-        featured_list = list(featured)
+        featured_list += list(additional)
 
-    serializer = ProductListSerializer(featured_list, many=True, context={'request': request})
+    serializer = ProductListSerializer(
+        featured_list, many=True, fields=fields, expand=expand, context={'request': request}
+    )
     return Response(serializer.data)
 
+@condition_on_version('products')
 @api_view(['GET'])
 def related_products(request, product_id):
     """
-    Get related products from the same category as the specified product
+    Get related products for the specified product, best match first.
+
+    Reads the precomputed RelatedProduct table (see products.related); the
+    product itself is only looked up when it has no related entries.
     """
-    try:
-        product = Product.objects.filter(active=True).get(id=product_id)
-    except Product.DoesNotExist:
-        return Response(
-            {'error': 'Product not found'}, 
-            status=status.HTTP_404_NOT_FOUND
-        )
-    
-    # Get products from the same category, excluding the current product
-    related = Product.objects.filter(
-        active=True,
-        category=product.category
-    ).exclude(id=product_id).select_related('category').prefetch_related('images')
-    
-    # Randomly order the results and limit to 3
-    related = related.order_by('?')[:3]
-    
-    serializer = ProductListSerializer(related, many=True, context={'request': request})
+    fields, expand = requested_fields(request.query_params)
+    products = ProductListSerializer.optimize_queryset(Product.objects.filter(active=True), fields, expand)
+
+    related = list(
+        products.filter(
+            recommended_for__product_id=product_id,
+        ).order_by('recommended_for__rank')[:3]
+    )
+
+    if not related:
+        try:
+            product = Product.objects.filter(active=True).get(id=product_id)
+        except Product.DoesNotExist:
+            return Response(
+                {'error': 'Product not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        # Not built yet: fall back to other products from the same category
+        related = products.filter(
+            category_id=product.category_id
+        ).exclude(id=product_id).order_by('name')[:3]
+
+    serializer = ProductListSerializer(
+        related, many=True, fields=fields, expand=expand, context={'request': request}
+    )
     return Response(serializer.data)
 
+@condition_on_version('products')
 @api_view(['GET'])
 def product_search(request):
     """
@@ -139,20 +251,110 @@ def product_search(request):
     query = request.GET.get('q', '')
     category = request.GET.get('category', '')
     
-    products = Product.objects.filter(active=True).select_related('category').prefetch_related('images')
-    
-    if query:
-        products = products.filter(
-            Q(name__icontains=query) | 
-            Q(description__icontains=query) |
-            Q(tags__icontains=query)
-        )
+    fields, expand = requested_fields(request.query_params)
+    products = ProductListSerializer.optimize_queryset(Product.objects.filter(active=True), fields, expand)
     
     if category and category != 'all':
         products = products.filter(category__name=category)
     
-    serializer = ProductListSerializer(products, many=True, context={'request': request})
-    return Response(serializer.data)
+    fuzzy = False
+    if query:
+        # Ranked by BM25 relevance, best match first
+        data = ProductListSerializer(
+            ProductSearchIndex.search(products, query), many=True, fields=fields, expand=expand,
+            context={'request': request}
+        ).data
+        if not data:
+            # Nothing matches exactly; try words resembling the query's,
+            # for mistyped model codes and names
+            data = ProductListSerializer(
+                FuzzySearch.search(products, query), many=True, fields=fields, expand=expand,
+                context={'request': request}
+            ).data
+            fuzzy = bool(data)
+    else:
+        data = ProductListSerializer(
+            products, many=True, fields=fields, expand=expand, context={'request': request}
+        ).data
+    
+    response = Response(data)
+    if fuzzy:
+        response['X-Search-Mode'] = 'fuzzy'
+    return response
+
+# Most products product_batch returns per request
+BATCH_LIMIT = 100
+
+@condition_on_version('products')
+@api_view(['GET', 'POST'])
+def product_batch(request):
+    """
+    Several products by id in one request, for the cart and comparison
+    pages: ``GET ?ids=<uuid>,<uuid>&fields=id,name,price`` or ``POST
+    {"ids": [...], "fields": [...], "expand": [...]}``. Products come back
+    in the order asked for, using two queries whatever their number (one
+    without the ``primary_image`` field); ids of unknown or inactive
+    products are listed under ``missing``.
+    """
+    params = request.data if request.method == 'POST' else request.query_params
+    if not hasattr(params, 'get'):
+        return Response({'error': 'Expected an object with "ids"'}, status=status.HTTP_400_BAD_REQUEST)
+    # ?ids=a,b and ?ids=a&ids=b, or a JSON list
+    raw_ids = params.getlist('ids') if hasattr(params, 'getlist') else params.get('ids') or []
+    if isinstance(raw_ids, str):
+        raw_ids = [raw_ids]
+    try:
+        values = [value.strip() for item in raw_ids for value in str(item).split(',') if value.strip()]
+        ids = list(dict.fromkeys(uuid.UUID(value) for value in values))
+    except ValueError:
+        return Response({'error': 'ids must be product UUIDs'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(ids) > BATCH_LIMIT:
+        return Response(
+            {'error': f'At most {BATCH_LIMIT} products can be fetched at once'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    fields, expand = requested_fields(params)
+
+    products = ProductListSerializer.optimize_queryset(Product.objects.filter(active=True, pk__in=ids), fields, expand)
+    found = {product.pk: product for product in products} if ids else {}
+
+    serializer = ProductListSerializer(
+        [found[pk] for pk in ids if pk in found], many=True, fields=fields, expand=expand,
+        context={'request': request}
+    )
+    return Response({
+        'results': serializer.data,
+        'missing': [str(pk) for pk in ids if pk not in found],
+    })
+
+@api_view(['GET'])
+def product_suggest(request):
+    """
+    Search-as-you-type suggestions for ``?q=`` from this worker's prefix
+    index (see products.suggest). ``Server-Timing`` reports the lookup.
+    """
+    query = request.GET.get('q', '')
+    try:
+        limit = max(int(request.GET.get('limit', SUGGEST_LIMIT)), 1)
+    except ValueError:
+        limit = SUGGEST_LIMIT
+
+    index = SuggestIndex.current()
+    started = time.perf_counter()
+    suggestions = [suggestion.as_dict() for suggestion in index.suggest(query, limit)]
+    elapsed = (time.perf_counter() - started) * 1000
+
+    response = Response({'query': query, 'suggestions': suggestions})
+    response['Server-Timing'] = f'suggest;dur={elapsed:.3f}'
+    return response
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def catalog_snapshot_stats(request):
+    """
+    Size and reload counters of this worker's catalog snapshot
+    """
+    return Response(CatalogSnapshot.current().stats())
 
 @api_view(['POST'])
 def upload_product_image(request, product_id):
@@ -337,50 +539,33 @@ class ProductImageView(APIView):
     """
     Serve individual product images with caching headers
     """
+    content_negotiation_class = IgnoreClientContentNegotiation
+
     def get(self, request, product_id, image_id):
-        from django.http import HttpResponse
-        from django.utils.http import http_date
-        from django.utils import timezone
-        from datetime import timedelta
-        import hashlib
-        
-        try:
-            product_image = ProductImage.objects.get(
-                id=image_id,
-                product_id=product_id
-            )
-        except ProductImage.DoesNotExist:
-            return Response({'error': 'Image not found'}, status=404)
-        
-        if not product_image.image_data:
-            return Response({'error': 'No image data'}, status=404)
-        
-        # Generate ETag based on metadata only (never touch image_data)
-        etag_data = f"{product_image.id}-{product_image.created_at.isoformat()}"
-        etag = hashlib.md5(etag_data.encode()).hexdigest()
-        
-        # Check if client has cached version
-        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
-        if if_none_match == f'"{etag}"':
-            response = HttpResponse(status=304)
-            response['ETag'] = f'"{etag}"'
-            return response
-        
-        # Create response with image data
-        response = HttpResponse(
-            product_image.image_data,
-            content_type=product_image.content_type or 'image/jpeg'
+        image = product_image_server.get_metadata(
+            ProductImage.objects.all(), id=image_id, product_id=product_id
         )
-        
-        # Add caching headers
-        max_age = 86400  # 24 hours
-        expires = timezone.now() + timedelta(seconds=max_age)
-        
-        response['Cache-Control'] = f'public, max-age={max_age}, immutable'
-        response['ETag'] = f'"{etag}"'
-        response['Expires'] = http_date(expires.timestamp())
-        response['Last-Modified'] = http_date(product_image.created_at.timestamp())
-        
-        return response
+        if image is None:
+            return Response({'error': 'Image not found'}, status=404)
+        return product_image_server.respond(request, image) or Response({'error': 'No image data'}, status=404)
 
 
+class ProductAttachmentView(APIView):
+    """
+    Stream a product attachment, with Range/If-Range support so large files
+    can be resumed. Attachments that are not public are only served to
+    staff.
+    """
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request, product_id, attachment_id):
+        attachments = ProductAttachment.objects.filter(product_id=product_id)
+        if not request.user.is_staff:
+            attachments = attachments.filter(is_public=True)
+
+        attachment = product_attachment_server.get_metadata(attachments, id=attachment_id)
+        if attachment is None:
+            return Response({'error': 'Attachment not found'}, status=404)
+        return product_attachment_server.respond(request, attachment) or Response(
+            {'error': 'No file data'}, status=404
+        )
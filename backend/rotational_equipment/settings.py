@@ -74,6 +74,7 @@ INSTALLED_APPS = [
     'company',
     'analytics',
     'galleries',
+    'core',
 ]
 
 MIDDLEWARE = [
@@ -181,11 +182,77 @@ DATA_UPLOAD_MAX_NUMBER_FIELDS = 1000  # Max form fields
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Caches
+# Response entries are kept apart from the rate-limit and IP lookup keys in
+# 'default' so they cannot evict each other.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'responses',
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+
+# Versioned response cache for public catalog endpoints (see core.caching).
+# Entries are invalidated by content version bumps; the timeout only bounds
+# how long data changed outside the ORM can stay cached.
+RESPONSE_CACHE_ALIAS = 'responses'
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', '3600'))
+RESPONSE_CACHE_STALE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_STALE_TIMEOUT', '300'))
+
+# Content-addressed store for uploaded images and attachments (see
+# core.storage). Kept next to the database so both live on the same volume.
+BLOB_STORE = {
+    'BACKEND': 'core.storage.FileSystemBlobStore',
+    'OPTIONS': {
+        'location': os.environ.get('BLOB_STORE_LOCATION', str(DATABASE_PATH.parent / 'blobs')),
+    },
+}
+
+# Resized/re-encoded images (see core.images). Derivatives are keyed by the
+# source digest and can always be re-rendered, so this is a plain LRU cache.
+IMAGE_DERIVATIVE_CACHE = {
+    'location': os.environ.get('IMAGE_DERIVATIVE_CACHE_LOCATION', str(DATABASE_PATH.parent / 'derivatives')),
+    'max_size': int(os.environ.get('IMAGE_DERIVATIVE_CACHE_MAX_SIZE', str(1024 ** 3))),
+}
+
+# Internal nginx location aliased to the blob store directory. When set,
+# blob responses hand the body off with X-Accel-Redirect (see core.blobs);
+# only useful when nginx can read the store, i.e. runs on the same host.
+BLOB_ACCEL_REDIRECT_PREFIX = os.environ.get('BLOB_ACCEL_REDIRECT_PREFIX') or None
+
+# Minimum trigram similarity (0-1) of a word for the typo-tolerant search
+# fallback (see products.fuzzy). Lower finds more, and looser, matches.
+PRODUCT_FUZZY_SEARCH_THRESHOLD = float(os.environ.get('PRODUCT_FUZZY_SEARCH_THRESHOLD', '0.3'))
+
+# Seconds an unpaid order holds its stock (see orders.reservations). Run
+# release_expired_reservations periodically to return abandoned holds.
+STOCK_RESERVATION_TTL = int(os.environ.get('STOCK_RESERVATION_TTL', '1800'))
+
+# Points the blob store and derivative cache at temporary directories
+# while tests run
+TEST_RUNNER = 'core.testing.TestRunner'
+
 # REST Framework configuration
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
+    # orjson for JSON in and out; MessagePack for clients that ask for it
+    # with Accept: application/msgpack (see core.renderers)
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'core.renderers.MessagePackRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'core.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 15
 }
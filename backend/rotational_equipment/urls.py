@@ -41,4 +41,5 @@ urlpatterns = [
     path('api/company/', include('company.urls')),
     path('api/analytics/', include('analytics.urls')),
     path('api/galleries/', include('galleries.urls')),
+    path('api/', include('core.urls')),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
@@ -94,7 +94,11 @@ export interface Category {
 
 export interface ProductImage {
   id: number;
+  // Image endpoint URL at ?size=detail, fingerprinted with &v=<content hash> so it can be cached for good
+  // (a base64 data: URL only when requested with ?inline_media=true)
   image_url: string;
+  // Every size of the image, for an <img srcset>; null with ?inline_media=true
+  image_srcset?: string | null;
   filename: string;
   content_type: string;
   alt_text: string;
@@ -121,6 +125,7 @@ export interface ProductAttachment {
   is_image: boolean;
   is_pdf: boolean;
   is_document: boolean;
+  // Download endpoint URL (a base64 data: URL only when requested with ?inline_media=true)
   data_url: string;
   created_at: string;
   updated_at: string;
@@ -188,6 +193,31 @@ export interface Product {
   updated_at?: string;
 }
 
+// Numeric specification facet (?facets=1 on the product list); min/max in `unit`
+export interface SpecFacet {
+  key: string;
+  name: string;
+  unit: string;
+  count: number;
+  min: number;
+  max: number;
+}
+
+// Tag with the number of matching products (/products/tags/)
+export interface TagFacet {
+  slug: string;
+  name: string;
+  count: number;
+}
+
+// Search-as-you-type suggestion (/products/suggest/)
+export interface Suggestion {
+  text: string;
+  type: 'query' | 'category' | 'manufacturer' | 'tag' | 'product';
+  // Product UUID, category or manufacturer id, tag slug; null for queries
+  id: string | number | null;
+}
+
 export interface OrderItem {
   product_id: string;
   quantity: number;
@@ -252,6 +282,7 @@ export interface GalleryImage {
   title: string;
   description: string;
   image_url: string;
+  image_srcset?: string;
   filename: string;
   content_type: string;
   alt_text: string;
@@ -291,13 +322,63 @@ export const apiService = {
     category_name?: string;
     ordering?: string;
     page?: number;
-  }): Promise<{ results: Product[]; count: number; next: string | null; previous: string | null }> => {
+    // Comma-separated tag names or slugs; products must carry all of them
+    tags?: string;
+    facets?: boolean;
+    // Sparse fieldsets: comma-separated fields to return, and the relations
+    // to nest ('' leaves category as its id); see getProduct
+    fields?: string;
+    expand?: string;
+    // Range filters on specifications: spec_<key>_min / spec_<key>_max, e.g. spec_flow_rate_min
+    [specBound: `spec_${string}_${'min' | 'max'}`]: string | number | undefined;
+  }): Promise<{ results: Product[]; count: number; next: string | null; previous: string | null; facets?: SpecFacet[] }> => {
     const response = await api.get('/products/', { params });
     return response.data;
   },
 
-  getProduct: async (id: string): Promise<Product> => {
-    const response = await api.get(`/products/${id}/`);
+  // Tag counts for the products matching the same filters as getProducts
+  getTagFacets: async (params?: {
+    search?: string;
+    category?: string;
+    category_name?: string;
+    tags?: string;
+    limit?: number;
+  }): Promise<TagFacet[]> => {
+    const response = await api.get('/products/tags/', { params });
+    return response.data;
+  },
+
+  // Served from an in-memory index; cheap enough to call on every keystroke
+  getSuggestions: async (q: string, limit?: number): Promise<Suggestion[]> => {
+    const response = await api.get('/products/suggest/', { params: { q, limit } });
+    return response.data.suggestions;
+  },
+
+  // Up to 100 products by id in one request, in the order given. `fields`
+  // narrows each product to the listed keys, e.g. for the cart:
+  // ['id', 'name', 'price', 'quantity', 'is_available', 'primary_image']
+  getProductsBatch: async (
+    ids: string[],
+    fields?: (keyof Product)[],
+    expand?: 'category'[]
+  ): Promise<{ results: Partial<Product>[]; missing: string[] }> => {
+    const response = await api.post('/products/batch/', { ids, fields, expand });
+    return response.data;
+  },
+
+  // `fields` limits the response to those keys; `expand` lists the relations
+  // (category, images, specifications, attachments) to include. Relations not
+  // expanded are never queried: category comes back as its id, the others
+  // are left out. Both default to everything.
+  getProduct: async (
+    id: string,
+    options?: { fields?: (keyof Product)[]; expand?: ('category' | 'images' | 'specifications' | 'attachments')[] }
+  ): Promise<Product> => {
+    const params = {
+      fields: options?.fields?.join(','),
+      expand: options?.expand?.join(','),
+    };
+    const response = await api.get(`/products/${id}/`, { params });
     return response.data;
   },
 
@@ -311,6 +392,8 @@ export const apiService = {
     return response.data;
   },
 
+  // When nothing matches exactly, the server returns products with similar
+  // words instead and sets the X-Search-Mode: fuzzy response header
   searchProducts: async (query: string, category?: string): Promise<Product[]> => {
     const response = await api.get('/products/search/', {
       params: { q: query, category }